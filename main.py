@@ -1,1325 +1,4292 @@
-import os
-import re
-import shutil
-import sys
-import configparser
-from pathlib import Path
-from qbittorrentapi import Client, LoginFailed
-
-if sys.platform == 'win32':
-    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
-
-CONFIG = {
-    'VIDEO_EXTS': ('.mkv', '.mp4', '.avi', '.mov', '.flv', '.wmv'),
-    'SUBS_EXTS': ('.ass', '.srt', '.ssa', '.sub', '.idx'),
-    'CONFIG_FILE': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qb_renamer_config.ini'),
-    'DEFAULT_EPISODE_REGEXES': [
-        r"\[(\d{2})\][^\\/]*$",
-        r"\b(\d{2})\b",
-        r"E(\d{2})",
-        r"第(\d{2})话",
-        r"EP?(\d{2})",
-        r"- (\d{2}) -",
-        r"_(\d{2})_",
-        r" (\d{2}) "
-    ],
-    'DEFAULT_MAX_DIR_DEPTH': '1'
-}
-
-class QBitRenamer:
-    def __init__(self, debug=None):
-        self.debug = False
-        self._init_console_encoding()
-        self.config = configparser.ConfigParser()
-        self._init_config()
-        self.load_config()
-        
-        if not self._check_first_run():
-            self.setup_credentials()
-        
-        self.debug = debug if debug is not None else self.config.getboolean('SETTINGS', 'debug_mode', fallback=False)
-        self._print_debug("🛠️ 初始化完成", force=True)
-        self.client = None
-        self.episode_regexes = self._init_episode_regexes()
-        self.lang_map = self._init_lang_map()
-        
-    def _init_episode_regexes(self):
-        """初始化集数正则表达式列表（带有效性验证）"""
-        default_regexes = [
-            r"S\d+E(\d+)",                  # 匹配 S01E01 格式
-            r"\[\s*(\d{2})\s*\]",            # 匹配 [01] 格式
-            r"\bEP?\s*(\d{2})\b",            # 匹配 EP01 或 E01
-            r"第\s*(\d{2})\s*[话集]",        # 匹配 第01话
-            r"\s(\d{2})(?=\D*\.mkv)",        # 匹配空格后的两位数字（在扩展名前）
-            r"_(\d{2})_",                    # 匹配 _01_
-            r"- (\d{2}) -"                   # 匹配 - 01 -
-        ]
-        if self.config.has_option('SETTINGS', 'episode_regexes'):
-            raw = self.config.get('SETTINGS', 'episode_regexes')
-            regexes = []
-            for idx, pattern in enumerate(raw.split('\n'), 1):
-                pattern = pattern.strip()
-                if not pattern:
-                    continue
-                try:
-                    re.compile(pattern)
-                    regexes.append(pattern)
-                except re.error as e:
-                    print(f"⚠️ 忽略无效正则表达式 #{idx}: {pattern} ({e})")
-            if regexes:
-                return regexes
-        return CONFIG['DEFAULT_EPISODE_REGEXES']
-
-    def _check_first_run(self):
-        required_keys = ['host', 'username', 'password']
-        for key in required_keys:
-            if not self.config['QBITTORRENT'].get(key):
-                print("\n🔐 首次使用需要设置qBittorrent WebUI凭据")
-                return False
-        return True
-
-    def _init_console_encoding(self):
-        try:
-            if sys.platform == 'win32':
-                import _locale
-                _locale._gdl_bak = _locale._getdefaultlocale
-                _locale._getdefaultlocale = lambda *args: ('en_US', 'utf-8')
-            sys.stdout.reconfigure(encoding='utf-8', errors='replace')
-        except Exception as e:
-            print(f"⚠️ 无法设置控制台编码: {e}")
-
-    def _init_config(self):
-        self.config['QBITTORRENT'] = {
-            ';host': 'qBittorrent WebUI访问地址',
-            'host': 'localhost:8080',
-            ';username': 'WebUI登录用户名',
-            'username': 'admin',
-            ';password': 'WebUI登录密码',
-            'password': 'adminadmin',
-            ';default_tag': '默认处理的种子标签',
-            'default_tag': 'anime',
-            ';processed_tag': '处理完成的种子标签',
-            'processed_tag': 'processed'
-        }
-        self.config['SETTINGS'] = {
-            ';default_mode': '操作模式: direct(直接重命名) | copy(复制) | move(移动) | pre(试运行)',
-            'default_mode': 'direct',
-            ';workspace': '文件输出目录 (仅copy/move模式需要)',
-            'workspace': str(Path.home() / 'Anime_Renamed'),
-            ';auto_tag_processed': '处理后自动添加processed标签 (true/false)',
-            'auto_tag_processed': 'true',
-            ';skip_processed': '跳过已处理标签的种子 (true/false)',
-            'skip_processed': 'true',
-            ';dry_run_first': '首次运行默认试运行模式 (true/false)',
-            'dry_run_first': 'true',
-            ';debug_mode': '显示详细调试信息 (true/false)',
-            'debug_mode': 'false',
-            ';episode_regexes': '集数匹配正则表达式列表（每行一个，按顺序尝试）',
-            'episode_regexes': '\n'.join([
-                r'\[(\d{2})\][^\\/]*$',
-                r'\b(\d{2})\b',
-                r'E(\d{2})',
-                r'第(\d{2})话',
-                r'EP?(\d{2})',
-                r'- (\d{2}) -',
-                r'_(\d{2})_',
-                r' (\d{2}) '
-            ]),
-            ';scan_subdirs': '扫描子目录中的文件 (true/false)',
-            'scan_subdirs': 'true',
-            ';subgroup_mode': '是否启用字幕组标记功能 (true/false)',
-            'subgroup_mode': 'false',
-            ';max_dir_depth': '最大子目录扫描深度 (默认为1)',
-            'max_dir_depth': CONFIG['DEFAULT_MAX_DIR_DEPTH'],
-            ';excluded_dirs': '要跳过的文件夹列表(逗号分隔,不区分大小写)',
-            'excluded_dirs': 'SPs,CDs,Scans'
-        }
-        self.config['NAMING'] = {
-            ';season_format': '季集格式 (可用变量: {season}-季号, {episode}-集号)',
-            'season_format': 'S{season}E{episode}',
-            ';video_prefix': '视频文件前缀标记',
-            'video_prefix': '[Video]',
-            ';sub_prefix': '字幕文件前缀标记', 
-            'sub_prefix': '[Subtitle]',
-            ';language_format': '语言标识格式 (可用变量: {lang})',
-            'language_format': '.{lang}',
-            ';custom_format': '文件名格式 (可用变量: {prefix} {season_ep} {custom} {lang} {ext})',
-            'custom_format': '{prefix} {season_ep}{custom}{lang}{ext}'
-        }
-        self.config['LANGUAGE'] = {
-            '; 语言检测规则说明': '格式: 匹配模式 = 语言标识',
-            '\\.chs&jap\\.': 'CHS&JP',
-            '\\.cht&jap\\.': 'CHT&JP',
-            '\\.jpsc\\.': 'JP&CHS', 
-            '\\.jptc\\.': 'JP&CHT',
-            '\\.sc\\.': 'CHS',
-            '\\.chs\\.': 'CHS',
-            '\\[简\\]': 'CHS',
-            '\\.tc\\.': 'CHT',
-            '\\.cht\\.': 'CHT',
-            '\\[繁\\]': 'CHT',
-            '\\.jap\\.': 'JP',
-            '\\.jp\\.': 'JP',
-            '\\.jpn\\.': 'JP',
-            '\\[日\\]': 'JP',
-            '\\.eng\\.': 'EN',
-            '\\.en\\.': 'EN',
-            '\\[英\\]': 'EN'
-        }
-
-    def load_config(self):
-        try:
-            if os.path.exists(CONFIG['CONFIG_FILE']):
-                self.config = configparser.ConfigParser(
-                    interpolation=None,
-                    allow_no_value=True,
-                    delimiters=('=',),
-                    inline_comment_prefixes=(';',)
-                )
-            
-                # 自定义读取器处理续行符
-                with open(CONFIG['CONFIG_FILE'], 'r', encoding='utf-8') as f:
-                    content = []
-                    continuation = False
-                    for line in f:
-                        line = line.rstrip('\n')
-                        if line.endswith('\\'):
-                            content.append(line.rstrip('\\').strip())
-                            continuation = True
-                        else:
-                            if continuation:
-                                content[-1] += ' ' + line.strip()
-                            else:
-                                content.append(line)
-                            continuation = False
-                    self.config.read_string('\n'.join(content))
-            
-                # 处理多行正则表达式
-                if self.config.has_option('SETTINGS', 'episode_regexes'):
-                    raw = self.config.get('SETTINGS', 'episode_regexes')
-                    self.config['SETTINGS']['episode_regexes'] = '\n'.join(
-                        [line.strip() for line in raw.splitlines() if line.strip()]
-                    )
-            else:
-                self._print_debug("🆕 创建默认配置", force=True)
-                self.save_config()
-        except Exception as e:
-            self._print_debug(f"❌ 配置读取错误: {e}", force=True)
-            self._backup_config()
-            self._init_config()
-
-    def _backup_config(self):
-        backup_path = CONFIG['CONFIG_FILE'] + '.bak'
-        try:
-            if os.path.exists(CONFIG['CONFIG_FILE']):
-                shutil.copyfile(CONFIG['CONFIG_FILE'], backup_path)
-                print(f"⚠️ 配置已损坏，已备份到: {backup_path}")
-        except Exception as e:
-            print(f"❌ 无法备份配置文件: {e}")
-
-    def save_config(self):
-        try:
-            with open(CONFIG['CONFIG_FILE'], 'w', encoding='utf-8') as f:
-                f.write("# 自动生成的配置文件\n")
-                f.write("# 以分号(;)开头的行是配置说明，程序会自动忽略\n\n")
-                for section in self.config.sections():
-                    f.write(f"[{section}]\n")
-                    for k, v in self.config[section].items():
-                        if k.startswith(';'):
-                            f.write(f"; {v}\n")
-                        else:
-                            # 修正正则表达式保存方式
-                            if section == 'SETTINGS' and k == 'episode_regexes':
-                                f.write(f"{k} = \n")
-                                for line in v.split('\n'):
-                                    f.write(f"    {line}\n")
-                            else:
-                                f.write(f"{k} = {v}\n")
-                    f.write("\n")
-                self._print_debug(f"💾 配置已保存到: {CONFIG['CONFIG_FILE']}")
-        except Exception as e:
-            print(f"❌ 配置保存失败: {e}")
-
-    def show_config(self):
-        print("\n📋 当前配置说明:")
-        section_helps = {
-            'QBITTORRENT': 'qBittorrent连接设置',
-            'SETTINGS': '程序行为设置',
-            'NAMING': '文件名格式设置',
-            'LANGUAGE': '语言检测规则'
-        }
-        for section in self.config.sections():
-            print(f"\n[{section}] {section_helps.get(section, '')}")
-            for key in [k for k in self.config[section] if not k.startswith(';')]:
-                value = self.config[section][key]
-                help_text = self.config[section].get(f';{key}', '')
-                print(f"  {key:20} = {value}")
-                if help_text:
-                    print(f"    {help_text}")
-        
-        # 特别显示排除目录设置
-        if 'SETTINGS' in self.config and 'excluded_dirs' in self.config['SETTINGS']:
-            print("\n🔍 当前排除目录设置:")
-            excluded = self.config['SETTINGS']['excluded_dirs'].split(',')
-            print(" , ".join([d.strip() for d in excluded if d.strip()]))
-
-    def _edit_section(self, section):
-        print(f"\n编辑 [{section}] 配置")
-        print("="*60)
-        
-        # 显示当前配置
-        for key in [k for k in self.config[section] if not k.startswith(';')]:
-            value = self.config[section][key]
-            help_text = self.config[section].get(f';{key}', '')
-            print(f"{key:20} = {value}")
-            if help_text:
-                print(f"  {help_text}")
-        
-        # 特殊处理SETTINGS节的排除目录
-        if section == 'SETTINGS':
-            print("\n🛑 排除目录设置")
-            print("-"*40)
-            current_excluded = self.config[section].get('excluded_dirs', 'SPs,CDs,Scans')
-            excluded_list = [d.strip() for d in current_excluded.split(',') if d.strip()]
-            print("当前排除的目录: " + ", ".join(excluded_list) if excluded_list else "无")
-            
-            while True:
-                action = input("\n操作: [a]添加 [d]删除 [c]清除 [s]设置新列表 [回车继续]: ").lower().strip()
-                if not action:
-                    break
-                    
-                if action == 'a':  # 添加
-                    to_add = input("输入要添加的目录名(多个用逗号分隔): ").strip()
-                    if to_add:
-                        current = set(excluded_list)
-                        current.update([d.strip() for d in to_add.split(',') if d.strip()])
-                        excluded_list = sorted(current)
-                        print("更新后列表:", ", ".join(excluded_list))
-                        
-                elif action == 'd':  # 删除
-                    if not excluded_list:
-                        print("⚠️ 当前没有可删除的目录")
-                        continue
-                    print("当前排除目录:", ", ".join(f"[{i}] {d}" for i, d in enumerate(excluded_list)))
-                    try:
-                        to_remove = input("输入要删除的编号或名称(多个用空格分隔): ").strip()
-                        if to_remove:
-                            indices = set()
-                            names = set()
-                            for item in to_remove.split():
-                                if item.isdigit():
-                                    idx = int(item)
-                                    if 0 <= idx < len(excluded_list):
-                                        indices.add(idx)
-                                else:
-                                    names.add(item.lower())
-                            
-                            # 保留不在删除列表中的项目
-                            new_list = [
-                                d for i, d in enumerate(excluded_list)
-                                if i not in indices and d.lower() not in names
-                            ]
-                            if len(new_list) != len(excluded_list):
-                                excluded_list = new_list
-                                print("更新后列表:", ", ".join(excluded_list) if excluded_list else "空")
-                    except Exception as e:
-                        print(f"⚠️ 输入错误: {e}")
-                        
-                elif action == 'c':  # 清除
-                    if input("确认清除所有排除目录? (y/n): ").lower() == 'y':
-                        excluded_list = []
-                        print("已清除所有排除目录")
-                        
-                elif action == 's':  # 设置新列表
-                    new_list = input("输入新的排除目录列表(逗号分隔): ").strip()
-                    if new_list:
-                        excluded_list = [d.strip() for d in new_list.split(',') if d.strip()]
-                        print("更新后列表:", ", ".join(excluded_list) if excluded_list else "空")
-                        
-            # 保存修改后的排除目录列表
-            if excluded_list:
-                self.config[section]['excluded_dirs'] = ", ".join(excluded_list)
-            else:
-                self.config[section]['excluded_dirs'] = ""
-        
-        # 语言表特殊编辑界面
-        if section == 'LANGUAGE':
-            print("\n🛠️ 语言表编辑模式 (输入格式: 模式 原内容=新内容)")
-            print("模式: replace(替换)/delete(删除)/add(添加)")
-            print("示例:")
-            print("  replace \\.chs\\.=CHS → 替换现有规则")
-            print("  delete \\.chs\\.=CHS → 删除规则")
-            print("  add \\.french\\.=FR → 添加新规则")
-            
-            while True:
-                try:
-                    edit_cmd = input("\n输入编辑命令 (留空结束): ").strip()
-                    if not edit_cmd:
-                        break
-                        
-                    parts = edit_cmd.split(maxsplit=1)
-                    if len(parts) < 2:
-                        print("⚠️ 格式错误，需要包含模式和内容")
-                        continue
-                        
-                    mode = parts[0].lower()
-                    content = parts[1]
-                    
-                    if mode not in ('replace', 'delete', 'add'):
-                        print("⚠️ 无效模式，请使用replace/delete/add")
-                        continue
-                        
-                    if '=' not in content:
-                        print("⚠️ 需要包含等号(=)分隔键值")
-                        continue
-                        
-                    key, value = content.split('=', 1)
-                    key = key.strip()
-                    value = value.strip()
-                    
-                    if mode == 'delete':
-                        if key not in self.config[section] or self.config[section][key] != value:
-                            print("⚠️ 规则不存在或不匹配")
-                            continue
-                            
-                        print(f"将删除: {key} = {value}")
-                        if input("确认删除? (y/n): ").lower() == 'y':
-                            del self.config[section][key]
-                            print("✅ 已删除")
-                            
-                    elif mode == 'add':
-                        if not (key.startswith('\\') or key.startswith('[')):
-                            print("⚠️ 键应以\\.或\\[开头")
-                            continue
-                            
-                        if key in self.config[section]:
-                            print("⚠️ 键已存在")
-                            continue
-                            
-                        print(f"将添加: {key} = {value}")
-                        if input("确认添加? (y/n): ").lower() == 'y':
-                            self.config[section][key] = value
-                            print("✅ 已添加")
-                            
-                    elif mode == 'replace':
-                        if key not in self.config[section]:
-                            print("⚠️ 原规则不存在")
-                            continue
-                            
-                        print(f"将替换: {key} = {self.config[section][key]} → {value}")
-                        if input("确认替换? (y/n): ").lower() == 'y':
-                            self.config[section][key] = value
-                            print("✅ 已替换")
-                            
-                except Exception as e:
-                    print(f"❌ 处理出错: {e}")
-                    if self.debug:
-                        import traceback
-                        traceback.print_exc()
-                    continue
-        
-        # 常规配置项编辑
-        while True:
-            key = input("\n输入要修改的键名 (留空结束编辑): ").strip()
-            if not key:
-                break
-                
-            if key not in self.config[section] or key.startswith(';'):
-                print("⚠️ 无效键名")
-                continue
-                
-            # 跳过已特殊处理的键
-            if (section == 'SETTINGS' and key == 'excluded_dirs') or \
-            (section == 'LANGUAGE' and not key.startswith(';')):
-                continue
-                
-            current_value = self.config[section][key]
-            
-            # 处理多行值（如正则表达式列表）
-            if key == 'episode_regexes' and section == 'SETTINGS':
-                print(f"\n当前 {key} 值 (多行):")
-                print("-"*40)
-                print(current_value)
-                print("-"*40)
-                print("输入新的正则表达式列表（每行一个，空行结束）:")
-                lines = []
-                while True:
-                    line = input(f"正则 {len(lines)+1}: ").strip()
-                    if not line:
-                        break
-                    try:
-                        re.compile(line)  # 验证正则表达式
-                        lines.append(line)
-                    except re.error as e:
-                        print(f"⚠️ 无效正则表达式: {e}")
-                        
-                if lines:
-                    new_value = '\n'.join(lines)
-                    print(f"\n新值预览:")
-                    print("-"*40)
-                    print(new_value)
-                    print("-"*40)
-                    if input("确认更新? (y/n): ").lower() == 'y':
-                        self.config[section][key] = new_value
-                        print("✅ 已更新")
-                continue
-                
-            # 处理布尔值
-            if current_value.lower() in ('true', 'false'):
-                new_value = input(f"切换 {key} 值 (当前: {current_value}) [y/n]: ").lower()
-                new_value = 'true' if new_value == 'y' else 'false'
-            else:
-                new_value = input(f"输入 {key} 的新值 (当前: {current_value}): ").strip()
-                
-            if new_value:
-                self.config[section][key] = new_value
-                print(f"✅ 已更新 {key} = {new_value}")
-        
-        save = input("\n是否保存更改? (y/n): ").lower() == 'y'
-        if save:
-            self.save_config()
-            print("✅ 配置已保存")
-        else:
-            print("⏹️ 更改已丢弃")
-
-    def edit_config(self):
-        print("\n⚙️ 配置编辑器")
-        print("="*60)
-        sections = list(self.config.sections())
-        for i, section in enumerate(sections, 1):
-            print(f"{i}. {section}")
-        while True:
-            try:
-                choice = input("\n选择要编辑的配置部分 (1-{}，q退出): ".format(len(sections)))
-                if choice.lower() == 'q':
-                    break
-                section_idx = int(choice) - 1
-                if 0 <= section_idx < len(sections):
-                    section = sections[section_idx]
-                    self._edit_section(section)
-                else:
-                    print("⚠️ 无效选择")
-            except ValueError:
-                print("⚠️ 请输入数字或q退出")
-
-    def _print_debug(self, message, force=False):
-        if self.debug or force:
-            print(f"🐛 [DEBUG] {message}")
-
-    def _confirm_continue(self, prompt):
-        if self.debug:
-            choice = input(f"{prompt} (y/n): ").lower()
-            return choice == 'y'
-        return True
-
-    def _init_lang_map(self):
-        """初始化语言映射表（修复大小写不敏感）"""
-        lang_map = {}
-        if 'LANGUAGE' in self.config:
-            for key, value in self.config['LANGUAGE'].items():
-                if not key.startswith(';'):
-                    # 将配置中的模式转换为忽略大小写的正则表达式
-                    pattern = key.replace('\\.', '.').replace('\\[', '[').replace('\\]', ']')
-                    lang_map[pattern] = value
-        return lang_map
-
-    def connect_qbittorrent(self):
-        self._print_debug("🔌 尝试连接qBittorrent")
-        if not self._confirm_continue("继续连接qBittorrent?"):
-            return False
-        if not self.config['QBITTORRENT']['username']:
-            self.setup_credentials()
-        try:
-            self.client = Client(
-                host=self.config['QBITTORRENT']['host'],
-                username=self.config['QBITTORRENT']['username'],
-                password=self.config['QBITTORRENT']['password']
-            )
-            self.client.auth_log_in()
-            self._print_debug("✅ 连接成功")
-            return True
-        except Exception as e:
-            print(f"❌ 连接失败: {e}")
-            return False
-
-    def setup_credentials(self):
-        """设置qBittorrent连接凭据"""
-        print("\n⚙️ 首次运行配置向导")
-        print("="*60)
-        
-        # 显示当前配置
-        print("\n📋 当前qBittorrent配置:")
-        print(f"🌐 WebUI地址: {self.config['QBITTORRENT'].get('host', '未设置')}")
-        print(f"👤 用户名: {self.config['QBITTORRENT'].get('username', '未设置')}")
-        print(f"🔑 密码: {'*' * len(self.config['QBITTORRENT'].get('password', '')) if self.config['QBITTORRENT'].get('password') else '未设置'}")
-        
-        # 获取用户输入
-        print("\n🛠️ 请输入以下信息:")
-        self.config['QBITTORRENT']['host'] = input("🌐 WebUI地址 (默认localhost:8080): ") or 'localhost:8080'
-        self.config['QBITTORRENT']['username'] = input("👤 用户名: ").strip()
-        self.config['QBITTORRENT']['password'] = input("🔑 密码: ").strip()
-        
-        # 保存配置
-        self.save_config()
-        print("\n✅ 配置已保存！")
-
-    def detect_language(self, filename):
-        """最终修正的语言检测方法"""
-        try:
-            filename = str(filename).lower()  # 统一转为小写
-            self._print_debug(f"🔍 检测语言 - 文件名: {filename}")
-
-            # 按优先级从高到低检查的语言规则
-            LANGUAGE_RULES = [
-                (r'\.chs&jap\.', 'CHS&JP'),
-                (r'\.cht&jap\.', 'CHT&JP'),
-                (r'\.jpsc\.', 'JP&CHS'),
-                (r'\.jptc\.', 'JP&CHT'),
-                (r'\.sc\.', 'CHS'),      # 必须放在.chs.前面
-                (r'\.chs\.', 'CHS'),     # 必须放在.cht.前面
-                (r'\[简\]', 'CHS'),
-                (r'\.tc\.', 'CHT'),      # 必须放在.cht.前面
-                (r'\.cht\.', 'CHT'),     # 必须放在.chs.后面
-                (r'\[繁\]', 'CHT'),
-                (r'\.jap\.', 'JP'),
-                (r'\.jp\.', 'JP'),
-                (r'\.jpn\.', 'JP'),
-                (r'\[日\]', 'JP'),
-                (r'\.eng\.', 'EN'),
-                (r'\.en\.', 'EN'),
-                (r'\[英\]', 'EN')
-            ]
-
-            for pattern, lang in LANGUAGE_RULES:
-                # 使用re.IGNORECASE确保大小写不敏感
-                if re.search(pattern, filename, re.IGNORECASE):
-                    self._print_debug(f"✅ 匹配成功: {pattern} → {lang}")
-                    return lang
-
-            self._print_debug("⚠️ 未匹配到任何语言规则")
-            return None
-        except Exception as e:
-            self._print_debug(f"❌ 语言检测出错: {e}")
-            return None
-        
-    def detect_episode(self, filename):
-        """使用配置的正则列表检测集号"""
-        for idx, pattern in enumerate(self.episode_regexes, 1):
-            try:
-                if match := re.search(pattern, filename, re.IGNORECASE):
-                    self._print_debug(f"✅ 正则 #{idx} 匹配成功: {pattern} → {match.group(1)}")
-                    return match.group(1)
-            except re.error as e:
-                self._print_debug(f"⚠️ 无效正则 #{idx}: {pattern} ({e})")
-        return None
-
-    def _sanitize_filename(self, filename):
-        illegal_chars = r'[\\/*?:"<>|]'
-        return re.sub(illegal_chars, '', filename)
-
-    def generate_new_name(self, file_path, prefix, season, custom_str, is_video, subgroup_tag=""):
-        try:
-            file_path = Path(file_path)
-            filename = file_path.name
-            self._print_debug(f"\n📝 开始处理文件: {filename}")
-
-            if not (episode := self.detect_episode(filename)):
-                self._print_debug("❌ 无法提取集号")
-                return None
-            
-            # 添加字幕组标记
-            if subgroup_tag:
-                prefix = f"[{subgroup_tag}] {prefix}"  # 添加方括号包裹
-
-            lang_str = ""
-            if not is_video:
-                if lang := self.detect_language(filename):
-                    lang_str = f".{lang}"
-                    self._print_debug(f"🔠 语言标签: {lang_str}")
-
-            season_str = str(season).zfill(2)
-            episode_str = str(episode).zfill(2)
-            
-            clean_custom = f".{self._sanitize_filename(custom_str)}" if custom_str else ""
-            
-            new_name = (
-                f"{prefix} "
-                f"S{season_str}E{episode_str}"
-                f"{clean_custom}"
-                f"{lang_str}"
-                f"{file_path.suffix}"
-            )
-
-            new_name = (
-                new_name.replace("..", ".")
-                .replace(" .", ".")
-                .replace(". ", ".")
-                .strip()
-            )
-
-            self._print_debug(f"✅ 最终文件名: {new_name}")
-            return new_name
-        except Exception as e:
-            self._print_debug(f"❌ 生成文件名出错: {e}")
-            return None
-
-    def select_mode(self):
-        modes = [
-            {'id': 'direct', 'name': '直接模式', 'desc': '直接通过qBittorrent API重命名文件', 'warning': '⚠️ 直接修改qBittorrent中的文件（高风险）', 'emoji': '⚡'},
-            {'id': 'copy', 'name': '复制模式', 'desc': '复制文件到工作目录并重命名', 'warning': '✅ 安全模式，不影响原文件', 'emoji': '📋'},
-            {'id': 'move', 'name': '移动模式', 'desc': '移动文件到工作目录并重命名', 'warning': '⚠️ 原文件将被移动到新位置', 'emoji': '🚚'},
-            {'id': 'pre', 'name': '试运行模式', 'desc': '仅预览重命名效果，不实际操作', 'warning': '✅ 安全模式，仅显示结果', 'emoji': '👀'}
-        ]
-        print("\n🔧 请选择操作模式:")
-        for i, mode in enumerate(modes, 1):
-            print(f"{i}. {mode['emoji']} {mode['name']}")
-            print(f"   {mode['desc']}")
-            print(f"   {mode['warning']}\n")
-        
-        default_mode = self.config['SETTINGS']['default_mode']
-        if self.config['SETTINGS'].getboolean('dry_run_first'):
-            default_mode = 'pre'
-        
-        while True:
-            choice = input(f"选择模式 (1-{len(modes)}, 默认 {default_mode}): ").strip().lower()
-            if not choice:
-                choice = default_mode
-                break
-            elif choice.isdigit() and 1 <= int(choice) <= len(modes):
-                choice = modes[int(choice)-1]['id']
-                break
-            elif choice in [m['id'] for m in modes]:
-                break
-            print("⚠️ 无效选择，请重新输入")
-        
-        self.config['SETTINGS']['default_mode'] = choice
-        self.save_config()
-        return choice
-
-    def _display_file_tree(self, files, max_depth=1):
-        """显示文件目录树结构（最终修正版）
-        
-        参数:
-            files: 文件列表，每个元素是包含'name'和'progress'的字典
-            max_depth: 最大显示深度
-        """
-        file_tree = {}
-        
-        # 收集所有唯一路径
-        path_items = set()
-        for f in files:
-            if f.get('progress', 0) >= 1:  # 只处理完成的文件
-                path = Path(f['name'])
-                parts = path.parts[:max_depth + 1]  # 限制深度
-                path_items.add(tuple(parts))  # 使用元组保证可哈希
-        
-        # 构建树形结构
-        for parts in sorted(path_items):
-            current_level = file_tree
-            for i, part in enumerate(parts):
-                if i == len(parts) - 1 and i >= max_depth:
-                    # 文件层级
-                    if 'files' not in current_level:
-                        current_level['files'] = []
-                    current_level['files'].append(part)
-                else:
-                    # 目录层级
-                    if part not in current_level:
-                        current_level[part] = {}
-                    current_level = current_level[part]
-        
-        def _print_tree(node, prefix='', is_last=True):
-            """递归打印树结构"""
-            # 打印目录
-            dirs = [(k, v) for k, v in node.items() if k != 'files']
-            for i, (name, child) in enumerate(dirs):
-                last = i == len(dirs) - 1 and 'files' not in node
-                print(f"{prefix}{'└── ' if last else '├── '}{name}")
-                _print_tree(child, f"{prefix}{'    ' if last else '│   '}", last)
-            
-            # 打印文件
-            if 'files' in node:
-                files = node['files']
-                for i, name in enumerate(files):
-                    print(f"{prefix}{'└── ' if i == len(files)-1 else '├── '}{name}")
-        
-        print(f"\n📂 文件目录结构预览 (最大深度: {max_depth}):")
-        print(".")  # 根目录
-        _print_tree(file_tree)
-
-    def _process_directory(self, base_path, current_path, files, mode, workspace, 
-                        prefix, season, custom_str, subgroup_tag, dir_depth=1):
-        """处理单个目录中的文件（跳过排除目录）"""
-        operations = []
-        file_tree = {}
-        
-        current_path = Path(current_path)
-        base_path = Path(base_path)
-        
-        # 获取排除目录列表
-        excluded_dirs = {d.strip().lower() for d in 
-                        self.config['SETTINGS'].get('excluded_dirs', 'SPs,CDs,Scans').split(',') 
-                        if d.strip()}
-        
-        # 检查当前目录是否在排除列表中
-        if current_path.name.lower() in excluded_dirs:
-            self._print_debug(f"⏭️ 跳过排除目录: {current_path}")
-            return operations, file_tree
-            
-        for file in files:
-            # 跳过未完成文件
-            if file.get('progress', 0) < 1:
-                continue
-                
-            file_path = Path(file['name'])
-            
-            # 精确匹配当前目录
-            try:
-                if file_path.parent != current_path:
-                    continue
-            except ValueError:
-                continue
-                
-            # 检查文件类型
-            ext = file_path.suffix.lower()
-            is_video = ext in CONFIG['VIDEO_EXTS']
-            is_sub = ext in CONFIG['SUBS_EXTS']
-            if not (is_video or is_sub):
-                continue
-                
-            # 生成新文件名
-            new_name = self.generate_new_name(
-                file_path, prefix, season, custom_str, is_video, subgroup_tag
-            )
-            if not new_name:
-                continue
-                
-            # 确定操作类型
-            if mode == 'copy':
-                dest = Path(workspace) / new_name
-                operations.append(('copy', str(file_path), str(dest)))
-            elif mode == 'move':
-                dest = Path(workspace) / new_name
-                operations.append(('move', str(file_path), str(dest)))
-            elif mode == 'direct':
-                dest = str(file_path.parent / new_name)
-                operations.append(('rename', str(file_path), dest))
-            else:  # preview
-                operations.append(('preview', str(file_path), str(file_path.parent / new_name)))
-            
-            # 记录文件信息
-            file_tree[file_path.name] = {
-                'type': 'video' if is_video else 'sub',
-                'new_name': new_name,
-                'original_path': str(file_path),
-                'subgroup': subgroup_tag
-            }
-        
-        return operations, file_tree
-
-    def process_torrents(self):
-        self._print_debug("🚀 开始处理种子")
-        if not self._confirm_continue("开始处理种子?"):
-            return
-
-        # 硬编码忽略的关键词列表（不区分大小写）
-        IGNORED_KEYWORDS = {'oad', 'ova', 'sp', 'special', 'ncop', 'nced', 'pv'}
-        
-        # 获取标签设置
-        default_tag = self.config['QBITTORRENT'].get('default_tag', '')
-        tag = input(f"\n🏷️ 要处理的标签 (默认 '{default_tag}', 留空退出): ").strip() or default_tag
-        if not tag:
-            self._print_debug("⏹️ 用户退出")
-            return
-        
-        # 初始化正则表达式
-        self.episode_regexes = self._init_episode_regexes()
-        self._print_debug(f"📌 使用正则模式列表: {self.episode_regexes}")
-
-        # 字幕组标记设置
-        subgroup_enabled = self.config.getboolean('SETTINGS', 'subgroup_mode', fallback=False)
-        subgroup_choice = input("\n是否启用字幕组标记? (y/n, 默认{}): ".format("是" if subgroup_enabled else "否")).lower()
-        subgroup_enabled = subgroup_choice in ('y', 'yes') if subgroup_choice else subgroup_enabled
-        self.config['SETTINGS']['subgroup_mode'] = 'true' if subgroup_enabled else 'false'
-
-        # 目录深度设置
-        try:
-            max_depth = int(self.config['SETTINGS'].get('max_dir_depth', CONFIG['DEFAULT_MAX_DIR_DEPTH']))
-        except (ValueError, KeyError):
-            max_depth = int(CONFIG['DEFAULT_MAX_DIR_DEPTH'])
-            self.config['SETTINGS']['max_dir_depth'] = str(max_depth)
-
-        if input(f"\n📂 当前最大目录扫描深度为 {max_depth}，是否修改？(y/n): ").lower() == 'y':
-            while True:
-                try:
-                    new_depth = int(input("请输入新的最大扫描深度 (1-5，推荐1-2): "))
-                    if 1 <= new_depth <= 5:
-                        max_depth = new_depth
-                        self.config['SETTINGS']['max_dir_depth'] = str(new_depth)
-                        self.save_config()
-                        print(f"✅ 已更新最大目录扫描深度为 {new_depth}")
-                        break
-                    print("⚠️ 请输入1-5之间的数字")
-                except ValueError:
-                    print("⚠️ 请输入有效的数字")
-
-        # 操作模式选择
-        mode = self.select_mode()
-        workspace = None
-
-        if mode in ('copy', 'move'):
-            while True:
-                workspace = input(f"📁 输入工作目录 (必须指定): ").strip()
-                if workspace:
-                    workspace = Path(workspace)
-                    try:
-                        workspace.mkdir(parents=True, exist_ok=True)
-                        break
-                    except Exception as e:
-                        print(f"❌ 无法创建工作目录: {e}")
-                        if input("是否重试? (y/n): ").lower() != 'y':
-                            return
-                else:
-                    print("⚠️ 工作目录不能为空")
-
-        # 获取排除目录设置
-        excluded_dirs = {d.strip().lower() for d in 
-                        self.config['SETTINGS'].get('excluded_dirs', 'SPs,CDs,Scans').split(',') 
-                        if d.strip()}
-        self._print_debug(f"🚫 排除目录列表: {excluded_dirs}")
-        self._print_debug(f"🚫 忽略文件关键词: {IGNORED_KEYWORDS}")
-
-        # 连接qBittorrent获取种子
-        self._print_debug(f"🔍 扫描标签: {tag}")
-        try:
-            torrents = self.client.torrents_info(tag=tag)
-        except Exception as e:
-            print(f"❌ 获取种子列表失败: {e}")
-            if hasattr(e, 'response'):
-                print(f"HTTP 错误详情: {e.response.text}")
-            return
-
-        # 跳过已处理种子
-        if self.config['SETTINGS'].getboolean('skip_processed'):
-            processed_tag = self.config['QBITTORRENT'].get('processed_tag', 'processed')
-            torrents = [t for t in torrents if processed_tag not in t.tags.split(',')]
-
-        if not torrents:
-            print("⚠️ 没有找到可处理的种子")
-            return
-
-        all_operations = []
-        for torrent in torrents:
-            print(f"\n🎬 发现种子: {torrent.name}")
-            print(f"📂 保存路径: {torrent.save_path}")
-        
-            try:
-                files = self.client.torrents_files(torrent.hash)
-                print(f"📦 文件数量: {len(files)}")
-                self._display_file_tree(files, max_depth)
-            except Exception as e:
-                print(f"⚠️ 无法获取文件列表: {e}")
-                if input("是否继续处理下一个种子? (y/n): ").lower() != 'y':
-                    break
-                continue
-        
-            if input("\n是否处理此种子? (y/n, 默认y): ").lower() not in ('', 'y', 'yes'):
-                continue
-            
-            # 收集所有需要处理的深层目录（depth > 0）
-            base_path = Path(files[0].name).parent if files else Path('.')
-            deep_dirs = {}
-            
-            # 扫描所有深层目录（depth > 0且不超过max_depth），排除特定文件夹
-            for f in files:
-                try:
-                    f_path = Path(f.name)
-                    current_depth = len(f_path.parts) - len(base_path.parts)
-                    if 1 <= current_depth <= max_depth:  # 只处理深度>0的目录
-                        dir_path = f_path.parent
-                        dir_name = dir_path.name.lower()
-                        
-                        # 检查是否在排除列表中
-                        if dir_name in excluded_dirs:
-                            self._print_debug(f"⏭️ 跳过排除目录: {dir_path}")
-                            continue
-                            
-                        if dir_path not in deep_dirs:
-                            deep_dirs[dir_path] = {
-                                'files': [],
-                                'needs_custom': False
-                            }
-                        deep_dirs[dir_path]['files'].append(f)
-                except Exception as e:
-                    self._print_debug(f"⚠️ 处理文件路径出错: {f.name} → {e}")
-                    continue
-
-            # 如果没有深层目录，检查是否有根目录文件需要处理
-            root_files = []
-            if not deep_dirs:
-                for f in files:
-                    try:
-                        f_path = Path(f.name)
-                        if len(f_path.parts) - len(base_path.parts) == 0:  # 根目录文件
-                            root_files.append(f)
-                    except Exception as e:
-                        self._print_debug(f"⚠️ 处理文件路径出错: {f.name} → {e}")
-                        continue
-
-            # 第一阶段：参数设置（仅当有深层目录时才跳过根目录设置）
-            current_subgroup = ""
-            if subgroup_enabled:
-                while True:
-                    current_subgroup = input(f"为此种子输入字幕组标记 (留空则不添加): ").strip()
-                    if not current_subgroup or (len(current_subgroup) <= 20 and not any(c in r'\/:*?"<>|' for c in current_subgroup)):
-                        break
-                    print("⚠️ 字幕组标记不能包含特殊字符且长度不超过20")
-
-            suggested_prefix = torrent.category or re.sub(r'[\[\]_]', ' ', torrent.name).strip()[:30]
-            while True:
-                prefix = input(f"📌 输入前缀 (建议: {suggested_prefix}, 留空使用建议): ").strip() or suggested_prefix
-                if len(prefix) <= 50:
-                    break
-                print("⚠️ 前缀长度不能超过50字符")
-
-            while True:
-                default_season = input(f"  输入默认季号 (默认01): ").strip().zfill(2) or '01'
-                if default_season.isdigit() and 1 <= int(default_season) <= 99:
-                    break
-                print("⚠️ 请输入01-99之间的数字")
-
-            custom_str = input("✍️ 自定义标识 (如WEB-DL, 可选): ").strip()[:20]
-
-            # 第二阶段：处理深层目录（完全独立设置，不继承任何参数）
-            processed_operations = []
-            if deep_dirs:
-                print("\n🔍 发现深层目录，将单独设置每个目录参数")
-                for dir_path in sorted(deep_dirs.keys(), key=lambda x: str(x)):
-                    print(f"\n📁 正在设置目录: {dir_path}")
-                    
-                    # 每个深层目录都单独设置参数
-                    dir_subgroup = current_subgroup
-                    if subgroup_enabled:
-                        while True:
-                            dir_subgroup = input(f"为此目录输入字幕组标记 (留空则不添加): ").strip()
-                            if not dir_subgroup or (len(dir_subgroup) <= 20 and not any(c in r'\/:*?"<>|' for c in dir_subgroup)):
-                                break
-                            print("⚠️ 字幕组标记不能包含特殊字符且长度不超过20")
-
-                    while True:
-                        dir_prefix = input(f"输入此前缀 (建议: {suggested_prefix}): ").strip() or suggested_prefix
-                        if len(dir_prefix) <= 50:
-                            break
-                        print("⚠️ 前缀长度不能超过50字符")
-
-                    while True:
-                        dir_season = input(f"输入此季号 (默认01): ").strip().zfill(2) or '01'
-                        if dir_season.isdigit() and 1 <= int(dir_season) <= 99:
-                            break
-                        print("⚠️ 请输入01-99之间的数字")
-
-                    dir_custom = input("✍️ 自定义标识 (如WEB-DL, 可选): ").strip()[:20]
-
-                    # 处理目录文件
-                    operations = []
-                    file_tree = {}
-                    
-                    for file in deep_dirs[dir_path]['files']:
-                        file_path = Path(file['name'])
-                        filename_lower = file_path.name.lower()
-                        
-                        # 检查是否包含忽略关键词
-                        if any(keyword in filename_lower for keyword in IGNORED_KEYWORDS):
-                            self._print_debug(f"⏭️ 跳过含忽略关键词的文件: {file_path.name}")
-                            continue
-                            
-                        # 检查文件类型
-                        ext = file_path.suffix.lower()
-                        is_video = ext in CONFIG['VIDEO_EXTS']
-                        is_sub = ext in CONFIG['SUBS_EXTS']
-                        if not (is_video or is_sub):
-                            continue
-                            
-                        # 生成新文件名
-                        new_name = self.generate_new_name(
-                            file_path, dir_prefix, dir_season, 
-                            dir_custom, is_video, dir_subgroup
-                        )
-                        if not new_name:
-                            continue
-                            
-                        # 确定操作类型
-                        if mode == 'copy':
-                            dest = Path(workspace) / new_name
-                            operations.append(('copy', str(file_path), str(dest)))
-                        elif mode == 'move':
-                            dest = Path(workspace) / new_name
-                            operations.append(('move', str(file_path), str(dest)))
-                        elif mode == 'direct':
-                            dest = str(file_path.parent / new_name)
-                            operations.append(('rename', str(file_path), dest))
-                        else:  # preview
-                            operations.append(('preview', str(file_path), str(file_path.parent / new_name)))
-                        
-                        # 记录文件信息
-                        file_tree[file_path.name] = {
-                            'type': 'video' if is_video else 'sub',
-                            'new_name': new_name,
-                            'original_path': str(file_path),
-                            'subgroup': dir_subgroup
-                        }
-                    
-                    if operations:
-                        print(f"\n🔍 目录 {dir_path} 重命名预览:")
-                        for filename, info in sorted(file_tree.items()):
-                            print(f"{'🎬' if info['type'] == 'video' else '📝'} {filename} → {info['new_name']}")
-                        
-                        if input("\n确认处理此目录? (y/n): ").lower() == 'y':
-                            processed_operations.extend(operations)
-            
-            # 第三阶段：处理根目录文件（仅当没有深层目录时）
-            elif root_files:
-                print("\n🔍 未发现深层目录，处理根目录文件")
-                operations = []
-                file_tree = {}
-                
-                for file in root_files:
-                    file_path = Path(file['name'])
-                    filename_lower = file_path.name.lower()
-                    
-                    # 检查是否包含忽略关键词
-                    if any(keyword in filename_lower for keyword in IGNORED_KEYWORDS):
-                        self._print_debug(f"⏭️ 跳过含忽略关键词的文件: {file_path.name}")
-                        continue
-                        
-                    # 检查文件类型
-                    ext = file_path.suffix.lower()
-                    is_video = ext in CONFIG['VIDEO_EXTS']
-                    is_sub = ext in CONFIG['SUBS_EXTS']
-                    if not (is_video or is_sub):
-                        continue
-                        
-                    # 生成新文件名
-                    new_name = self.generate_new_name(
-                        file_path, prefix, default_season, 
-                        custom_str, is_video, current_subgroup
-                    )
-                    if not new_name:
-                        continue
-                        
-                    # 确定操作类型
-                    if mode == 'copy':
-                        dest = Path(workspace) / new_name
-                        operations.append(('copy', str(file_path), str(dest)))
-                    elif mode == 'move':
-                        dest = Path(workspace) / new_name
-                        operations.append(('move', str(file_path), str(dest)))
-                    elif mode == 'direct':
-                        dest = str(file_path.parent / new_name)
-                        operations.append(('rename', str(file_path), dest))
-                    else:  # preview
-                        operations.append(('preview', str(file_path), str(file_path.parent / new_name)))
-                    
-                    # 记录文件信息
-                    file_tree[file_path.name] = {
-                        'type': 'video' if is_video else 'sub',
-                        'new_name': new_name,
-                        'original_path': str(file_path),
-                        'subgroup': current_subgroup
-                    }
-                
-                if operations:
-                    print(f"\n🔍 根目录重命名预览:")
-                    for filename, info in sorted(file_tree.items()):
-                        print(f"{'🎬' if info['type'] == 'video' else '📝'} {filename} → {info['new_name']}")
-                    
-                    if input("\n确认处理根目录文件? (y/n): ").lower() == 'y':
-                        processed_operations.extend(operations)
-
-            if processed_operations:
-                all_operations.append({
-                    'hash': torrent.hash,
-                    'name': torrent.name,
-                    'operations': processed_operations,
-                    'params': {
-                        'prefix': prefix,
-                        'season': default_season,
-                        'custom': custom_str,
-                        'subgroup': current_subgroup
-                    }
-                })
-
-        if not all_operations:
-            print("⚠️ 没有生成任何操作")
-            return
-        
-        self.show_full_preview(all_operations, mode, subgroup_enabled)
-
-        if mode != 'pre' and input("\n⚠️ 确认执行以上操作? (y/n): ").lower() == 'y':
-            total_success = 0
-            for torrent in all_operations:
-                print(f"\n🔄 处理: {torrent['name']}")
-                success = 0
-                
-                for op_type, src, dst in torrent['operations']:
-                    try:
-                        if op_type == 'copy':
-                            shutil.copy2(src, dst)
-                        elif op_type == 'move':
-                            shutil.move(src, dst)
-                        elif op_type == 'rename':
-                            self.client.torrents_rename_file(
-                                torrent_hash=torrent['hash'],
-                                old_path=src,
-                                new_path=Path(src).parent / Path(dst).name
-                            )
-                        success += 1
-                        self._print_debug(f"✅ 成功: {src} → {dst}")
-                    except Exception as e:
-                        print(f"❌ 操作失败 {src} → {e}")
-                        if self.debug:
-                            import traceback
-                            traceback.print_exc()
-                
-                if success > 0 and self.config['SETTINGS'].getboolean('auto_tag_processed'):
-                    old_tag = self.config['QBITTORRENT'].get('default_tag', '').strip()
-                    new_tag = self.config['QBITTORRENT'].get('processed_tag', 'processed').strip()
-                    
-                    try:
-                        current_tags = self.client.torrents_info(torrent_hashes=torrent['hash'])[0].tags.split(', ')
-                        
-                        if old_tag and old_tag in current_tags:
-                            self.client.torrents_remove_tags(torrent_hashes=torrent['hash'], tags=[old_tag])
-                        
-                        if new_tag not in current_tags:
-                            self.client.torrents_add_tags(torrent_hashes=torrent['hash'], tags=[new_tag])
-                            
-                        print(f"🏷️ 标签更新: 移除 {old_tag} → 添加 {new_tag}")
-                        
-                        updated = self.client.torrents_info(torrent_hashes=torrent['hash'])[0]
-                        print(f"🔍 当前标签: {updated.tags}")
-                        
-                    except Exception as e:
-                        print(f"⚠️ 标签更新失败: {str(e)}")
-                        if hasattr(e, 'response'):
-                            print(f"HTTP 错误详情: {e.response.text}")
-
-                total_success += success
-                print(f"✅ 完成: {success}/{len(torrent['operations'])}")
-
-            print(f"\n🎉 全部完成! 成功处理 {total_success} 个文件")
-        else:
-            print("⏹️ 操作已取消")
-        
-    def show_full_preview(self, all_operations, mode, subgroup_enabled=False):
-        mode_names = {
-            'direct': '⚡ 直接模式',
-            'copy': '📋 复制模式',
-            'move': '🚚 移动模式',
-            'pre': '👀 试运行模式'
-        }
-        
-        print(f"\n🔎 完整操作预览 ({mode_names.get(mode, mode)})")
-        print("="*80)
-        print(f"🔍 使用的集数匹配正则: {self.episode_regexes}")
-        if subgroup_enabled:
-            print(f"🔖 字幕组标记功能已启用")
-        print("="*80)
-        
-        total_stats = {
-            'torrents': len(all_operations),
-            'videos': 0,
-            'subs': 0,
-            'total': 0,
-            'dirs': 0
-        }
-        
-        for torrent in all_operations:
-            print(f"\n📌 种子: {torrent['name']}")
-            print(f"├─ 📂 路径: {torrent.get('path', '根目录')}")
-            # 修正参数访问路径
-            print(f"├─ 🔤 前缀: {torrent['params']['prefix']}")  # 正确访问方式
-            print(f"├─ 🏷️ 季号: S{torrent['params']['season']}")
-            if subgroup_enabled and torrent['params'].get('subgroup'):
-                print(f"├─ 🔖 字幕组: {torrent['params']['subgroup']}")
-            if torrent['params'].get('custom'):
-                print(f"├─ ✍️ 自定义标识: {torrent['params']['custom']}")
-            
-            stats = {'videos': 0, 'subs': 0}
-            for op in torrent['operations']:
-                ext = Path(op[1]).suffix.lower()
-                if ext in CONFIG['VIDEO_EXTS']:
-                    stats['videos'] += 1
-                elif ext in CONFIG['SUBS_EXTS']:
-                    stats['subs'] += 1
-            
-            total_stats['videos'] += stats['videos']
-            total_stats['subs'] += stats['subs']
-            total_stats['total'] += stats['videos'] + stats['subs']
-            total_stats['dirs'] += 1
-            
-            print(f"├─ 🎬 视频: {stats['videos']} | 📝 字幕: {stats['subs']} | 📦 总计: {stats['videos'] + stats['subs']}")
-            print(f"└─ 🔧 操作类型: {mode_names.get(mode, mode)}")
-
-        print("\n📊 全局统计:")
-        print(f"• 🏷️ 总种子数: {total_stats['torrents']}")
-        print(f"• 📂 总目录数: {total_stats['dirs']}")
-        print(f"• 🎬 总视频文件: {total_stats['videos']}")
-        print(f"• 📝 总字幕文件: {total_stats['subs']}")
-        print(f"• 📦 总文件数: {total_stats['total']}")
-        print("="*80)
-
-    def run(self):
-        print("\n🎬 qBittorrent文件整理工具 v12.8")
-        print(f"📝 配置文件: {CONFIG['CONFIG_FILE']}")
-        print("="*60)
-        
-        # 显示当前配置
-        print("\n📋 当前主要配置:")
-        print(f"🌐 WebUI地址: {self.config['QBITTORRENT'].get('host', '未设置')}")
-        print(f"👤 用户名: {self.config['QBITTORRENT'].get('username', '未设置')}")
-        print(f"🔑 密码: {'*' * len(self.config['QBITTORRENT'].get('password', '')) if self.config['QBITTORRENT'].get('password') else '未设置'}")
-        
-        config_action = input("\n是否查看/编辑当前配置? (v查看/e编辑/回车跳过): ").lower()
-        if config_action == 'v':
-            self.show_config()
-        elif config_action == 'e':
-            self.edit_config()
-        
-        if not self.connect_qbittorrent():
-            return
-            
-        try:
-            while True:
-                self.process_torrents()
-                if not self._confirm_continue("\n是否继续处理其他标签?"):
-                    break
-        except KeyboardInterrupt:
-            print("\n🛑 用户中断操作")
-        except Exception as e:
-            print(f"❌ 发生错误: {e}")
-            if self.debug:
-                import traceback
-                traceback.print_exc()
-        finally:
-            if self.client:
-                try:
-                    self.client.auth_log_out()
-                except:
-                    pass
-            print("\n✅ 程序退出")
-
-if __name__ == "__main__":
-    import argparse
-    parser = argparse.ArgumentParser(description='🎬 qBittorrent文件整理工具')
-    parser.add_argument('--debug', action='store_true', help='🐛 启用调试模式')
-    parser.add_argument('--config', help='📂 指定配置文件路径')
-    args = parser.parse_args()
-    
-    if args.config:
-        CONFIG['CONFIG_FILE'] = args.config
-    
-    try:
-        QBitRenamer(debug=args.debug).run()
-    except ImportError as e:
-        print(f"❌ 需要安装依赖: pip install qbittorrent-api\n{e}")
\ No newline at end of file
+import os
+import re
+import hashlib
+import json
+import mmap
+import shutil
+import sqlite3
+import string
+import sys
+import time
+import configparser
+import contextvars
+import fnmatch
+import gzip
+import logging
+import queue
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+try:
+    from qbittorrentapi import APIConnectionError, Client, HTTP5XXError, LoginFailed
+except ImportError:
+    # 只使用规划 API (Planner) 时不需要 qbittorrent-api，连接时再提示安装
+    Client = None
+    APIConnectionError = HTTP5XXError = LoginFailed = None
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+
+CONFIG = {
+    'VIDEO_EXTS': ('.mkv', '.mp4', '.avi', '.mov', '.flv', '.wmv'),
+    'SUBS_EXTS': ('.ass', '.srt', '.ssa', '.sub', '.idx'),
+    'CONFIG_FILE': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qb_renamer_config.ini'),
+    'DEFAULT_EPISODE_REGEXES': [
+        r"\[(\d{2})\][^\\/]*$",
+        r"\b(\d{2})\b",
+        r"E(\d{2})",
+        r"第(\d{2})话",
+        r"EP?(\d{2})",
+        r"- (\d{2}) -",
+        r"_(\d{2})_",
+        r" (\d{2}) "
+    ],
+    'DEFAULT_MAX_DIR_DEPTH': '1',
+    'DEFAULT_EXCLUDED_DIRS': 'SPs,CDs,Scans',
+    'DEFAULT_IGNORED_KEYWORDS': 'OAD,OVA,SP,Special,NCOP,NCED,PV',
+    'DEFAULT_SEASON_FORMAT': 'S{season}E{episode}',
+    'DEFAULT_LANGUAGE_FORMAT': '.{lang}',
+    'DEFAULT_CUSTOM_FORMAT': '{prefix} {season_ep}.{custom}{lang}{ext}',
+    'COPY_BUFFER_SIZE': 8 * 1024 * 1024,
+    'REGEX_PROBE_BUDGET': 0.05,          # 单次探测匹配超过此秒数即判定为灾难性回溯
+    'DEFAULT_REGEX_TIME_BUDGET_MS': '50',
+    'DIGEST_INDEX_FILE': '.qb_renamer_digests.json',
+    'API_CACHE_SIZE': 512
+}
+
+logger = logging.getLogger('qb_renamer')
+
+# 结构化日志上下文（种子哈希 / 阶段），由 JSON 日志记录自动附带
+_LOG_CONTEXT = contextvars.ContextVar('qb_renamer_log_context', default={})
+LOG_CONTEXT_FIELDS = ('phase', 'torrent', 'file')
+
+
+def set_log_context(**fields):
+    """更新当前日志上下文，值为 None 的字段被移除"""
+    context = {**_LOG_CONTEXT.get(), **fields}
+    _LOG_CONTEXT.set({k: v for k, v in context.items() if v is not None})
+
+
+class _LogContextFilter(logging.Filter):
+    """把日志上下文写入记录；通过 extra= 显式传入的字段优先"""
+
+    def filter(self, record):
+        context = _LOG_CONTEXT.get()
+        for key in LOG_CONTEXT_FIELDS:
+            if not hasattr(record, key):
+                setattr(record, key, context.get(key))
+        return True
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，含时间戳、级别、上下文字段与消息"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))
+                  + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+        }
+        for key in LOG_CONTEXT_FIELDS:
+            if (value := getattr(record, key, None)) is not None:
+                entry[key] = str(value)
+        entry['msg'] = record.getMessage().strip()
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(debug=False, json_path=''):
+    """配置日志：控制台输出调试信息，可选 JSON Lines 文件
+
+    调试关闭时日志级别为 INFO，logger.debug 在级别检查处即返回，不做任何格式化。
+    可重复调用，每次替换之前安装的处理器。
+    """
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    logger.propagate = False
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter('🐛 [%(levelname)s] %(message)s'))
+    logger.addHandler(console)
+
+    if json_path:
+        try:
+            sink = logging.FileHandler(json_path, encoding='utf-8')
+        except OSError as e:
+            print(f"⚠️ 无法打开日志文件 {json_path}: {e}")
+            return
+        sink.addFilter(_LogContextFilter())
+        sink.setFormatter(JsonLinesFormatter())
+        logger.addHandler(sink)
+
+
+# 发布文件名词法规则：单个正则的分支按优先级排列，finditer 一次线性扫描完成切词与分类
+RELEASE_TOKEN_RE = re.compile(r"""
+    (?P<open>[\[【(（])
+  | (?P<close>[\]】)）])
+  | (?P<nth_season>(?<![a-z0-9])(?P<nth_number>\d{1,2})(?:st|nd|rd|th)\s*Season(?![a-z0-9])
+      | 第\s*(?P<nth_cn>[〇零一二两三四五六七八九十\d]{1,3})\s*[季期部])
+  | (?P<sxe>(?<![a-z0-9])S(?P<sxe_season>\d{1,2})E(?P<sxe_episode>\d{1,3})(?:v(?P<sxe_version>\d))?(?![a-z0-9]))
+  | (?P<ep>(?<![a-z0-9])(?:EP?|第)\s*(?P<ep_episode>\d{1,3})(?:v(?P<ep_version>\d))?\s*[话話集]?(?![a-z0-9]))
+  | (?P<season>(?<![a-z0-9])(?:S|Season\s*)(?P<season_number>\d{1,2})(?![a-z0-9]))
+  | (?P<res>(?<![a-z0-9])(?:\d{3,4}[pi]|[48]k|\d{3,4}[x×]\d{3,4})(?![a-z0-9]))
+  | (?P<source>(?<![a-z0-9])(?:WEB-?DL|WEB-?Rip|BD-?Rip|Blu-?Ray|BDMV|BD|DVD-?Rip|DVD|HDTV|TV-?Rip|WEB|Baha|B-Global|CR|ABEMA|AMZN|NF)(?![a-z0-9]))
+  | (?P<lang>(?<=\.)(?:chs&jap|cht&jap|jpsc|jptc|chs|cht|sc|tc|jap|jpn|jp|eng|en)(?=\.|$)|(?<=\[)[简繁日英](?=\]))
+  | (?P<num>(?<![a-z0-9])(?P<num_value>\d{1,3})(?:v(?P<num_version>\d))?(?![a-z0-9]))
+  | (?P<version>(?<![a-z0-9])v(?P<version_number>\d)(?![a-z0-9]))
+  | (?P<word>[^\s\[\]【】()（）._\-]+)
+  | (?P<sep>[\s._\-]+)
+""", re.VERBOSE | re.IGNORECASE)
+
+# 只有装饰符号或新番/合集公告的文字（如 ★04月新番★），不作为标题
+RELEASE_ANNOUNCE_RE = re.compile(
+    r'^[\s★☆◆◇■□●○♪♥❤✿·]*(?:(?:\d{1,2}月|[春夏秋冬]季?|\d{4}年?\d{0,2}月?)?新番|合集|完结|连载|.*招募.*)?'
+    r'[\s★☆◆◇■□●○♪♥❤✿·]*$'
+)
+
+# 语言标记 → 语言标识
+RELEASE_LANG_TAGS = {
+    'chs&jap': 'CHS&JP', 'cht&jap': 'CHT&JP', 'jpsc': 'JP&CHS', 'jptc': 'JP&CHT',
+    'sc': 'CHS', 'chs': 'CHS', '简': 'CHS',
+    'tc': 'CHT', 'cht': 'CHT', '繁': 'CHT',
+    'jap': 'JP', 'jp': 'JP', 'jpn': 'JP', '日': 'JP',
+    'eng': 'EN', 'en': 'EN', '英': 'EN'
+}
+
+
+@dataclass
+class ReleaseInfo:
+    """发布文件名的结构化解析结果"""
+    groups: list = field(default_factory=list)      # 方括号内容（按出现顺序）
+    subgroup: str = ''                              # 开头 [字幕组]
+    title: str = ''
+    season: str = ''
+    episode: str = ''
+    version: str = ''
+    resolution: str = ''
+    source: str = ''
+    languages: list = field(default_factory=list)   # 语言标识（按出现顺序）
+
+
+def parse_release_name(name):
+    """单次扫描将发布文件名切分为括号组/标题/集号/版本/分辨率/来源/语言"""
+    info = ReleaseInfo()
+    depth = 0
+    group_start = 0
+    group_kinds = set()
+    group_num = ''
+    title_groups = []       # 仅含文字的括号组，作为括号内标题的候选
+    title_tokens = []       # 括号外标题部分的 (类型, match)
+    title_closed = False
+    episodes = []           # (可信度, 集号)
+    # 扩展名不参与切词（扫描在扩展名前结束，语言标记以 $ 视作右边界）
+    ext = os.path.splitext(name)[1]
+    end = len(name) - len(ext) if 1 < len(ext) <= 5 and ext[1:].isalnum() else len(name)
+
+    for m in RELEASE_TOKEN_RE.finditer(name, 0, end):
+        kind = m.lastgroup
+        if kind == 'open':
+            if depth == 0:
+                group_start, group_kinds, group_num = m.end(), set(), ''
+                if title_tokens and RELEASE_ANNOUNCE_RE.match(
+                        name[title_tokens[0][1].start():title_tokens[-1][1].end()]):
+                    title_tokens = []       # 括号间的公告/装饰文字不是标题
+                elif title_tokens:
+                    title_closed = True
+            depth += 1
+            continue
+        if kind == 'close':
+            if depth == 0:
+                continue
+            depth -= 1
+            if depth == 0:
+                content = name[group_start:m.start()].strip()
+                plain = 'word' in group_kinds and group_kinds <= {'word', 'sep', 'num'}
+                if plain and not info.groups and not name[:group_start - 1].strip():
+                    info.subgroup = content
+                elif plain and not RELEASE_ANNOUNCE_RE.match(content):
+                    title_groups.append(content)
+                elif group_kinds == {'num'}:
+                    episodes.append((2, group_num))
+                info.groups.append(content)
+            continue
+
+        if depth:
+            group_kinds.add(kind)
+        elif kind in ('word', 'num') and not title_closed:
+            title_tokens.append((kind, m))
+            continue
+        elif kind != 'sep' and title_tokens:
+            title_closed = True
+
+        if kind == 'sxe':
+            info.season = info.season or m.group('sxe_season')
+            episodes.append((3, m.group('sxe_episode')))
+            info.version = info.version or (m.group('sxe_version') or '')
+        elif kind == 'ep':
+            episodes.append((3, m.group('ep_episode')))
+            info.version = info.version or (m.group('ep_version') or '')
+        elif kind == 'season':
+            info.season = info.season or m.group('season_number')
+        elif kind == 'nth_season':
+            # 2nd Season / 第二季 只给出季号，其后的数字仍可作为集号
+            number = m.group('nth_number') or str(_chinese_number(m.group('nth_cn')))
+            info.season = info.season or number
+        elif kind == 'res':
+            info.resolution = info.resolution or m.group()
+        elif kind == 'source':
+            info.source = info.source or m.group()
+        elif kind == 'lang':
+            info.languages.append(RELEASE_LANG_TAGS[m.group().lower()])
+        elif kind == 'num':
+            info.version = info.version or (m.group('num_version') or '')
+            if depth:
+                group_num = m.group('num_value')
+            else:
+                episodes.append((2, m.group('num_value')))
+        elif kind == 'version':
+            info.version = info.version or m.group('version_number')
+
+    # 标题末尾的数字视为集号（" - 01" / "_01" / 两位补零数字，或整个标题只有数字）
+    if title_tokens and title_tokens[-1][0] == 'num':
+        last = title_tokens[-1][1]
+        gap = name[title_tokens[-2][1].end():last.start()] if len(title_tokens) > 1 else '-'
+        if '-' in gap or '_' in gap or len(last.group('num_value')) == 2:
+            title_tokens.pop()
+            episodes.append((2 if '-' in gap or '_' in gap else 1, last.group('num_value')))
+            info.version = info.version or (last.group('num_version') or '')
+
+    if title_tokens:
+        title = name[title_tokens[0][1].start():title_tokens[-1][1].end()]
+        info.title = title if ' ' in title else re.sub(r'[._]+', ' ', title)
+    elif title_groups:
+        # 标题位于括号内，如 [字幕组][标题][01]
+        info.title = title_groups[0]
+
+    if episodes:
+        info.episode = max(episodes, key=lambda e: e[0])[1]
+    return info
+
+
+# 目录名/种子名中的季号写法
+SEASON_PHRASE_RE = re.compile(r"""
+    第\s*(?P<cn>[〇零一二两三四五六七八九十\d]{1,3})\s*[季期部]
+  | (?<![a-z0-9])(?P<ordinal>\d{1,2})(?:st|nd|rd|th)\s*Season(?![a-z])
+  | (?<![a-z0-9])(?:Season|Saison|S)\s*(?P<number>\d{1,2})(?![a-z0-9])
+""", re.VERBOSE | re.IGNORECASE)
+# 标题末尾的罗马数字季号（II 起）：多字母写法直接跟在标题后（Overlord IV），
+# 单字母 V/X 易与标题本身混淆，只在 Season 或分隔符之后识别（Show Season V、Show - X）
+ROMAN_SEASON_RE = re.compile(
+    r'(?:(?:\s+Season|\s*[-:：])\s*(?P<marked>II|III|IV|V|VI|VII|VIII|IX|X)'
+    r'|\s+(?P<bare>II|III|IV|VI|VII|VIII|IX))$'
+)
+ROMAN_NUMERALS = {'II': 2, 'III': 3, 'IV': 4, 'V': 5, 'VI': 6, 'VII': 7, 'VIII': 8, 'IX': 9, 'X': 10}
+CHINESE_DIGITS = {'〇': 0, '零': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+# 不代表独立剧集的目录名（光盘/分卷/原盘结构/附属内容），推断时沿用种子标题
+NON_SERIES_DIR_RE = re.compile(
+    r'^(?:(?:Disc|Disk|DVD|BD|CD|Vol(?:ume)?)\s*[.#_-]?\s*\d*|BDMV|CERTIFICATE|STREAM|PLAYLIST|BACKUP'
+    r'|Menus?|Bonus|Featurettes?|Scans?|Covers?|Fonts?|Subs?|Subtitles?|Samples?|Others?|Misc|\d+)$',
+    re.IGNORECASE
+)
+# 特典目录归入第 0 季（Emby 的 Specials）
+SPECIALS_DIR_RE = re.compile(r'^(?:SPs?|Specials?|Extras?|Bonus|OVAs?|OADs?|特典|映像特典)$', re.IGNORECASE)
+
+
+def _chinese_number(text):
+    """一/二/十二/二十 等中文数字（也接受阿拉伯数字）"""
+    if text.isdigit():
+        return int(text)
+    if '十' in text:
+        tens, _, ones = text.partition('十')
+        return CHINESE_DIGITS.get(tens, 1) * 10 + CHINESE_DIGITS.get(ones, 0)
+    return CHINESE_DIGITS.get(text, 0)
+
+
+@dataclass
+class SeriesHint:
+    """从目录名/种子名推断的剧集信息"""
+    title: str = ''
+    season: str = ''        # 两位季号，无法推断时为空
+    subgroup: str = ''
+
+
+def infer_series(name):
+    """从目录名/种子名推断标题、季号与字幕组
+
+    识别 S02 / Season 2 / 第二季 / 2nd Season / 标题末尾的罗马数字，特典目录为第 0 季；
+    标题去掉季号写法，便于按剧集记忆。
+    """
+    release = parse_release_name(name)
+    season = int(release.season) if release.season else None
+    title = release.title
+    if not title:
+        # 标题与季号同在括号内，如 [字幕组][标题 第3季][01-12]
+        title = next((g for g in release.groups[1 if release.subgroup else 0:] if SEASON_PHRASE_RE.search(g)), '')
+    if season is None and (m := SEASON_PHRASE_RE.search(name)):
+        if m.group('cn'):
+            season = _chinese_number(m.group('cn'))
+        else:
+            season = int(m.group('ordinal') or m.group('number'))
+    title = SEASON_PHRASE_RE.sub(' ', title).strip(' -_.')
+    if m := ROMAN_SEASON_RE.search(title):
+        season = season if season is not None else ROMAN_NUMERALS[m.group('marked') or m.group('bare')]
+        title = title[:m.start()].strip(' -_.')
+    if SPECIALS_DIR_RE.match(name.strip()):
+        title = ''
+        season = 0 if season is None else season
+    return SeriesHint(
+        title=re.sub(r'\s{2,}', ' ', title),
+        season=f"{season:02d}" if season is not None and 0 <= season <= 99 else '',
+        subgroup=release.subgroup
+    )
+
+
+class SeriesMemory:
+    """按 (标准化标题, 分类, 字幕组) 记忆上次使用的命名参数（SQLite 主键索引查询）
+
+    连接可在多个线程间共享（服务模式下并发处理请求），访问由锁串行化。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS series ("
+            " title TEXT NOT NULL, category TEXT NOT NULL, subgroup TEXT NOT NULL,"
+            " prefix TEXT, season TEXT, custom TEXT, subgroup_tag TEXT, updated REAL,"
+            " PRIMARY KEY (title, category, subgroup)) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def normalize(text):
+        """标准化键：忽略大小写、空白与标点"""
+        return re.sub(r'[\W_]+', '', (text or '').casefold())
+
+    def lookup(self, title, category='', subgroup=''):
+        """精确匹配 (标题, 分类, 字幕组)，未命中时回退到同标题同分类最近一次的记录"""
+        key = (self.normalize(title), self.normalize(category), self.normalize(subgroup))
+        if not key[0]:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT prefix, season, custom, subgroup_tag FROM series"
+                " WHERE title = ? AND category = ? AND subgroup = ?", key
+            ).fetchone()
+            if row is None:
+                row = self.conn.execute(
+                    "SELECT prefix, season, custom, subgroup_tag FROM series"
+                    " WHERE title = ? AND category = ? ORDER BY updated DESC LIMIT 1", key[:2]
+                ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('prefix', 'season', 'custom', 'subgroup'), row))
+
+    def remember(self, title, category, subgroup, params):
+        """保存一组命名参数"""
+        key = (self.normalize(title), self.normalize(category), self.normalize(subgroup))
+        if not key[0]:
+            return
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                key + (params['prefix'], params['season'], params['custom'], params['subgroup'], time.time())
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class DigestIndex:
+    """工作目录中的校验值索引（sidecar JSON），记录每个输出文件的摘要与校验时间"""
+
+    def __init__(self, workspace, algorithm='blake2b'):
+        self.workspace = Path(workspace)
+        self.path = self.workspace / CONFIG['DIGEST_INDEX_FILE']
+        self.algorithm = algorithm
+        self.entries = {}
+        self.dirty = False
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ 校验索引读取失败，将重新建立: {e}")
+
+    def _key(self, path):
+        try:
+            return Path(path).resolve().relative_to(self.workspace.resolve()).as_posix()
+        except ValueError:
+            return str(Path(path).resolve())
+
+    def new_hash(self):
+        return hashlib.new(self.algorithm)
+
+    def record(self, path, digest):
+        st = os.stat(path)
+        self.entries[self._key(path)] = {
+            'algorithm': self.algorithm,
+            'digest': digest,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'verified': time.time()
+        }
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def reverify(self, limit=None):
+        """增量复查：按上次校验时间从旧到新复查最多 limit 个文件
+
+        返回: (已复查数, 不一致文件列表, 缺失文件列表)
+        """
+        checked, mismatched, missing = 0, [], []
+        for key, entry in sorted(self.entries.items(), key=lambda kv: kv[1].get('verified', 0)):
+            if limit is not None and checked >= limit:
+                break
+            path = self.workspace / key
+            if not path.exists():
+                missing.append(key)
+                continue
+            if hash_file(path, entry.get('algorithm', self.algorithm)) != entry['digest']:
+                mismatched.append(key)
+            else:
+                entry['verified'] = time.time()
+                self.dirty = True
+            checked += 1
+        return checked, mismatched, missing
+
+
+def hash_file(path, algorithm='blake2b'):
+    """通过 mmap 计算文件摘要（大文件由 hashlib 在释放 GIL 的情况下整块处理）"""
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        if hasattr(os, 'posix_fadvise'):
+            # 丢弃页缓存，确保读到的是磁盘上的实际数据
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                digest.update(mm)
+    return digest.hexdigest()
+
+
+def copy_with_digest(src, dst, digest):
+    """大缓冲区流式复制，复制的同时计算源文件摘要（不额外读取源文件）"""
+    buffer = bytearray(CONFIG['COPY_BUFFER_SIZE'])
+    view = memoryview(buffer)
+    copied = 0
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        while n := fsrc.readinto(buffer):
+            chunk = view[:n]
+            digest.update(chunk)
+            fdst.write(chunk)
+            copied += n
+        fdst.flush()
+        os.fsync(fdst.fileno())
+    shutil.copystat(src, dst)
+    return copied
+
+
+def fsync_file(path):
+    """把文件内容落盘"""
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+
+
+def fsync_dir(path):
+    """把目录中的新建/重命名落盘（Windows 不支持对目录 fsync，跳过）"""
+    if sys.platform == 'win32':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class MoveTransaction:
+    """单个种子的事务性移动：先把全部文件暂存到工作目录内的临时目录，全部成功后再提交
+
+    同设备的文件以重命名暂存（不复制数据），跨设备的文件复制到暂存区、提交完成后才删除源文件。
+    动作开始前整批意图写入落盘日志 (journal.json)，阶段切换时更新状态：
+      staging    → 崩溃后回滚（暂存文件放回原处）
+      committing → 崩溃后继续提交（所有文件已暂存完毕）
+      committed  → 只剩删除跨设备源文件与清理暂存目录
+    执行中任何失败都会自动回滚并重新抛出异常。
+
+    设备判断按源目录缓存，每个目录只 stat 一次。跨设备副本逐个 fsync；目录 fsync 按目录批量进行：
+    日志落盘后同步暂存目录一次，全部暂存后同步一次，提交后每个目标目录同步一次，之后才删除源文件。
+    """
+
+    STAGING_DIR = '.qb_renamer_staging'
+
+    def __init__(self, workspace, name, root=None, entries=None, state='staging'):
+        self.root = Path(root) if root else Path(workspace) / self.STAGING_DIR / f"{name}-{time.time_ns()}"
+        self.entries = entries if entries is not None else []
+        self.state = state
+
+    @property
+    def journal_path(self):
+        return self.root / 'journal.json'
+
+    def _write_journal(self, sync=True):
+        """写入日志；sync 时同步暂存目录，让日志与此前暂存的文件一起落盘"""
+        tmp_path = self.root / 'journal.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'state': self.state, 'entries': self.entries}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        if sync:
+            fsync_dir(self.root)
+
+    def _sync_targets(self):
+        """提交后每个目标目录同步一次（删除跨设备源文件之前）"""
+        for directory in {os.path.dirname(entry['dst']) or '.' for entry in self.entries}:
+            fsync_dir(directory)
+
+    def run(self, moves, copy_fn):
+        """moves: [(源, 目标)]；copy_fn(源, 暂存路径) 用于跨设备复制，返回摘要或 None
+
+        目标已存在或在本事务内重复（不区分大小写）时，整个事务在暂存任何文件之前被拒绝。
+        """
+        seen = set()
+        for _, dst in moves:
+            key = os.path.normcase(os.path.abspath(dst)).casefold()
+            if key in seen:
+                raise FileExistsError(f"同一事务内目标重复: {dst}")
+            seen.add(key)
+            if os.path.exists(dst):
+                raise FileExistsError(f"目标已存在: {dst}")
+        self.root.mkdir(parents=True)
+        try:
+            staging_dev = os.stat(self.root).st_dev
+            devices = {}    # 源目录 → 设备号
+            for idx, (src, dst) in enumerate(moves):
+                src_dir = os.path.dirname(str(src)) or '.'
+                if src_dir not in devices:
+                    devices[src_dir] = os.stat(src_dir).st_dev
+                self.entries.append({
+                    'src': str(src),
+                    'staged': str(self.root / f"{idx:04d}{Path(dst).suffix}"),
+                    'dst': str(dst),
+                    'method': 'rename' if devices[src_dir] == staging_dev else 'copy',
+                    'digest': None
+                })
+            self._write_journal()
+
+            for entry in self.entries:
+                if entry['method'] == 'rename':
+                    os.replace(entry['src'], entry['staged'])
+                else:
+                    entry['digest'] = copy_fn(entry['src'], entry['staged'])
+                    fsync_file(entry['staged'])
+            self.state = 'committing'
+            self._write_journal()
+            for entry in self.entries:
+                os.replace(entry['staged'], entry['dst'])
+            self._sync_targets()
+        except BaseException:
+            try:
+                self.rollback()
+            except Exception as e:
+                print(f"⚠️ 回滚失败，暂存目录保留以便下次恢复: {self.root} ({e})")
+            raise
+        self.state = 'committed'
+        self._write_journal(sync=False)
+        self._finish()
+
+    def rollback(self):
+        """撤销：已提交的文件退回暂存区，暂存文件放回源位置（跨设备副本直接删除）"""
+        for entry in reversed(self.entries):
+            staged, src, dst = entry['staged'], entry['src'], entry['dst']
+            if self.state == 'committing' and not os.path.exists(staged) and os.path.exists(dst):
+                os.replace(dst, staged)
+            if not os.path.exists(staged):
+                continue
+            if entry['method'] == 'rename' or not os.path.exists(src):
+                shutil.move(staged, src)
+            else:
+                os.remove(staged)
+        self._cleanup()
+
+    def _roll_forward(self):
+        """继续未完成的提交"""
+        for entry in self.entries:
+            if os.path.exists(entry['staged']):
+                os.replace(entry['staged'], entry['dst'])
+        self._sync_targets()
+        self.state = 'committed'
+        self._write_journal(sync=False)
+        self._finish()
+
+    def _finish(self):
+        """删除已提交的跨设备源文件并清理暂存目录"""
+        for entry in self.entries:
+            if entry['method'] == 'copy' and os.path.exists(entry['dst']) and os.path.exists(entry['src']):
+                os.remove(entry['src'])
+        self._cleanup()
+
+    def _cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        try:
+            self.root.parent.rmdir()  # 没有其他进行中的事务时一并移除暂存目录
+        except OSError:
+            pass
+
+    @classmethod
+    def recover(cls, workspace):
+        """处理上次中断遗留的事务，返回 [(事务名, 'rolled_back' | 'committed')]"""
+        staging = Path(workspace) / cls.STAGING_DIR
+        recovered = []
+        if not staging.is_dir():
+            return recovered
+        for root in sorted(p for p in staging.iterdir() if p.is_dir()):
+            try:
+                with open(root / 'journal.json', 'r', encoding='utf-8') as f:
+                    journal = json.load(f)
+            except (OSError, ValueError):
+                # 日志写入前中断，尚未移动任何文件
+                shutil.rmtree(root, ignore_errors=True)
+                continue
+            tx = cls(workspace, root.name, root=root, entries=journal['entries'], state=journal['state'])
+            if tx.state == 'staging':
+                tx.rollback()
+                recovered.append((root.name, 'rolled_back'))
+            else:
+                tx._roll_forward()
+                recovered.append((root.name, 'committed'))
+        return recovered
+
+
+@dataclass
+class IOJob:
+    """一个文件 I/O 任务"""
+    key: tuple          # 结果键，如 (种子序号, 操作序号)
+    fn: object          # 无参可调用对象，执行实际 I/O
+    src: str
+    dst: str
+    size: int = 0
+    op_type: str = 'copy'
+
+
+class IOScheduler:
+    """按设备 (st_dev) 调度文件 I/O：机械硬盘每块盘同时只跑一个流，固态硬盘可同时跑多个
+
+    每个任务同时占用源设备与目标设备的并发名额，名额不足的任务留在队列中，
+    不会阻塞其他设备组合上的任务。
+    """
+
+    def __init__(self, ssd_streams=4, hdd_streams=1, metrics=None):
+        self.ssd_streams = max(1, ssd_streams)
+        self.hdd_streams = max(1, hdd_streams)
+        self.metrics = metrics
+        self._devices = {}
+        self._streams = {}
+
+    def device_of(self, path):
+        """返回路径（或其最近的已存在上级目录）所在设备号"""
+        path = Path(path)
+        for candidate in (path, *path.parents):
+            if candidate in self._devices:
+                return self._devices[candidate]
+            try:
+                dev = os.stat(candidate).st_dev
+            except OSError:
+                continue
+            self._devices[candidate] = dev
+            return dev
+        return None
+
+    @staticmethod
+    def is_rotational(dev):
+        """通过 /sys 判断块设备是否为机械硬盘；无法判断时按机械硬盘处理"""
+        if dev is None or not sys.platform.startswith('linux'):
+            return True
+        base = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+        for flag in (f"{base}/queue/rotational", f"{base}/../queue/rotational"):
+            try:
+                with open(flag) as f:
+                    return f.read().strip() != '0'
+            except OSError:
+                continue
+        return True
+
+    def streams_for(self, dev):
+        if dev not in self._streams:
+            self._streams[dev] = self.hdd_streams if self.is_rotational(dev) else self.ssd_streams
+        return self._streams[dev]
+
+    def run(self, jobs, on_done=None):
+        """并发执行任务，返回 {key: None | 异常}"""
+        queues = {}
+        for job in jobs:
+            devices = frozenset(d for d in (self.device_of(job.src), self.device_of(job.dst)))
+            queues.setdefault(devices, deque()).append(job)
+        slots = {dev: self.streams_for(dev) for devices in queues for dev in devices}
+        results = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(1, sum(slots.values()))) as pool:
+            while queues or running:
+                for devices in list(queues):
+                    device_queue = queues[devices]
+                    while device_queue and all(slots[d] > 0 for d in devices):
+                        job = device_queue.popleft()
+                        for d in devices:
+                            slots[d] -= 1
+                        running[pool.submit(job.fn)] = (job, devices, time.perf_counter())
+                    if not device_queue:
+                        del queues[devices]
+                if self.metrics:
+                    self.metrics.set('io_queue_depth', sum(len(q) for q in queues.values()))
+                    self.metrics.set('io_running_jobs', len(running))
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job, devices, started = running.pop(future)
+                    for d in devices:
+                        slots[d] += 1
+                    results[job.key] = future.exception()
+                    if self.metrics:
+                        self.metrics.observe('io_job_duration_seconds', time.perf_counter() - started,
+                                             op=job.op_type)
+                    if on_done:
+                        on_done(job, results[job.key])
+        if self.metrics:
+            self.metrics.set('io_running_jobs', 0)
+        return results
+
+    def check_free_space(self, jobs):
+        """按目标设备汇总所需空间并与可用空间比较
+
+        同设备移动只是重命名，不占用额外空间。
+        返回: [(目标路径, 所需字节, 可用字节)]，仅包含空间不足的设备
+        """
+        required = {}
+        sample_path = {}
+        for job in jobs:
+            dst_dev = self.device_of(job.dst)
+            if job.op_type == 'move' and self.device_of(job.src) == dst_dev:
+                continue
+            required[dst_dev] = required.get(dst_dev, 0) + job.size
+            sample_path.setdefault(dst_dev, Path(job.dst).parent)
+        shortages = []
+        for dev, needed in required.items():
+            free = shutil.disk_usage(sample_path[dev]).free
+            if needed > free:
+                shortages.append((str(sample_path[dev]), needed, free))
+        return shortages
+
+
+# 指标定义: 名称 → (类型, 说明)；名称输出时自动加 qb_renamer_ 前缀
+METRIC_DEFINITIONS = {
+    'torrents_scanned_total': ('counter', '已扫描的种子数'),
+    'files_planned_total': ('counter', '已规划重命名的文件数 (按类型)'),
+    'file_operations_total': ('counter', '执行的文件操作数 (按操作与结果)'),
+    'bytes_copied_total': ('counter', '复制/跨设备移动写入的字节数'),
+    'api_requests_total': ('counter', 'qBittorrent API 调用次数 (按实例、接口与结果)'),
+    'api_request_duration_seconds': ('histogram', 'qBittorrent API 调用耗时 (按实例、接口)'),
+    'regex_rule_hits_total': ('counter', '命名规则命中次数 (按规则)'),
+    'api_cache_requests_total': ('counter', 'API 响应缓存查询次数 (按实例、接口与命中结果)'),
+    'api_concurrency_limit': ('gauge', '自适应并发限制器当前允许的同时请求数 (按实例)'),
+    'io_queue_depth': ('gauge', 'I/O 调度器中等待执行的任务数'),
+    'io_running_jobs': ('gauge', 'I/O 调度器中正在执行的任务数'),
+    'io_job_duration_seconds': ('histogram', '单个 copy/move 任务耗时 (按操作)'),
+}
+
+
+class Metrics:
+    """进程内指标注册表（线程安全），以 Prometheus 文本格式输出
+
+    可通过本地 HTTP /metrics 端点或 node_exporter textfile collector 文件暴露。
+    """
+
+    PREFIX = 'qb_renamer_'
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}       # (名称, 标签元组) → 数值
+        self._histograms = {}   # (名称, 标签元组) → [各桶计数..., 总和, 次数]
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = [0] * (len(self.BUCKETS) + 2)
+            for idx, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    state[idx] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = [*labels, *extra]
+        if not pairs:
+            return ''
+
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}'
+
+    def render(self):
+        """生成 Prometheus 文本格式"""
+        with self._lock:
+            values = sorted(self._values.items())
+            histograms = sorted((k, list(v)) for k, v in self._histograms.items())
+        lines = []
+        described = set()
+
+        def header(name):
+            if name not in described:
+                described.add(name)
+                kind, help_text = METRIC_DEFINITIONS.get(name, ('untyped', ''))
+                lines.append(f"# HELP {self.PREFIX}{name} {help_text}")
+                lines.append(f"# TYPE {self.PREFIX}{name} {kind}")
+
+        for (name, labels), value in values:
+            header(name)
+            lines.append(f"{self.PREFIX}{name}{self._labels(labels)} {value}")
+        for (name, labels), state in histograms:
+            header(name)
+            for bound, count in zip(self.BUCKETS, state):
+                lines.append(f"{self.PREFIX}{name}_bucket{self._labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{self.PREFIX}{name}_bucket{self._labels(labels, [('le', '+Inf')])} {state[-1]}")
+            lines.append(f"{self.PREFIX}{name}_sum{self._labels(labels)} {state[-2]}")
+            lines.append(f"{self.PREFIX}{name}_count{self._labels(labels)} {state[-1]}")
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """原子写入 textfile collector 文件（先写临时文件再替换）"""
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """在后台线程启动 HTTP 服务，GET /metrics 返回当前指标"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # 仅启用端点时导入，减少启动耗时
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def is_overload_error(error):
+    """5xx 响应与连接错误/超时视为服务端过载信号"""
+    if Client is not None and isinstance(error, (HTTP5XXError, APIConnectionError)):
+        return True
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return isinstance(status, int) and status >= 500
+
+
+class AdaptiveLimiter:
+    """AIMD 并发限制器：延迟平稳时缓慢增加并发，延迟升高或出现 5xx/超时时成倍回退
+
+    基线延迟按接口分别取最近一段窗口内的最小值（分页列表与单个重命名的正常耗时相差很大，
+    不能共用一个基线）；单次请求耗时超过 本接口基线 × LATENCY_TOLERANCE
+    （且超过 LATENCY_FLOOR，避免亚毫秒级抖动误判）即视为拥塞。每个"代"只回退一次：
+    回退前已发出的请求再返回慢结果不会重复回退。adaptive=False 时固定为 maximum。
+    """
+
+    LATENCY_TOLERANCE = 2.0
+    LATENCY_FLOOR = 0.05      # 秒
+    DECREASE_FACTOR = 0.5
+    BASELINE_WINDOW = 50
+
+    def __init__(self, maximum, initial=2, adaptive=True):
+        self.maximum = max(1, maximum)
+        self.adaptive = adaptive
+        self._limit = float(min(self.maximum, max(1, initial)) if adaptive else self.maximum)
+        self._in_flight = 0
+        self._epoch = 0
+        self._latencies = {}      # 接口名 → 最近的延迟样本
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self):
+        """等待空闲名额，返回当前代号（释放时传回）"""
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                self._cond.wait()
+            self._in_flight += 1
+            return self._epoch
+
+    def release(self, epoch, latency, overloaded=False, endpoint=''):
+        """释放名额并根据本次请求的延迟/结果（与同一接口的基线比较）调整并发上限"""
+        with self._cond:
+            self._in_flight -= 1
+            if self.adaptive:
+                samples = self._latencies.setdefault(endpoint, deque(maxlen=self.BASELINE_WINDOW))
+                baseline = min(samples) if samples else latency
+                samples.append(latency)
+                congested = overloaded or (
+                    latency > self.LATENCY_FLOOR and latency > baseline * self.LATENCY_TOLERANCE
+                )
+                if congested:
+                    if epoch == self._epoch:
+                        self._limit = max(1.0, self._limit * self.DECREASE_FACTOR)
+                        self._epoch += 1
+                elif self._limit < self.maximum:
+                    # 每个"往返"约增加 1
+                    self._limit = min(float(self.maximum), self._limit + 1 / self._limit)
+            self._cond.notify_all()
+
+
+def _torrent_hashes(args, kwargs):
+    """从 API 调用参数中取出涉及的种子哈希；未限定种子时返回 None"""
+    value = kwargs.get('torrent_hash') or kwargs.get('torrent_hashes') or (args[0] if args else None)
+    if not value:
+        return None
+    if isinstance(value, str):
+        return frozenset(value.split('|'))
+    return frozenset(value)
+
+
+class ResponseCache:
+    """API 响应缓存（TTL + LRU），键为 接口 + 参数
+
+    写操作按 WRITE_INVALIDATES 精确失效：只清除涉及同一种子的条目，以及未限定种子的
+    列表查询（写入可能改变其过滤结果）。未登记的非只读接口一律清空缓存，避免读到旧状态。
+    """
+
+    READ_ENDPOINTS = frozenset({'torrents_info', 'torrents_files'})
+    WRITE_INVALIDATES = {
+        'torrents_rename_file': ('torrents_files',),
+        'torrents_rename_folder': ('torrents_files', 'torrents_info'),
+        'torrents_add_tags': ('torrents_info',),
+        'torrents_remove_tags': ('torrents_info',),
+        'torrents_set_category': ('torrents_info',),
+        'torrents_set_location': ('torrents_info', 'torrents_files'),
+    }
+    # 不改变种子状态、无需失效的接口
+    NEUTRAL_ENDPOINTS = frozenset({'auth_log_in', 'auth_log_out', 'app_version', 'app_web_api_version'})
+
+    def __init__(self, ttl, max_entries=CONFIG['API_CACHE_SIZE']):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # 键 → (过期时间, 结果, 涉及的种子哈希或 None)
+        self._lock = threading.Lock()
+        self.generation = 0             # 每次失效递增；读取期间发生过写入的结果不入缓存
+
+    @staticmethod
+    def key(endpoint, args, kwargs):
+        return endpoint, repr(args), repr(sorted(kwargs.items()))
+
+    def get(self, key):
+        """返回 (命中, 结果)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry[1]
+
+    def put(self, key, value, hashes):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value, hashes)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def store(self, endpoint, args, kwargs, result, generation):
+        """缓存读接口结果；种子列表按种子拆分，使单个种子的 torrents_info 查询也能命中"""
+        if generation != self.generation:
+            return
+        hashes = _torrent_hashes(args, kwargs)
+        self.put(self.key(endpoint, args, kwargs), result, hashes)
+        if endpoint == 'torrents_info' and hashes is None:
+            for torrent in result:
+                torrent_hash = torrent.get('hash') if hasattr(torrent, 'get') else None
+                if torrent_hash:
+                    self.put(self.key(endpoint, (), {'torrent_hashes': torrent_hash}),
+                             [torrent], frozenset((torrent_hash,)))
+
+    def invalidate(self, endpoint, args, kwargs):
+        """写操作后失效相关条目"""
+        if endpoint in self.NEUTRAL_ENDPOINTS:
+            return
+        targets = self.WRITE_INVALIDATES.get(endpoint)
+        hashes = _torrent_hashes(args, kwargs)
+        with self._lock:
+            self.generation += 1
+            if targets is None or hashes is None:
+                self._entries.clear()
+                return
+            for key in [k for k, (_, _, entry_hashes) in self._entries.items()
+                        if k[0] in targets and (entry_hashes is None or entry_hashes & hashes)]:
+                del self._entries[key]
+
+    def discard(self, hashes):
+        """丢弃涉及指定种子的条目，下次读取直接访问服务端"""
+        with self._lock:
+            self.generation += 1
+            for key in [k for k, (_, _, entry_hashes) in self._entries.items()
+                        if entry_hashes is not None and entry_hashes & hashes]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+class InstrumentedClient:
+    """qBittorrent 客户端代理：读接口走响应缓存，由自适应限制器控制同时进行的请求数，
+    并按实例/接口记录调用次数、结果与耗时"""
+
+    def __init__(self, client, metrics, instance='default', max_concurrency=4, adaptive=True, cache_ttl=0):
+        self._client = client
+        self._metrics = metrics
+        self._instance = instance
+        self._limiter = AdaptiveLimiter(max_concurrency, adaptive=adaptive)
+        self.cache = ResponseCache(cache_ttl) if cache_ttl > 0 else None
+
+    def clear_cache(self):
+        """丢弃缓存的响应（每轮处理开始时调用，缓存只在一轮处理内有效）"""
+        if self.cache is not None:
+            self.cache.clear()
+
+    def forget_torrent(self, torrent_hash):
+        """丢弃单个种子的缓存响应（常驻服务每次规划/执行前调用，避免沿用之前请求读到的旧状态）"""
+        if self.cache is not None:
+            self.cache.discard(frozenset((torrent_hash,)))
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        metrics = self._metrics
+        labels = {'instance': self._instance, 'endpoint': name}
+
+        def call(*args, **kwargs):
+            cache = self.cache
+            if cache is not None and name in cache.READ_ENDPOINTS:
+                hit, cached = cache.get(cache.key(name, args, kwargs))
+                metrics.inc('api_cache_requests_total', result='hit' if hit else 'miss', **labels)
+                if hit:
+                    return cached
+                generation = cache.generation
+            limiter = self._limiter
+            epoch = limiter.acquire()
+            overloaded = False
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception as e:
+                overloaded = is_overload_error(e)
+                metrics.inc('api_requests_total', result='error', **labels)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                limiter.release(epoch, elapsed, overloaded, endpoint=name)
+                metrics.observe('api_request_duration_seconds', elapsed, **labels)
+                metrics.set('api_concurrency_limit', limiter.limit, instance=self._instance)
+                # 写操作无论成功与否都使相关缓存失效（失败时服务端状态未知）
+                if cache is not None and name not in cache.READ_ENDPOINTS:
+                    cache.invalidate(name, args, kwargs)
+            metrics.inc('api_requests_total', result='ok', **labels)
+            if cache is not None and name in cache.READ_ENDPOINTS:
+                cache.store(name, args, kwargs, result, generation)
+            return result
+        return call
+
+
+# 录制时抹去的字段：凭据、会话，以及含 passkey 的 tracker 地址
+REPLAY_SCRUB_KEYS = frozenset(('username', 'password', 'cookie', 'sid', 'tracker', 'magnet_uri'))
+REPLAY_FORMAT = 'qb_renamer-replay/1'
+
+
+def _to_plain(value):
+    """把 API 响应转换为可 JSON 序列化的普通结构，并抹去 REPLAY_SCRUB_KEYS 中的字段"""
+    if isinstance(value, dict):
+        return {str(k): ('' if k in REPLAY_SCRUB_KEYS else _to_plain(v)) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [_to_plain(v) for v in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def _replay_key(endpoint, args, kwargs):
+    return json.dumps([endpoint, _to_plain(args), _to_plain(kwargs)], sort_keys=True, ensure_ascii=False)
+
+
+class SessionRecorder:
+    """把客户端调用与响应写入回放文件（gzip 压缩的 JSON Lines，不含凭据）
+
+    首行为文件头，之后每行一次调用: i=实例 e=接口 a/k=参数 t=耗时(秒) r=响应 或 x=[异常类型, 信息]。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self.calls = 0
+        self._write({'format': REPLAY_FORMAT, 'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S%z')})
+
+    def _write(self, entry, count=False):
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self._lock:
+            self.calls += count
+            self._file.write(line)
+
+    def wrap(self, client, instance):
+        """返回记录该实例全部调用的客户端代理（包在缓存/限流层之下，只记录真正发出的请求）"""
+        return RecordingClient(client, self, instance)
+
+    def record(self, entry):
+        self._write(entry, count=True)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class RecordingClient:
+    """qBittorrent 客户端代理：把每次调用的参数、响应与耗时交给 SessionRecorder"""
+
+    def __init__(self, client, recorder, instance):
+        self._client = client
+        self._recorder = recorder
+        self._instance = instance
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            entry = {'i': self._instance, 'e': name, 'a': _to_plain(args), 'k': _to_plain(kwargs)}
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception as e:
+                entry['x'] = [type(e).__name__, str(e)]
+                raise
+            else:
+                entry['r'] = _to_plain(result)
+                return result
+            finally:
+                entry['t'] = round(time.perf_counter() - start, 6)
+                self._recorder.record(entry)
+        return call
+
+
+class AttrDict(dict):
+    """支持属性访问的 dict，与 qbittorrentapi 的返回值一致（回放响应与规划 API 的输入记录）"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _from_plain(value):
+    if isinstance(value, dict):
+        return AttrDict((k, _from_plain(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_from_plain(v) for v in value]
+    return value
+
+
+class ReplayClient:
+    """回放后端：按 (接口, 参数) 依次返回录制的响应，代替真实的 qBittorrent 连接
+
+    同一请求录制了多次时按录制顺序返回，用完后重复最后一次；写操作未录制时视为成功。
+    latency='recorded' 按录制耗时等待，'zero' 立即返回。
+    """
+
+    REPLAYED_ERRORS = {cls.__name__: cls for cls in (APIConnectionError, HTTP5XXError, LoginFailed) if cls}
+
+    def __init__(self, instance, latency='recorded'):
+        self.instance = instance
+        self.latency = latency
+        self.responses = {}
+
+    @classmethod
+    def load(cls, path, latency='recorded'):
+        """读取回放文件，返回 {实例名: ReplayClient}"""
+        clients = {}
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline() or '{}')
+            if header.get('format') != REPLAY_FORMAT:
+                raise ValueError(f"不是有效的回放文件: {path}")
+            for line in f:
+                entry = json.loads(line)
+                client = clients.setdefault(entry['i'], cls(entry['i'], latency))
+                key = _replay_key(entry['e'], entry['a'], entry['k'])
+                client.responses.setdefault(key, deque()).append(entry)
+        return clients
+
+    def _lookup(self, name, args, kwargs):
+        recorded = self.responses.get(_replay_key(name, args, kwargs))
+        if recorded:
+            return recorded.popleft() if len(recorded) > 1 else recorded[0]
+        # 单个种子的查询可以从录制的列表响应中取出
+        if name == 'torrents_info' and set(kwargs) == {'torrent_hashes'}:
+            for key, entries in self.responses.items():
+                if json.loads(key)[0] == name and isinstance(entries[-1].get('r'), list):
+                    found = [t for t in entries[-1]['r'] if t.get('hash') == kwargs['torrent_hashes']]
+                    if found:
+                        return {'t': 0, 'r': found}
+        if name not in ResponseCache.READ_ENDPOINTS:
+            return {'t': 0, 'r': None}
+        raise LookupError(f"回放文件中没有该请求: {self.instance} {name} {args or ''}{kwargs or ''}")
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            entry = self._lookup(name, args, kwargs)
+            if self.latency == 'recorded' and entry.get('t'):
+                time.sleep(entry['t'])
+            if 'x' in entry:
+                error_type, message = entry['x']
+                raise self.REPLAYED_ERRORS.get(error_type, RuntimeError)(message)
+            return _from_plain(entry.get('r'))
+        return call
+
+
+# 正则安全探测用的典型文件名
+REGEX_PROBE_CORPUS = (
+    '[Lilith-Raws] Kaguya-sama - Love is War - 05 [Baha][WEB-DL][1080p][AVC AAC][CHT][MP4].mp4',
+    '【喵萌奶茶屋】★04月新番★[间谍过家家 / Spy x Family][13][1080p][简日双语].mp4',
+    'Show.Name.S01E02.1080p.WEB-DL.x264.chs&jap.ass',
+    '[VCB-Studio] Show [01][Ma10p_1080p][x265_flac].sc.ass',
+    'Show 第03话 [简].ass',
+)
+_REGEX_SAFETY_CACHE = {}
+
+
+def _has_nested_quantifier(parsed, inside_unbounded=False):
+    """静态检查：无界重复内部是否嵌套了可变长度的重复，如 (a+)+、(\\w+\\s?)*"""
+    for op, av in parsed:
+        name = str(op)
+        if name in ('MAX_REPEAT', 'MIN_REPEAT'):
+            low, high, sub = av
+            if inside_unbounded and high != low:
+                return True
+            if _has_nested_quantifier(sub, inside_unbounded or high == sre_parse.MAXREPEAT):
+                return True
+        elif name == 'SUBPATTERN':
+            if _has_nested_quantifier(av[-1], inside_unbounded):
+                return True
+        elif name == 'BRANCH':
+            if any(_has_nested_quantifier(branch, inside_unbounded) for branch in av[1]):
+                return True
+        elif name in ('ASSERT', 'ASSERT_NOT'):
+            if _has_nested_quantifier(av[1], inside_unbounded):
+                return True
+    return False
+
+
+def _probe_time(compiled, text):
+    start = time.perf_counter()
+    compiled.search(text)
+    return time.perf_counter() - start
+
+
+def check_regex_safety(pattern):
+    """评估正则在对抗输入与典型文件名上的匹配耗时
+
+    返回: (结论, 说明)，结论为 'ok' | 'warn' | 'reject'
+      reject: 短对抗输入上即超出时间预算（指数级回溯）
+      warn:   存在嵌套量词或耗时随输入长度超线性增长
+    """
+    if pattern in _REGEX_SAFETY_CACHE:
+        return _REGEX_SAFETY_CACHE[pattern]
+    compiled = re.compile(pattern, re.IGNORECASE)
+    budget = CONFIG['REGEX_PROBE_BUDGET']
+    verdict = ('ok', '')
+
+    # 对抗输入：模式中出现的字面字符 + 常见字符重复 n 次，再接一个迫使匹配失败的尾字符
+    alphabet = {c for c in pattern if c.isalnum() or c in ' _-.[]'} | set('a0 ._-[')
+    alphabet = sorted(alphabet)[:24]
+    for n in range(6, 26, 2):
+        worst = max(_probe_time(compiled, c * n + tail) for c in alphabet for tail in ('!', '\n'))
+        if worst > budget:
+            verdict = ('reject', f"长度 {n} 的对抗输入耗时 {worst * 1000:.0f}ms（灾难性回溯）")
+            break
+
+    if verdict[0] == 'ok':
+        # 超线性检测：输入长度翻 4 倍，耗时增长远超 4 倍
+        for base in (REGEX_PROBE_CORPUS[0], *(c * 8 + ' ' for c in alphabet[:6])):
+            short = (base * (500 // len(base) + 1))[:500] + '!'
+            long = (base * (2000 // len(base) + 1))[:2000] + '!'
+            t_short = min(_probe_time(compiled, short) for _ in range(2))
+            if t_short > budget:
+                verdict = ('warn', f"500 字符输入耗时 {t_short * 1000:.0f}ms")
+                break
+            t_long = min(_probe_time(compiled, long) for _ in range(2))
+            if t_long > 0.005 and t_long > t_short * 10:
+                verdict = ('warn', f"耗时随输入长度超线性增长 ({t_short * 1000:.1f}ms → {t_long * 1000:.1f}ms)")
+                break
+        else:
+            if any(_probe_time(compiled, name) > budget for name in REGEX_PROBE_CORPUS):
+                verdict = ('warn', "典型文件名上匹配耗时超出预算")
+
+    if verdict[0] == 'ok':
+        try:
+            if _has_nested_quantifier(sre_parse.parse(pattern)):
+                verdict = ('warn', "包含嵌套量词，可能在特定输入上发生灾难性回溯")
+        except Exception:
+            pass
+
+    _REGEX_SAFETY_CACHE[pattern] = verdict
+    return verdict
+
+
+def compile_checked_regex(pattern, label):
+    """编译配置中的正则并做安全评估；不安全的正则返回 None"""
+    try:
+        compiled = re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        print(f"⚠️ 忽略无效{label}: {pattern} ({e})")
+        return None
+    verdict, reason = check_regex_safety(pattern)
+    if verdict == 'reject':
+        print(f"❌ 拒绝{label}: {pattern} — {reason}")
+        return None
+    if verdict == 'warn':
+        print(f"⚠️ {label}可能存在性能风险: {pattern} — {reason}")
+    return compiled
+
+
+def parse_int_setting(section, key, default, minimum=1):
+    """读取整数配置项；无效时提示并使用默认值"""
+    try:
+        return max(minimum, int(section.get(key, default)))
+    except ValueError:
+        print(f"⚠️ 配置项 {key} 不是有效的数字，使用默认值 {default}")
+        return int(default)
+
+
+def parse_name_list(raw):
+    """解析逗号分隔的名称列表（去除空白，统一小写）"""
+    return frozenset(d.strip().lower() for d in (raw or '').split(',') if d.strip())
+
+
+def compile_ignore_matcher(keywords):
+    """将忽略关键词编译为单个正则（一次扫描完成全部关键词检查）
+
+    关键词只在表示"这一集是特典"的位置命中，标题中作为普通单词出现时不算
+    （如 [Special Edition]、剧名含 Special）：
+      - 单独成组的括号：[SP]、[OVA 02]、(NCOP1)
+      - 直接带编号：SP01、NCOP1v2、OVA2
+      - 位于集号位置或紧跟集号：Show - OVA、Show - 01 SP
+      - 位于文件名末尾（其后只剩语言等点号后缀）：Show NCED、Show.Specials.chs
+    """
+    if not keywords:
+        return None
+    # 长关键词优先，避免 sp 抢先匹配 special；允许复数 s（Specials、SPs）
+    word = '(?:' + '|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True)) + ')s?'
+    number = r'(?:\d+(?:v\d+)?)'
+    token = rf'(?<![a-z0-9]){word}{number}?(?:\s*{number})?(?![a-z0-9])'
+    return re.compile('|'.join((
+        rf'[\[【(（]\s*{token}\s*[\]】)）]',
+        rf'(?<![a-z0-9]){word}\d+(?:v\d+)?(?![a-z0-9])',
+        rf'(?:\s-\s*|(?<![a-z0-9])\d{{1,3}}(?:v\d+)?[\s._]+){token}',
+        rf'(?:^|(?<=[\s._\-\]】)）])){token}(?=(?:\.[a-z&]+)*$)',
+    )), re.IGNORECASE)
+
+
+class DirExcluder:
+    """排除目录匹配：普通名称走集合查找，通配符条目编译为单个正则（均不区分大小写）
+
+    含 / 的条目按相对种子根目录的路径匹配（如 */menu），其余按目录名匹配（如 scan*）。
+    目录的任一上级被排除时，整个子树都被排除。
+    """
+
+    GLOB_CHARS = frozenset('*?[')
+
+    def __init__(self, names):
+        self.names = frozenset(n for n in names if not self.GLOB_CHARS & set(n) and '/' not in n)
+        name_globs = [n for n in names if self.GLOB_CHARS & set(n) and '/' not in n]
+        path_globs = [n.strip('/') for n in names if '/' in n]
+        self.name_pattern = re.compile('|'.join(fnmatch.translate(g) for g in name_globs)) if name_globs else None
+        self.path_pattern = re.compile('|'.join(fnmatch.translate(g) for g in path_globs)) if path_globs else None
+
+    def __bool__(self):
+        return bool(self.names or self.name_pattern or self.path_pattern)
+
+    def matches(self, dir_path, base):
+        """目录本身（不看上级）是否命中排除规则；路径规则只用于 base 以下的目录"""
+        name = dir_path.name.lower()
+        if name in self.names or (self.name_pattern and self.name_pattern.match(name)):
+            return True
+        if self.path_pattern and len(dir_path.parts) > len(base.parts):
+            relative = dir_path.relative_to(base).as_posix().lower()
+            return self.path_pattern.match(relative) is not None
+        return False
+
+    def is_excluded(self, dir_path, base, memo):
+        """目录或其在 base 以下的任一上级被排除
+
+        memo 为同一种子内共享的 {目录: 结果} 缓存，按目录树自顶向下只判定一次，
+        同一子树下的文件直接命中缓存。
+        """
+        if dir_path in memo:
+            return memo[dir_path]
+        # 目录自身的名称总是判定；上级只向上查到 base（种子根目录本身不参与判定）
+        result = (len(dir_path.parent.parts) > len(base.parts) and self.is_excluded(dir_path.parent, base, memo)) \
+            or self.matches(dir_path, base)
+        memo[dir_path] = result
+        return result
+
+
+# 命名模板中成对包裹变量的括号：变量为空时连同括号一起省略
+TEMPLATE_BRACKETS = {'[': ']', '(': ')', '【': '】', '「': '」', '《': '》', '（': '）'}
+
+# 文件名中不允许出现的字符（含路径分隔符，渲染结果不会产生子目录）
+ILLEGAL_FILENAME_CHARS = re.compile(r'[\\/*?:"<>|]')
+
+
+class NameTemplate:
+    """预编译的命名模板
+
+    加载时解析模板并校验变量名；渲染时按片段拼接：模板开头的文字总是输出，
+    其余每段文字视为其后变量的前导分隔符，仅当该变量非空且前面已有输出时才输出；
+    紧贴变量两侧的成对括号（如 [{custom}]）在变量为空时一并省略，
+    因此空变量不会留下多余的空格、点号或半个括号，无需事后修补字符串。
+    """
+
+    def __init__(self, template, allowed, required=()):
+        self.template = template
+        self.literals = []  # 第 i 个变量前的文字为 literals[i]，最后一项为模板结尾文字
+        self.parts = []     # (变量名, 格式说明, 转换符)
+        for literal, field_name, spec, conversion in string.Formatter().parse(template):
+            self.literals.append(literal)
+            if field_name is None:
+                break
+            if field_name not in allowed:
+                raise ValueError(f"未知变量 {{{field_name}}} (可用: {', '.join('{%s}' % a for a in allowed)})")
+            self.parts.append((field_name, spec or '', conversion))
+        if len(self.literals) == len(self.parts):
+            self.literals.append('')
+        # 变量两侧文字分别以开括号结尾、以对应闭括号开头时，该变量被括号包裹
+        self.wrapped = [
+            before[-1:] in TEMPLATE_BRACKETS and after.startswith(TEMPLATE_BRACKETS[before[-1]])
+            for before, after in zip(self.literals, self.literals[1:])
+        ]
+        self.fields = frozenset(part[0] for part in self.parts)
+        if missing := [f for f in required if f not in self.fields]:
+            raise ValueError(f"缺少必需变量 {', '.join('{%s}' % f for f in missing)}")
+        # 用示例值试渲染一次，提前暴露格式说明错误
+        self.render(**{name: 'x' for name in allowed})
+
+    def render(self, **values):
+        rendered = []
+        for field_name, spec, conversion in self.parts:
+            value = values.get(field_name, '')
+            if conversion:
+                value = {'s': str, 'r': repr, 'a': ascii}[conversion](value)
+            rendered.append(format(value, spec) if value != '' else '')
+
+        literals = list(self.literals)
+        for idx, value in enumerate(rendered):
+            if not value and self.wrapped[idx]:
+                literals[idx] = literals[idx][:-1]
+                literals[idx + 1] = literals[idx + 1][1:]
+
+        out = [literals[0]]
+        emitted = bool(literals[0])
+        for idx, value in enumerate(rendered):
+            if not value:
+                continue
+            if emitted and idx:
+                out.append(literals[idx])
+            out.append(value)
+            emitted = True
+        if emitted:
+            out.append(literals[-1])
+        return ''.join(out)
+
+
+@dataclass(frozen=True)
+class NamingRules:
+    """[NAMING] 中的全部命名模板（均已预编译）"""
+    season: NameTemplate
+    language: NameTemplate
+    name: NameTemplate
+    video_prefix: str
+    sub_prefix: str
+
+    SEASON_FIELDS = ('season', 'episode')
+    LANGUAGE_FIELDS = ('lang',)
+    NAME_FIELDS = ('prefix', 'season_ep', 'season', 'episode', 'custom', 'lang', 'ext', 'type_prefix')
+
+    @classmethod
+    def from_section(cls, naming):
+        def compile_template(key, default, allowed, required=()):
+            template = naming.get(key, default)
+            try:
+                return NameTemplate(template, allowed, required)
+            except (ValueError, KeyError, IndexError) as e:
+                print(f"⚠️ 命名模板 {key} = {template} 无效 ({e})，使用默认值 {default}")
+                return NameTemplate(default, allowed, required)
+
+        return cls(
+            season=compile_template('season_format', CONFIG['DEFAULT_SEASON_FORMAT'],
+                                    cls.SEASON_FIELDS, ('episode',)),
+            language=compile_template('language_format', CONFIG['DEFAULT_LANGUAGE_FORMAT'],
+                                      cls.LANGUAGE_FIELDS, ('lang',)),
+            name=compile_template('custom_format', CONFIG['DEFAULT_CUSTOM_FORMAT'],
+                                  cls.NAME_FIELDS, ('season_ep', 'ext')),
+            video_prefix=naming.get('video_prefix', ''),
+            sub_prefix=naming.get('sub_prefix', '')
+        )
+
+    def render(self, prefix, season, episode, custom, lang, ext, is_video):
+        """渲染完整文件名；custom 与 lang 为空时其分隔符一并省略，结果中的非法字符（含路径分隔符）被移除"""
+        season_ep = self.season.render(season=season, episode=episode)
+        name = self.name.render(
+            prefix=prefix,
+            season_ep=season_ep,
+            season=season,
+            episode=episode,
+            custom=custom,
+            lang=self.language.render(lang=lang) if lang else '',
+            ext=ext,
+            type_prefix=self.video_prefix if is_video else self.sub_prefix
+        )
+        return ILLEGAL_FILENAME_CHARS.sub('', name).strip()
+
+
+# 重复发布的取舍策略 → 比较顺序（前者优先，后者用于打平）
+DUPLICATE_POLICIES = {
+    'version': ('version', 'size', 'subgroup'),
+    'size': ('size', 'version', 'subgroup'),
+    'subgroup': ('subgroup', 'version', 'size'),
+    'off': (),
+}
+
+# 附加 qBittorrent 实例的配置节前缀，如 [QBITTORRENT:seedbox2]
+INSTANCE_SECTION_PREFIX = 'QBITTORRENT:'
+
+
+@dataclass(frozen=True)
+class InstanceConfig:
+    """一个 qBittorrent 实例的连接设置"""
+    name: str
+    host: str
+    username: str
+    password: str
+    max_concurrency: int = 4
+    request_timeout: int = 30
+    connect_timeout: int = 5
+
+    @classmethod
+    def from_section(cls, name, section, fallback):
+        """读取实例配置节，未填写的用户名/密码/并发/超时沿用主实例 [QBITTORRENT] 的值"""
+        def number(key, default):
+            try:
+                return max(1, int(section.get(key) or fallback.get(key) or default))
+            except ValueError:
+                print(f"⚠️ 实例 {name} 的 {key} 不是有效的数字，使用默认值 {default}")
+                return default
+
+        return cls(
+            name=name,
+            host=section.get('host', '').strip(),
+            username=(section.get('username') or fallback.get('username', '')).strip(),
+            password=(section.get('password') or fallback.get('password', '')).strip(),
+            max_concurrency=number('max_concurrency', 4),
+            request_timeout=number('request_timeout', 30),
+            connect_timeout=number('connect_timeout', 5)
+        )
+
+
+@dataclass(frozen=True)
+class RuntimeSettings:
+    """配置的只读运行时快照：每次加载/保存配置时构建一次，规划与执行阶段只读取此对象"""
+    default_tag: str
+    processed_tag: str
+    default_category: str
+    default_mode: str
+    workspace: str
+    auto_tag_processed: bool
+    skip_processed: bool
+    completed_only: bool
+    dry_run_first: bool
+    debug_mode: bool
+    subgroup_mode: bool
+    max_dir_depth: int
+    page_size: int
+    series_memory: bool
+    series_memory_auto: bool
+    verify_copies: bool
+    verify_algorithm: str
+    ssd_io_streams: int
+    hdd_io_streams: int
+    regex_time_budget: float                        # 秒
+    metrics_port: int                               # 0 表示不启用 HTTP 端点
+    metrics_textfile: str
+    log_file: str
+    instances: tuple                                # (InstanceConfig, ...)，第一个为主实例
+    adaptive_concurrency: bool
+    api_cache_ttl: int                              # 秒，0 表示不缓存
+    service_port: int
+    service_timeout: int                            # 秒，--torrent 等待规划服务执行完成的上限
+    duplicate_policy: str                           # version | size | subgroup | off
+    preferred_subgroups: tuple                      # 按优先级排列（小写）
+    direct_layout: str                              # flat | season
+    episode_regex_first: bool                       # 集号先按 episode_regexes 匹配，词法分析器兜底
+    video_exts: frozenset
+    sub_exts: frozenset
+    excluded_dirs: frozenset
+    dir_excluder: DirExcluder
+    ignore_matcher: object                          # 编译后的忽略关键词正则或 None
+    episode_patterns: tuple                         # 编译后的集数正则（按顺序尝试）
+    language_rules: tuple                           # ((编译后的正则, 语言标识), ...)
+    naming: NamingRules
+
+    @property
+    def episode_regexes(self):
+        """集数正则的原始字符串（用于显示）"""
+        return [p.pattern for p in self.episode_patterns]
+
+    @classmethod
+    def from_rules(cls, settings=None, language=None, naming=None):
+        """不经过配置文件构建规则（供 Planner 嵌入使用）
+
+        各参数为对应配置节的 {键: 值}，键名与 INI 相同，未给出的项使用默认值；
+        列表值按配置文件的写法连接（episode_regexes 每行一条，其余逗号分隔）。
+        """
+        config = configparser.ConfigParser(interpolation=None)
+        for section, values in (('SETTINGS', settings), ('LANGUAGE', language), ('NAMING', naming)):
+            config[section] = {
+                key: ('\n' if key == 'episode_regexes' else ',').join(value)
+                if isinstance(value, (list, tuple)) else str(value)
+                for key, value in (values or {}).items()
+            }
+        return cls.from_config(config)
+
+    @classmethod
+    def from_config(cls, config):
+        settings = config['SETTINGS'] if config.has_section('SETTINGS') else {}
+        qbit = config['QBITTORRENT'] if config.has_section('QBITTORRENT') else {}
+        naming = config['NAMING'] if config.has_section('NAMING') else {}
+
+        def flag(key, default):
+            try:
+                return config.getboolean('SETTINGS', key, fallback=default)
+            except ValueError:
+                print(f"⚠️ 配置项 {key} 不是有效的布尔值，使用默认值 {default}")
+                return default
+
+        def number(key, default, minimum=1):
+            return parse_int_setting(settings, key, default, minimum)
+
+        # 集数正则：逐条编译并验证必须包含捕获组
+        episode_patterns = []
+        raw = settings.get('episode_regexes', '')
+        for idx, pattern in enumerate(raw.split('\n'), 1):
+            pattern = pattern.strip()
+            if not pattern:
+                continue
+            compiled = compile_checked_regex(pattern, f"集数正则 #{idx}")
+            if compiled is None:
+                continue
+            if compiled.groups < 1:
+                print(f"⚠️ 忽略无捕获组的正则表达式 #{idx}: {pattern}")
+                continue
+            episode_patterns.append(compiled)
+        customized = bool(episode_patterns)
+        if not episode_patterns:
+            episode_patterns = [re.compile(p, re.IGNORECASE) for p in CONFIG['DEFAULT_EPISODE_REGEXES']]
+
+        # 集号来源顺序：auto 时用户改过 episode_regexes 即优先使用，否则词法分析器优先
+        episode_source = settings.get('episode_source', 'auto').strip().lower()
+        if episode_source not in ('auto', 'lexer', 'regex'):
+            print(f"⚠️ 未知的集号来源 {episode_source}，使用 auto")
+            episode_source = 'auto'
+        # 配置文件逐行去除首尾空白，与同样去除空白的默认列表比较
+        customized = customized and [p.pattern for p in episode_patterns] != \
+            [p.strip() for p in CONFIG['DEFAULT_EPISODE_REGEXES']]
+        episode_regex_first = episode_source == 'regex' or (episode_source == 'auto' and customized)
+
+        # 语言规则：[LANGUAGE] 中 模式 = 语言标识
+        language_rules = []
+        if config.has_section('LANGUAGE'):
+            for pattern, lang in config['LANGUAGE'].items():
+                if pattern.startswith(';') or not lang:
+                    continue
+                if (compiled := compile_checked_regex(pattern, "语言规则")) is not None:
+                    language_rules.append((compiled, lang))
+
+        # 主实例 [QBITTORRENT] 加上所有 [QBITTORRENT:名称] 附加实例
+        instances = [InstanceConfig.from_section('default', qbit, qbit)]
+        for section in config.sections():
+            if section.startswith(INSTANCE_SECTION_PREFIX):
+                extra = InstanceConfig.from_section(section[len(INSTANCE_SECTION_PREFIX):].strip(), config[section], qbit)
+                if not extra.host:
+                    print(f"⚠️ 实例配置 [{section}] 缺少 host，已忽略")
+                    continue
+                instances.append(extra)
+
+        excluded_dirs = parse_name_list(settings.get('excluded_dirs', CONFIG['DEFAULT_EXCLUDED_DIRS']))
+        duplicate_policy = settings.get('duplicate_policy', 'version').strip().lower()
+        if duplicate_policy not in DUPLICATE_POLICIES:
+            print(f"⚠️ 未知的重复发布策略 {duplicate_policy}，使用 version")
+            duplicate_policy = 'version'
+        direct_layout = settings.get('direct_layout', 'flat').strip().lower()
+        if direct_layout not in ('flat', 'season'):
+            print(f"⚠️ 未知的直接模式目录结构 {direct_layout}，使用 flat")
+            direct_layout = 'flat'
+
+        return cls(
+            default_tag=qbit.get('default_tag', '').strip(),
+            processed_tag=qbit.get('processed_tag', 'processed').strip(),
+            default_category=qbit.get('default_category', '').strip(),
+            default_mode=settings.get('default_mode', 'direct'),
+            workspace=settings.get('workspace', ''),
+            auto_tag_processed=flag('auto_tag_processed', True),
+            skip_processed=flag('skip_processed', True),
+            completed_only=flag('completed_only', True),
+            dry_run_first=flag('dry_run_first', True),
+            debug_mode=flag('debug_mode', False),
+            subgroup_mode=flag('subgroup_mode', False),
+            max_dir_depth=number('max_dir_depth', CONFIG['DEFAULT_MAX_DIR_DEPTH']),
+            page_size=number('page_size', '100'),
+            series_memory=flag('series_memory', True),
+            series_memory_auto=flag('series_memory_auto', False),
+            verify_copies=flag('verify_copies', False),
+            verify_algorithm=settings.get('verify_algorithm', 'blake2b').strip() or 'blake2b',
+            ssd_io_streams=number('ssd_io_streams', '4'),
+            hdd_io_streams=number('hdd_io_streams', '1'),
+            regex_time_budget=number('regex_time_budget_ms', CONFIG['DEFAULT_REGEX_TIME_BUDGET_MS']) / 1000,
+            metrics_port=number('metrics_port', '0', minimum=0),
+            metrics_textfile=settings.get('metrics_textfile', '').strip(),
+            log_file=settings.get('log_file', '').strip(),
+            instances=tuple(instances),
+            adaptive_concurrency=flag('adaptive_concurrency', True),
+            api_cache_ttl=number('api_cache_ttl', '60', minimum=0),
+            service_port=number('service_port', '8766', minimum=0),
+            service_timeout=number('service_timeout', '300'),
+            duplicate_policy=duplicate_policy,
+            preferred_subgroups=tuple(
+                g.strip().lower() for g in settings.get('preferred_subgroups', '').split(',') if g.strip()
+            ),
+            direct_layout=direct_layout,
+            episode_regex_first=episode_regex_first,
+            video_exts=frozenset(CONFIG['VIDEO_EXTS']),
+            sub_exts=frozenset(CONFIG['SUBS_EXTS']),
+            excluded_dirs=excluded_dirs,
+            dir_excluder=DirExcluder(excluded_dirs),
+            ignore_matcher=compile_ignore_matcher(
+                parse_name_list(settings.get('ignored_keywords', CONFIG['DEFAULT_IGNORED_KEYWORDS']))
+            ),
+            episode_patterns=tuple(episode_patterns),
+            language_rules=tuple(language_rules),
+            naming=NamingRules.from_section(naming)
+        )
+
+
+class Planner:
+    """无副作用的规划：给定规则 (RuntimeSettings) 与种子/文件记录，返回操作计划
+
+    不读写配置文件、不调用 input()、不连接 qBittorrent，可直接嵌入其他程序批量规划；
+    QBitRenamer 在此之上增加配置、交互与执行。剧集记忆只做查询，series_memory 为 None 时
+    完全按名称推断参数。
+    """
+
+    def __init__(self, settings, metrics=None, series_memory=None):
+        self.settings = settings
+        self.metrics = metrics or Metrics()
+        self.series_memory = series_memory
+        self.quarantined_patterns = set()
+
+    def _is_ignored_file(self, file_path):
+        """检查文件名（不含扩展名）是否含忽略关键词"""
+        matcher = self.settings.ignore_matcher
+        if matcher is None:
+            return False
+        return matcher.search(Path(file_path).stem) is not None
+
+    def detect_language(self, filename, release=None):
+        """从文件名的语言标记（如 .chs. / [简]）检测语言"""
+        release = release or parse_release_name(Path(str(filename)).name)
+        if release.languages:
+            self.metrics.inc('regex_rule_hits_total', rule='lexer', kind='language')
+            logger.debug("✅ 语言标记: %s", release.languages[0], extra={'file': filename})
+            return release.languages[0]
+        # 回退到 [LANGUAGE] 中的自定义规则
+        for pattern, lang in self.settings.language_rules:
+            if pattern.pattern in self.quarantined_patterns:
+                continue
+            if self._timed_search(pattern, str(filename)):
+                self.metrics.inc('regex_rule_hits_total', rule=pattern.pattern, kind='language')
+                logger.debug("✅ 匹配成功: %s → %s", pattern.pattern, lang, extra={'file': filename})
+                return lang
+        logger.debug("⚠️ 未匹配到任何语言规则", extra={'file': filename})
+        return None
+
+    def _timed_search(self, pattern, text):
+        """带时间预算的正则搜索；超出预算的正则被隔离，本次运行内不再使用
+
+        标准库 re 无法中途打断匹配，因此在每次匹配结束后检查耗时，
+        让同一个正则不会在整批文件上反复拖慢运行。
+        """
+        start = time.perf_counter()
+        match = pattern.search(text)
+        elapsed = time.perf_counter() - start
+        if elapsed > self.settings.regex_time_budget:
+            self.quarantined_patterns.add(pattern.pattern)
+            print(f"⚠️ 正则 {pattern.pattern} 匹配耗时 {elapsed * 1000:.0f}ms，超出预算，已隔离")
+        return match
+
+    def detect_episode(self, filename):
+        """使用配置的正则列表检测集号"""
+        for idx, pattern in enumerate(self.settings.episode_patterns, 1):
+            if pattern.pattern in self.quarantined_patterns:
+                continue
+            if match := self._timed_search(pattern, filename):
+                self.metrics.inc('regex_rule_hits_total', rule=pattern.pattern, kind='episode')
+                logger.debug("✅ 正则 #%d 匹配成功: %s → %s", idx, pattern.pattern, match.group(1),
+                             extra={'file': filename})
+                return match.group(1)
+        return None
+
+    def _resolve_episode(self, filename, release):
+        """按 episode_source 决定词法分析器与配置正则的先后，前者未识别时由后者兜底"""
+        if self.settings.episode_regex_first and (episode := self.detect_episode(filename)):
+            return episode
+        if release.episode:
+            self.metrics.inc('regex_rule_hits_total', rule='lexer', kind='episode')
+            return release.episode
+        return None if self.settings.episode_regex_first else self.detect_episode(filename)
+
+    def _sanitize_filename(self, filename):
+        return ILLEGAL_FILENAME_CHARS.sub('', filename)
+
+    def generate_new_name(self, file_path, prefix, season, custom_str, is_video, subgroup_tag="",
+                          episode=None, release=None):
+        try:
+            file_path = Path(file_path)
+            filename = file_path.name
+            logger.debug("📝 开始处理文件: %s", filename, extra={'file': filename})
+
+            # 集号按 episode_source 在词法解析结果与配置的正则列表之间取舍
+            release = release or parse_release_name(filename)
+            if not (episode := episode or self._resolve_episode(filename, release)):
+                logger.debug("❌ 无法提取集号", extra={'file': filename})
+                return None
+            
+            # 添加字幕组标记
+            if subgroup_tag:
+                prefix = f"[{subgroup_tag}] {prefix}"  # 添加方括号包裹
+
+            lang = None
+            if not is_video:
+                if lang := self.detect_language(filename, release):
+                    logger.debug("🔠 语言标签: %s", lang)
+
+            new_name = self.settings.naming.render(
+                prefix=prefix.strip(),
+                season=str(season).zfill(2),
+                episode=str(episode).zfill(2),
+                custom=self._sanitize_filename(custom_str).strip(' .') if custom_str else '',
+                lang=lang,
+                ext=file_path.suffix,
+                is_video=is_video
+            )
+
+            logger.debug("✅ 最终文件名: %s", new_name, extra={'file': filename})
+            return new_name
+        except Exception as e:
+            logger.debug("❌ 生成文件名出错: %s", e, exc_info=True, extra={'file': file_path})
+            return None
+
+    def _build_operation(self, mode, workspace, file_path, new_name):
+        """根据操作模式生成单个文件的操作 (类型, 源路径, 目标路径)"""
+        if mode == 'copy':
+            return ('copy', str(file_path), str(Path(workspace) / new_name))
+        if mode == 'move':
+            return ('move', str(file_path), str(Path(workspace) / new_name))
+        if mode == 'direct':
+            return ('rename', str(file_path), str(file_path.parent / new_name))
+        return ('preview', str(file_path), str(file_path.parent / new_name))
+
+    @staticmethod
+    def _match_video(file_path, episode, videos_by_stem, videos_by_episode):
+        """为字幕查找对应视频：先按同名主干匹配（去掉语言后缀），再按集号匹配"""
+        stem = file_path.stem.lower()
+        for _ in range(3):
+            if video := videos_by_stem.get((file_path.parent, stem)):
+                return video
+            if '.' not in stem:
+                break
+            stem = stem.rsplit('.', 1)[0]
+        if episode and (candidates := videos_by_episode.get((file_path.parent, episode))):
+            return candidates[0]
+        return None
+
+    def _plan_files(self, files, mode, workspace, prefix, season, custom_str, subgroup_tag, skip_stats):
+        """规划一组文件的新文件名（按集号分组，字幕与同集视频配对）
+
+        一次遍历按 (目录, 集号) 与 (目录, 文件名主干) 建立视频索引，字幕通过哈希查找
+        配对，并以视频的集号渲染命名模板，与视频共用文件名主干并追加 language_format 语言后缀。
+
+        返回: (operations, file_tree, pairing)
+            pairing: {'paired': 数量, 'orphan_subs': [...], 'videos_without_subs': [...]}
+        """
+        entries = []
+        releases = {}
+        videos_by_stem = {}
+        videos_by_episode = {}
+        for file in files:
+            file_path = Path(file['name'])
+
+            # 检查是否包含忽略关键词
+            if self._is_ignored_file(file_path):
+                logger.debug("⏭️ 跳过含忽略关键词的文件: %s", file_path.name, extra={'file': file_path})
+                skip_stats['keyword'] += 1
+                continue
+
+            # 检查文件类型
+            ext = file_path.suffix.lower()
+            is_video = ext in self.settings.video_exts
+            is_sub = ext in self.settings.sub_exts
+            if not (is_video or is_sub):
+                continue
+
+            release = releases[file_path] = parse_release_name(file_path.name)
+            episode = self._resolve_episode(file_path.name, release)
+            entries.append((file_path, is_video, episode))
+            if is_video:
+                videos_by_stem.setdefault((file_path.parent, file_path.stem.lower()), file_path)
+                if episode:
+                    videos_by_episode.setdefault((file_path.parent, episode), []).append(file_path)
+
+        # 第一步：视频命名
+        video_names = {}
+        video_episodes = {}
+        for file_path, is_video, episode in entries:
+            if is_video and episode:
+                video_episodes[file_path] = episode
+                new_name = self.generate_new_name(
+                    file_path, prefix, season, custom_str, True, subgroup_tag,
+                    episode=episode, release=releases[file_path]
+                )
+                if new_name:
+                    video_names[file_path] = new_name
+
+        # 第二步：字幕配对并按原顺序生成操作
+        operations = []
+        file_tree = {}
+        pairing = {'paired': 0, 'orphan_subs': [], 'videos_without_subs': []}
+        videos_with_subs = set()
+        for file_path, is_video, episode in entries:
+            if is_video:
+                new_name = video_names.get(file_path)
+            else:
+                video = self._match_video(file_path, episode, videos_by_stem, videos_by_episode)
+                if video in video_names:
+                    # 使用视频的集号渲染同一模板，字幕与视频只差语言后缀与扩展名
+                    new_name = self.generate_new_name(
+                        file_path, prefix, season, custom_str, False, subgroup_tag,
+                        episode=video_episodes[video], release=releases[file_path]
+                    )
+                    videos_with_subs.add(video)
+                    pairing['paired'] += 1
+                else:
+                    # 孤立字幕：无对应视频时按自身文件名独立命名
+                    pairing['orphan_subs'].append(file_path.name)
+                    new_name = self.generate_new_name(
+                        file_path, prefix, season, custom_str, False, subgroup_tag,
+                        episode=episode, release=releases[file_path]
+                    )
+            if not new_name:
+                continue
+
+            operations.append(self._build_operation(mode, workspace, file_path, new_name))
+            self.metrics.inc('files_planned_total', type='video' if is_video else 'subtitle')
+            file_tree[file_path.name] = {
+                'type': 'video' if is_video else 'sub',
+                'new_name': new_name,
+                'original_path': str(file_path),
+                'subgroup': subgroup_tag
+            }
+
+        pairing['videos_without_subs'] = [v.name for v in video_names if v not in videos_with_subs]
+        return operations, file_tree, pairing
+
+    @staticmethod
+    def _release_identity(t_idx, src):
+        """来源文件所属的发布：(所在种子与目录, 字幕组, 版本)"""
+        src = Path(src)
+        release = parse_release_name(src.name)
+        subgroup = (release.subgroup or parse_release_name(src.parent.name).subgroup).lower()
+        return (t_idx, src.parent), subgroup, int(release.version or 1)
+
+    def _release_rank(self, src, size):
+        """按 duplicate_policy 生成来源文件的排序键（越大越优先）"""
+        _, subgroup, version = self._release_identity(None, src)
+        preferred = self.settings.preferred_subgroups
+        criteria = {
+            'version': version,
+            'size': size or 0,
+            'subgroup': len(preferred) - preferred.index(subgroup) if subgroup in preferred else 0,
+        }
+        return tuple(criteria[c] for c in DUPLICATE_POLICIES[self.settings.duplicate_policy])
+
+    def _drop_duplicate_releases(self, all_operations):
+        """同一目标文件只保留一个来源，其余在任何数据移动之前从操作列表中移除
+
+        copy/move 按工作目录中的目标路径分组（跨种子、跨实例），重命名按种子内的目标路径分组；
+        目标路径由 (前缀, 季号, 集号, 语言) 渲染而来，同组即同一集的同一语言版本。
+        每集先按策略选出胜出的视频，字幕优先保留与该视频同一发布（同目录、字幕组、版本）的来源，
+        避免视频与字幕分别来自不同发布。
+        返回: [(被丢弃的源, 目标, 保留的源)]
+        """
+        if self.settings.duplicate_policy == 'off':
+            return []
+        groups = {}     # (范围, 目标) → [(排序键, 种子序号, 操作序号)]
+        for t_idx, torrent in enumerate(all_operations):
+            sizes = torrent.get('sizes', {})
+            scope = (torrent.get('instance'), torrent.get('hash'))
+            for op_idx, (op_type, src, dst) in enumerate(torrent['operations']):
+                target = (None if op_type in ('copy', 'move') else scope, str(dst).casefold())
+                groups.setdefault(target, []).append((self._release_rank(src, sizes.get(src)), t_idx, op_idx))
+
+        def source(candidate):
+            return all_operations[candidate[1]]['operations'][candidate[2]][1]
+
+        def stem_of(target):
+            return target[0], str(Path(target[1]).with_suffix(''))
+
+        def by_rank(candidates):
+            # 稳定排序：条件相同时保留先规划的来源
+            return sorted(candidates, key=lambda c: c[0], reverse=True)
+
+        # 第一步：每集（视频目标去掉扩展名）选出胜出的视频及其发布
+        episode_release = {}
+        video_exts = self.settings.video_exts
+        for target, candidates in groups.items():
+            if Path(target[1]).suffix in video_exts:
+                winner = by_rank(candidates)[0]
+                episode_release[stem_of(target)] = self._release_identity(winner[1], source(winner))
+
+        # 第二步：字幕目标逐级去掉语言等后缀找到所属的集，优先同一发布的来源
+        def ranked(target, candidates):
+            scope, stem = stem_of(target)
+            while (scope, stem) not in episode_release and Path(stem).suffix:
+                stem = str(Path(stem).with_suffix(''))
+            preferred = episode_release.get((scope, stem))
+            if preferred is None:
+                return by_rank(candidates)
+
+            def affinity(candidate):
+                location, subgroup, version = self._release_identity(candidate[1], source(candidate))
+                return location == preferred[0], subgroup == preferred[1], version == preferred[2]
+            return sorted(candidates, key=lambda c: (affinity(c), c[0]), reverse=True)
+
+        dropped = []
+        losers = set()
+        for target, candidates in groups.items():
+            if len(candidates) < 2:
+                continue
+            if Path(target[1]).suffix in video_exts:
+                candidates = by_rank(candidates)
+            else:
+                candidates = ranked(target, candidates)
+            winner = source(candidates[0])
+            for _, t_idx, op_idx in candidates[1:]:
+                _, src, dst = all_operations[t_idx]['operations'][op_idx]
+                losers.add((t_idx, op_idx))
+                dropped.append((src, dst, winner))
+
+        if losers:
+            for t_idx, torrent in enumerate(all_operations):
+                torrent['operations'] = [op for op_idx, op in enumerate(torrent['operations'])
+                                         if (t_idx, op_idx) not in losers]
+            all_operations[:] = [t for t in all_operations if t['operations']]
+        return dropped
+
+    def _lookup_series(self, title, category, subgroup):
+        """查询剧集记忆（未启用时返回 None）"""
+        if self.series_memory is None or not title:
+            return None
+        return self.series_memory.lookup(title, category, subgroup)
+
+    @staticmethod
+    def _common_root(files):
+        """种子内所有文件的公共上级目录；单文件种子为该文件所在目录"""
+        if not files:
+            return Path('.')
+        common = Path(files[0].name).parent.parts
+        for f in files[1:]:
+            parts = Path(f.name).parent.parts
+            size = 0
+            while size < min(len(common), len(parts)) and common[size] == parts[size]:
+                size += 1
+            common = common[:size]
+            if not common:
+                break
+        return Path(*common) if common else Path('.')
+
+    def _collect_torrent_dirs(self, files, max_depth, dir_excluder, skip_stats):
+        """按目录深度分组种子文件
+
+        返回: (deep_dirs, root_files)
+            deep_dirs: {目录: {'files': [...], ...}}，深度 1..max_depth 且不在排除列表中的目录
+            root_files: 没有深层目录时的根目录文件
+        """
+        # 收集所有需要处理的深层目录（depth > 0）
+        base_path = Path(files[0].name).parent if files else Path('.')
+        # 排除规则相对种子根目录（所有文件的公共上级）判定，与首个文件位于哪个子目录无关
+        torrent_root = self._common_root(files)
+        deep_dirs = {}
+        excluded = {}   # 本种子的目录排除判定缓存
+
+        # 扫描所有深层目录（depth > 0且不超过max_depth），排除特定文件夹
+        for f in files:
+            try:
+                f_path = Path(f.name)
+                current_depth = len(f_path.parts) - len(base_path.parts)
+                if 1 <= current_depth <= max_depth:  # 只处理深度>0的目录
+                    dir_path = f_path.parent
+
+                    # 检查目录及其上级是否在排除列表中（整棵子树在逐文件处理前被跳过）
+                    if dir_excluder.is_excluded(dir_path, torrent_root, excluded):
+                        logger.debug("⏭️ 跳过排除目录: %s", dir_path)
+                        skip_stats['excluded_dir'] += 1
+                        continue
+
+                    if dir_path not in deep_dirs:
+                        deep_dirs[dir_path] = {
+                            'files': [],
+                            'needs_custom': False
+                        }
+                    deep_dirs[dir_path]['files'].append(f)
+            except Exception as e:
+                logger.debug("⚠️ 处理文件路径出错: %s → %s", f.name, e)
+                continue
+
+        # 如果没有深层目录，检查是否有根目录文件需要处理
+        root_files = []
+        if not deep_dirs:
+            for f in files:
+                try:
+                    f_path = Path(f.name)
+                    if len(f_path.parts) - len(base_path.parts) == 0:  # 根目录文件
+                        root_files.append(f)
+                except Exception as e:
+                    logger.debug("⚠️ 处理文件路径出错: %s → %s", f.name, e)
+                    continue
+
+
+        return deep_dirs, root_files
+
+    def _rule_params(self, title, category, subgroup, season, suggested_prefix):
+        """非交互模式的命名参数：优先使用剧集记忆，否则按推断结果推导；名称中明确的季号优先"""
+        remembered = self._lookup_series(title, category, subgroup)
+        if remembered:
+            params = dict(remembered, season=season or remembered['season'])
+        else:
+            params = {
+                'prefix': suggested_prefix,
+                'season': season or '01',
+                'custom': '',
+                'subgroup': subgroup
+            }
+        if not self.settings.subgroup_mode:
+            params['subgroup'] = ''
+        return params
+
+    @staticmethod
+    def _dir_series_title(hint, series_title):
+        """目录所属剧集的标题：目录名带季号或像独立剧集名时为目录标题，
+        否则（Disc 1、Vol.1、Menu、BDMV 等）沿用种子标题"""
+        title = hint.title
+        if not title or SeriesMemory.normalize(title) == SeriesMemory.normalize(series_title):
+            return series_title
+        if hint.season or (not NON_SERIES_DIR_RE.match(title) and re.search(r'[^\W\d_]{2}', title)):
+            return title
+        return series_title
+
+    def _infer_dir_params(self, hint, base, series_title, subgroup_enabled, remembered=None):
+        """按目录名推断一个深层目录的命名参数
+
+        季号：目录名中的季号 > 剧集记忆 > 种子参数；前缀：剧集记忆 > 种子参数（目录属于
+        另一部剧集时使用目录标题，见 _dir_series_title）；字幕组：剧集记忆 > 目录开头的 [字幕组] > 种子参数。
+        """
+        remembered = remembered or {}
+        dir_title = self._dir_series_title(hint, series_title)
+        subgroup = remembered.get('subgroup') or hint.subgroup or base['subgroup']
+        return {
+            'prefix': remembered.get('prefix') or (base['prefix'] if dir_title == series_title else dir_title[:50]),
+            'season': hint.season or remembered.get('season') or base['season'],
+            'custom': remembered['custom'] if 'custom' in remembered else base['custom'],
+            'subgroup': subgroup if subgroup_enabled else ''
+        }
+
+    def plan_torrent(self, torrent, files, mode='pre', workspace=None, instance='default', skip_stats=None):
+        """规划单个种子：有深层目录时按目录名推断各自的参数，否则处理根目录文件
+
+        torrent 至少包含 name（可选 hash/category/tags/save_path），files 为 {'name', 'size', 'progress'}
+        记录；参数优先使用剧集记忆，否则按名称推断。同一种子内的重复发布已去除。
+
+        返回: {'torrent', 'files', 'instance', 'mode', 'workspace', 'already_processed', 'filtered', 'params',
+               'operations', 'entries': [{'file', 'new_name', 'type'}], 'duplicates', 'skipped'}
+        """
+        plan = self._plan_torrent(torrent, files, mode, workspace, instance, skip_stats)
+        self._drop_plan_duplicates([plan])
+        return plan
+
+    def plan_batch(self, records, mode='pre', workspace=None):
+        """批量规划：records 为 [(torrent, files)] 或 [(torrent, files, instance)]
+
+        逐个种子规划后统一去除跨种子的重复发布（copy/move 的目标在同一工作目录）。
+        返回: (plans, duplicates)，plans 与 records 一一对应
+        """
+        plans = []
+        for torrent, files, *instance in records:
+            plans.append(self._plan_torrent(torrent, files, mode, workspace, *instance))
+        self._drop_plan_duplicates(plans)
+        return plans, [d for plan in plans for d in plan['duplicates']]
+
+    def _plan_torrent(self, torrent, files, mode, workspace, instance='default', skip_stats=None):
+        torrent = torrent if isinstance(torrent, AttrDict) else AttrDict(torrent)
+        files = [f if isinstance(f, AttrDict) else AttrDict(f) for f in files]
+        settings = self.settings
+        skip_stats = Counter() if skip_stats is None else skip_stats
+        plan = {
+            'torrent': torrent, 'files': files, 'instance': instance, 'mode': mode, 'workspace': workspace,
+            'already_processed': False, 'filtered': None, 'params': None, 'operations': [], 'entries': [],
+            'duplicates': [], 'skipped': skip_stats
+        }
+        tags = {t.strip() for t in torrent.get('tags', '').split(',')}
+        if settings.skip_processed and settings.processed_tag in tags:
+            plan['already_processed'] = True
+            return plan
+
+        deep_dirs, root_files = self._collect_torrent_dirs(
+            files, settings.max_dir_depth, settings.dir_excluder, skip_stats
+        )
+        category = torrent.get('category') or ''
+        torrent_hint = infer_series(torrent.name)
+        series_title = torrent_hint.title or torrent.name
+        suggested_prefix = category or (torrent_hint.title or torrent.name.strip())[:30]
+        base = self._rule_params(series_title, category, torrent_hint.subgroup,
+                                 torrent_hint.season, suggested_prefix)
+
+        # 与交互流程一致：有深层目录时按目录名推断各自的参数，否则处理根目录文件
+        groups = []
+        if deep_dirs:
+            for dir_path in sorted(deep_dirs, key=str):
+                hint = infer_series(dir_path.name)
+                params = self._infer_dir_params(
+                    hint, base, series_title, settings.subgroup_mode,
+                    self._lookup_series(self._dir_series_title(hint, series_title), category,
+                                        hint.subgroup or torrent_hint.subgroup)
+                )
+                groups.append((dir_path, deep_dirs[dir_path]['files'], params))
+        elif root_files:
+            groups.append((None, root_files, base))
+
+        planned_groups = []
+        for dir_path, group_files, params in groups:
+            planned, file_tree, _ = self._plan_files(
+                group_files, mode, workspace, params['prefix'], params['season'],
+                params['custom'], params['subgroup'], skip_stats
+            )
+            planned_groups.append((dir_path, params, planned))
+            plan['entries'].extend(
+                {'file': info['original_path'], 'new_name': info['new_name'], 'type': info['type']}
+                for info in file_tree.values()
+            )
+        plan['operations'], plan['duplicates'] = self._arrange_direct_operations(mode, planned_groups, files)
+        if plan['duplicates']:
+            dropped_sources = {src for src, _, _ in plan['duplicates']}
+            plan['entries'] = [e for e in plan['entries'] if e['file'] not in dropped_sources]
+        plan['params'] = groups[0][2] if groups else None
+        return plan
+
+    def _arrange_direct_operations(self, mode, groups, files):
+        """合并各组操作；direct 模式且 direct_layout=season 时改为目录结构整理
+
+        返回: (操作列表, 整理时按最终位置去除的重复发布 [(被丢弃的源, 目标, 保留的源)])
+        """
+        if mode == 'direct' and self.settings.direct_layout == 'season':
+            return self._plan_folder_layout(groups, files)
+        return [op for _, _, operations in groups for op in operations], []
+
+    def _plan_folder_layout(self, groups, files):
+        """direct 模式整理为 Emby 目录结构 <前缀>/Season NN/<新文件名>
+
+        先用 rename_folder 由深到浅把各组目录改为 Season NN，最后把种子根目录改为前缀，
+        未参与重命名的文件随目录一起移动；之后每个文件只需一次 rename（按目录重命名后的位置）。
+        目标目录冲突的组与根目录文件退回逐文件移动；同一种子内有多个不同前缀时保持原结构。
+
+        各组文件最终都落在 前缀/Season NN/ 下，重复发布按最终位置（而非整理前的目录）比较去除。
+
+        groups: [(目录，None 表示根目录文件, 参数, 该组的 rename 操作)]
+        返回: (操作列表，rename_folder 在前, 被去除的重复发布)
+        """
+        groups = [g for g in groups if g[2]]
+        operations = [op for _, _, ops in groups for op in ops]
+        prefixes = {params['prefix'] for _, params, _ in groups}
+        series = self._sanitize_filename(prefixes.pop()).strip(' .') if len(prefixes) == 1 else ''
+        if not series:
+            return operations, []
+        top = PurePosixPath(series)
+
+        def season_dir(group):
+            return f"Season {group[1]['season']}"
+
+        batch = [{'sizes': {f.name: f.get('size', 0) for f in files}, 'operations': [
+            ('rename', src, str(top / season_dir(group) / Path(dst).name)) for group in groups for _, src, dst in group[2]
+        ]}]
+        dropped = self._drop_duplicate_releases(batch)
+        if dropped:
+            losers = {src for src, _, _ in dropped}
+            groups = [(d, params, [op for op in ops if op[1] not in losers]) for d, params, ops in groups]
+
+        paths = [PurePosixPath(Path(f.name).as_posix()) for f in files]
+        tops = {p.parts[0] for p in paths}
+        root = PurePosixPath(tops.pop()) if len(tops) == 1 and all(len(p.parts) > 1 for p in paths) else None
+        folders = {parent for p in paths for parent in p.parents}
+        here = root or PurePosixPath('.')
+
+        def group_dir(group):
+            return PurePosixPath(Path(group[0]).as_posix()) if group[0] is not None else here
+
+        moves = []      # (原目录, 新目录)，按执行顺序
+        if root is not None and len(groups) == 1 and group_dir(groups[0]) == root:
+            # 只有根目录一组：根目录直接成为 前缀/Season NN
+            moves.append((root, top / season_dir(groups[0])))
+        else:
+            taken = set()
+            for group in sorted(groups, key=lambda g: len(group_dir(g).parts), reverse=True):
+                current = group_dir(group)
+                target = (root or top) / season_dir(group)
+                if current == here or target in taken or (target != current and target in folders):
+                    continue
+                taken.add(target)
+                if target != current:
+                    moves.append((current, target))
+            if root is not None and root != top:
+                moves.append((root, top))
+
+        def relocate(path):
+            for old, new in moves:
+                if path == old or old in path.parents:
+                    path = new / path.relative_to(old)
+            return path
+
+        arranged = [('rename_folder', str(old), str(new)) for old, new in moves]
+        for group in groups:
+            final_dir = top / season_dir(group)
+            for _, src, dst in group[2]:
+                current = relocate(PurePosixPath(Path(src).as_posix()))
+                target = final_dir / Path(dst).name
+                if current != target:
+                    arranged.append(('rename', str(current), str(target)))
+        return arranged, dropped
+
+    def _drop_plan_duplicates(self, plans):
+        """对一组计划去除重复发布，并同步各计划的操作、预览条目与 duplicates"""
+        batch = [{'hash': plan['torrent'].get('hash'), 'instance': plan['instance'], 'operations': plan['operations'],
+                  'sizes': {f.name: f.get('size', 0) for f in plan['files']}} for plan in plans]
+        dropped = self._drop_duplicate_releases(list(batch))
+        if dropped:
+            for plan, item in zip(plans, batch):
+                removed = {(src, dst) for _, src, dst in set(plan['operations']) - set(item['operations'])}
+                if not removed:
+                    continue
+                plan['operations'] = item['operations']
+                plan['entries'] = [e for e in plan['entries'] if e['file'] not in {src for src, _ in removed}]
+                plan['duplicates'] = plan['duplicates'] + [d for d in dropped if (d[0], d[1]) in removed]
+        return dropped
+
+
+class QBitRenamer(Planner):
+    # 逗号分隔列表类配置项 → 显示名称
+    NAME_LIST_KEYS = {
+        'excluded_dirs': '排除目录',
+        'ignored_keywords': '忽略关键词'
+    }
+
+    def __init__(self, debug=None, log_json=None, interactive=True, recorder=None, replay=None):
+        self.debug = False
+        self.interactive = interactive
+        self.recorder = recorder    # SessionRecorder：记录 API 调用到回放文件
+        self.replay = replay        # {实例名: ReplayClient}：使用回放文件代替真实连接
+        configure_logging(bool(debug))
+        self._init_console_encoding()
+        self.config = configparser.ConfigParser()
+        self._init_config()
+        self.load_config()
+        
+        if replay is None and not self._check_first_run():
+            if not interactive:
+                raise SystemExit("❌ 尚未配置qBittorrent凭据，请先以交互模式运行一次")
+            self.setup_credentials()
+        
+        self.debug = debug if debug is not None else self.settings.debug_mode
+        configure_logging(self.debug, log_json if log_json is not None else self.settings.log_file)
+        logger.info("🛠️ 初始化完成")
+        self.client = None
+        self.clients = {}       # 实例名 → 已连接的客户端，self.client 为其中第一个
+        Planner.__init__(self, self.settings, Metrics(), self._init_series_memory())
+        
+    def _init_series_memory(self):
+        """打开剧集参数记忆库（与配置文件同目录）"""
+        if not self.settings.series_memory:
+            return None
+        path = os.path.splitext(CONFIG['CONFIG_FILE'])[0] + '_series.db'
+        try:
+            return SeriesMemory(path)
+        except sqlite3.Error as e:
+            print(f"⚠️ 无法打开剧集记忆库: {e}")
+            return None
+
+    def _refresh_settings(self):
+        """根据当前配置重建运行时快照"""
+        self.settings = RuntimeSettings.from_config(self.config)
+
+    def _check_first_run(self):
+        required_keys = ['host', 'username', 'password']
+        for key in required_keys:
+            if not self.config['QBITTORRENT'].get(key):
+                print("\n🔐 首次使用需要设置qBittorrent WebUI凭据")
+                return False
+        return True
+
+    def _init_console_encoding(self):
+        try:
+            if sys.platform == 'win32':
+                import _locale
+                _locale._gdl_bak = _locale._getdefaultlocale
+                _locale._getdefaultlocale = lambda *args: ('en_US', 'utf-8')
+            sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+        except Exception as e:
+            print(f"⚠️ 无法设置控制台编码: {e}")
+
+    def _init_config(self):
+        self.config['QBITTORRENT'] = {
+            ';host': 'qBittorrent WebUI访问地址',
+            'host': 'localhost:8080',
+            ';username': 'WebUI登录用户名',
+            'username': 'admin',
+            ';password': 'WebUI登录密码',
+            'password': 'adminadmin',
+            ';default_tag': '默认处理的种子标签',
+            'default_tag': 'anime',
+            ';processed_tag': '处理完成的种子标签',
+            'processed_tag': 'processed',
+            ';default_category': '仅处理此分类的种子 (留空不限制)',
+            'default_category': '',
+            ';max_concurrency': '对此实例同时进行的API请求数上限 (也是连接池大小; 启用自适应并发时实际并发在1到此值之间调整)',
+            'max_concurrency': '4',
+            ';request_timeout': 'API请求超时秒数，超时的实例不会拖住其他实例',
+            'request_timeout': '30',
+            ';connect_timeout': '建立连接的超时秒数，无法访问的实例在此时间后即放弃，不等待完整的请求超时',
+            'connect_timeout': '5'
+        }
+        self.config['SETTINGS'] = {
+            ';default_mode': '操作模式: direct(直接重命名) | copy(复制) | move(移动) | pre(试运行)',
+            'default_mode': 'direct',
+            ';workspace': '文件输出目录 (仅copy/move模式需要)',
+            'workspace': str(Path.home() / 'Anime_Renamed'),
+            ';auto_tag_processed': '处理后自动添加processed标签 (true/false)',
+            'auto_tag_processed': 'true',
+            ';skip_processed': '跳过已处理标签的种子 (true/false)',
+            'skip_processed': 'true',
+            ';completed_only': '只获取已下载完成的种子 (由服务端过滤, true/false)',
+            'completed_only': 'true',
+            ';page_size': '分页获取种子列表时每页数量',
+            'page_size': '100',
+            ';dry_run_first': '首次运行默认试运行模式 (true/false)',
+            'dry_run_first': 'true',
+            ';debug_mode': '显示详细调试信息 (true/false)',
+            'debug_mode': 'false',
+            ';episode_regexes': '集数匹配正则表达式列表（每行一个，按顺序尝试）',
+            ';episode_source': '集号识别顺序: auto(修改过集数正则时正则优先，否则文件名词法分析优先) | lexer(词法分析优先) | regex(正则优先)',
+            'episode_source': 'auto',
+            'episode_regexes': '\n'.join([
+                r'\[(\d{2})\][^\\/]*$',
+                r'\b(\d{2})\b',
+                r'E(\d{2})',
+                r'第(\d{2})话',
+                r'EP?(\d{2})',
+                r'- (\d{2}) -',
+                r'_(\d{2})_',
+                r' (\d{2}) '
+            ]),
+            ';scan_subdirs': '扫描子目录中的文件 (true/false)',
+            'scan_subdirs': 'true',
+            ';subgroup_mode': '是否启用字幕组标记功能 (true/false)',
+            'subgroup_mode': 'false',
+            ';max_dir_depth': '最大子目录扫描深度 (默认为1)',
+            'max_dir_depth': CONFIG['DEFAULT_MAX_DIR_DEPTH'],
+            ';excluded_dirs': '要跳过的文件夹列表(逗号分隔,不区分大小写,其下所有子目录一并跳过; 支持通配符如 Scan*, 含/时按相对种子根目录的路径匹配如 */Menu)',
+            'excluded_dirs': CONFIG['DEFAULT_EXCLUDED_DIRS'],
+            ';ignored_keywords': '文件名含这些关键词时跳过(逗号分隔,不区分大小写; 只在单独的括号组、带编号、集号位置或文件名末尾时命中，如[SP]、SP01、- OVA、Specials，标题中的普通单词不算)',
+            'ignored_keywords': CONFIG['DEFAULT_IGNORED_KEYWORDS'],
+            ';series_memory': '记住每部剧集上次使用的前缀/季号/自定义标识/字幕组并作为默认值 (true/false)',
+            'series_memory': 'true',
+            ';series_memory_auto': '命中记忆时直接套用参数，不再逐项询问 (true/false)',
+            'series_memory_auto': 'false',
+            ';verify_copies': 'copy/move时边复制边计算校验值并与目标文件比对，结果记录到工作目录索引 (true/false)',
+            'verify_copies': 'false',
+            ';verify_algorithm': '校验算法 (blake2b/sha256/md5等hashlib支持的算法)',
+            'verify_algorithm': 'blake2b',
+            ';ssd_io_streams': 'copy/move时每块固态硬盘的并发文件流数',
+            'ssd_io_streams': '4',
+            ';hdd_io_streams': 'copy/move时每块机械硬盘(或无法识别的设备)的并发文件流数',
+            'hdd_io_streams': '1',
+            ';regex_time_budget_ms': '单次正则匹配的时间预算(毫秒)，超出的正则在本次运行中被隔离',
+            'regex_time_budget_ms': CONFIG['DEFAULT_REGEX_TIME_BUDGET_MS'],
+            ';metrics_port': '在 127.0.0.1 的此端口提供 Prometheus /metrics 端点 (0 表示不启用)',
+            'metrics_port': '0',
+            ';metrics_textfile': '运行结束时写入 Prometheus 指标的文件路径，供 node_exporter textfile collector 采集 (留空不写)',
+            'metrics_textfile': '',
+            ';adaptive_concurrency': '根据WebUI响应延迟与5xx/超时自动调整API并发数 (true/false)',
+            'adaptive_concurrency': 'true',
+            ';api_cache_ttl': '单轮处理内API读取结果的缓存秒数，写操作会使相关缓存立即失效 (0 表示不缓存)',
+            'api_cache_ttl': '60',
+            ';service_port': '--serve 规划服务监听的本地端口；--torrent 发现该端口上有服务时直接交给服务处理 (0 表示不转交)',
+            'service_port': '8766',
+            ';service_timeout': '--torrent 交给规划服务执行时最多等待的秒数，超时视为失败 (服务串行执行，避免挂起的进程无限堆积)',
+            'service_timeout': '300',
+            ';duplicate_policy': '多个来源生成同一目标文件时(v1/v2、不同字幕组)只保留一个: version(最高版本) | size(最大文件) | subgroup(优先字幕组) | off(不处理)',
+            'duplicate_policy': 'version',
+            ';preferred_subgroups': '字幕组优先级(逗号分隔,靠前优先)，用于 duplicate_policy=subgroup 及其他策略打平',
+            'preferred_subgroups': '',
+            ';direct_layout': '直接模式的目录结构: flat(只改文件名) | season(整理为 前缀/Season NN/，目录用 torrents_rename_folder 整体重命名)',
+            'direct_layout': 'flat',
+            ';log_file': 'JSON Lines 结构化日志文件路径 (含时间戳/种子哈希/文件/阶段; 调试模式下包含调试日志; 留空不写)',
+            'log_file': ''
+        }
+        self.config['NAMING'] = {
+            ';season_format': '季集格式 (可用变量: {season}-季号, {episode}-集号)',
+            'season_format': CONFIG['DEFAULT_SEASON_FORMAT'],
+            ';video_prefix': '视频文件前缀标记',
+            'video_prefix': '[Video]',
+            ';sub_prefix': '字幕文件前缀标记', 
+            'sub_prefix': '[Subtitle]',
+            ';language_format': '语言标识格式 (可用变量: {lang})',
+            'language_format': CONFIG['DEFAULT_LANGUAGE_FORMAT'],
+            ';custom_format': '文件名格式 (可用变量: {prefix} {season_ep} {season} {episode} {custom} {lang} {ext} {type_prefix}-视频/字幕前缀标记; 变量为空时其前面的分隔符及包裹它的括号如 [{custom}] 自动省略)',
+            'custom_format': CONFIG['DEFAULT_CUSTOM_FORMAT']
+        }
+        self.config['LANGUAGE'] = {
+            '; 语言检测规则说明': '格式: 匹配模式 = 语言标识',
+            '\\.chs&jap\\.': 'CHS&JP',
+            '\\.cht&jap\\.': 'CHT&JP',
+            '\\.jpsc\\.': 'JP&CHS', 
+            '\\.jptc\\.': 'JP&CHT',
+            '\\.sc\\.': 'CHS',
+            '\\.chs\\.': 'CHS',
+            '\\[简\\]': 'CHS',
+            '\\.tc\\.': 'CHT',
+            '\\.cht\\.': 'CHT',
+            '\\[繁\\]': 'CHT',
+            '\\.jap\\.': 'JP',
+            '\\.jp\\.': 'JP',
+            '\\.jpn\\.': 'JP',
+            '\\[日\\]': 'JP',
+            '\\.eng\\.': 'EN',
+            '\\.en\\.': 'EN',
+            '\\[英\\]': 'EN'
+        }
+
+    def load_config(self):
+        try:
+            if os.path.exists(CONFIG['CONFIG_FILE']):
+                self.config = configparser.ConfigParser(
+                    interpolation=None,
+                    allow_no_value=True,
+                    delimiters=('=',),
+                    inline_comment_prefixes=(';',)
+                )
+            
+                # 自定义读取器处理续行符
+                with open(CONFIG['CONFIG_FILE'], 'r', encoding='utf-8') as f:
+                    content = []
+                    continuation = False
+                    for line in f:
+                        line = line.rstrip('\n')
+                        if line.endswith('\\'):
+                            content.append(line.rstrip('\\').strip())
+                            continuation = True
+                        else:
+                            if continuation:
+                                content[-1] += ' ' + line.strip()
+                            else:
+                                content.append(line)
+                            continuation = False
+                    self.config.read_string('\n'.join(content))
+            
+                # 处理多行正则表达式
+                if self.config.has_option('SETTINGS', 'episode_regexes'):
+                    raw = self.config.get('SETTINGS', 'episode_regexes')
+                    self.config['SETTINGS']['episode_regexes'] = '\n'.join(
+                        [line.strip() for line in raw.splitlines() if line.strip()]
+                    )
+
+                # 旧版 {custom} 自带前导点号，紧跟在其他变量后时补上显式的点号分隔符
+                if self.config.has_option('NAMING', 'custom_format'):
+                    template = self.config.get('NAMING', 'custom_format')
+                    if '}{custom}' in template:
+                        self.config['NAMING']['custom_format'] = template.replace('}{custom}', '}.{custom}')
+                        logger.info("🔧 已升级命名模板: %s → %s", template,
+                                    self.config['NAMING']['custom_format'])
+            else:
+                logger.info("🆕 创建默认配置")
+                self.save_config()
+        except Exception as e:
+            logger.error("❌ 配置读取错误: %s", e)
+            self._backup_config()
+            self._init_config()
+        self._refresh_settings()
+
+    def _backup_config(self):
+        backup_path = CONFIG['CONFIG_FILE'] + '.bak'
+        try:
+            if os.path.exists(CONFIG['CONFIG_FILE']):
+                shutil.copyfile(CONFIG['CONFIG_FILE'], backup_path)
+                print(f"⚠️ 配置已损坏，已备份到: {backup_path}")
+        except Exception as e:
+            print(f"❌ 无法备份配置文件: {e}")
+
+    def save_config(self):
+        try:
+            with open(CONFIG['CONFIG_FILE'], 'w', encoding='utf-8') as f:
+                f.write("# 自动生成的配置文件\n")
+                f.write("# 以分号(;)开头的行是配置说明，程序会自动忽略\n\n")
+                for section in self.config.sections():
+                    f.write(f"[{section}]\n")
+                    for k, v in self.config[section].items():
+                        if k.startswith(';'):
+                            f.write(f"; {v}\n")
+                        else:
+                            # 修正正则表达式保存方式
+                            if section == 'SETTINGS' and k == 'episode_regexes':
+                                f.write(f"{k} = \n")
+                                for line in v.split('\n'):
+                                    f.write(f"    {line}\n")
+                            else:
+                                f.write(f"{k} = {v}\n")
+                    f.write("\n")
+                logger.debug("💾 配置已保存到: %s", CONFIG['CONFIG_FILE'])
+        except Exception as e:
+            print(f"❌ 配置保存失败: {e}")
+        self._refresh_settings()
+
+    def show_config(self):
+        print("\n📋 当前配置说明:")
+        section_helps = {
+            'QBITTORRENT': 'qBittorrent连接设置 (可添加 [QBITTORRENT:名称] 配置节同时处理多个实例，含 host/username/password/max_concurrency/request_timeout/connect_timeout)',
+            'SETTINGS': '程序行为设置',
+            'NAMING': '文件名格式设置',
+            'LANGUAGE': '语言检测规则'
+        }
+        for section in self.config.sections():
+            section_help = '附加qBittorrent实例' if section.startswith(INSTANCE_SECTION_PREFIX) else section_helps.get(section, '')
+            print(f"\n[{section}] {section_help}")
+            for key in [k for k in self.config[section] if not k.startswith(';')]:
+                value = self.config[section][key]
+                help_text = self.config[section].get(f';{key}', '')
+                print(f"  {key:20} = {value}")
+                if help_text:
+                    print(f"    {help_text}")
+        
+        # 特别显示排除目录与忽略关键词设置
+        if 'SETTINGS' in self.config:
+            for key, title in self.NAME_LIST_KEYS.items():
+                if key in self.config['SETTINGS']:
+                    print(f"\n🔍 当前{title}设置:")
+                    items = self.config['SETTINGS'][key].split(',')
+                    print(" , ".join([d.strip() for d in items if d.strip()]))
+
+    def _edit_name_list(self, section, key, default):
+        """交互式编辑逗号分隔的名称列表（排除目录/忽略关键词）"""
+        title = self.NAME_LIST_KEYS[key]
+        print(f"\n🛑 {title}设置")
+        print("-"*40)
+        current_value = self.config[section].get(key, default)
+        items = [d.strip() for d in current_value.split(',') if d.strip()]
+        print(f"当前{title}: " + ", ".join(items) if items else "无")
+
+        while True:
+            action = input("\n操作: [a]添加 [d]删除 [c]清除 [s]设置新列表 [回车继续]: ").lower().strip()
+            if not action:
+                break
+                
+            if action == 'a':  # 添加
+                to_add = input("输入要添加的项(多个用逗号分隔): ").strip()
+                if to_add:
+                    current = set(items)
+                    current.update([d.strip() for d in to_add.split(',') if d.strip()])
+                    items = sorted(current)
+                    print("更新后列表:", ", ".join(items))
+                    
+            elif action == 'd':  # 删除
+                if not items:
+                    print("⚠️ 当前没有可删除的项")
+                    continue
+                print(f"当前{title}:", ", ".join(f"[{i}] {d}" for i, d in enumerate(items)))
+                try:
+                    to_remove = input("输入要删除的编号或名称(多个用空格分隔): ").strip()
+                    if to_remove:
+                        indices = set()
+                        names = set()
+                        for item in to_remove.split():
+                            if item.isdigit():
+                                idx = int(item)
+                                if 0 <= idx < len(items):
+                                    indices.add(idx)
+                            else:
+                                names.add(item.lower())
+                        
+                        # 保留不在删除列表中的项目
+                        new_list = [
+                            d for i, d in enumerate(items)
+                            if i not in indices and d.lower() not in names
+                        ]
+                        if len(new_list) != len(items):
+                            items = new_list
+                            print("更新后列表:", ", ".join(items) if items else "空")
+                except Exception as e:
+                    print(f"⚠️ 输入错误: {e}")
+                    
+            elif action == 'c':  # 清除
+                if input(f"确认清除所有{title}? (y/n): ").lower() == 'y':
+                    items = []
+                    print(f"已清除所有{title}")
+                    
+            elif action == 's':  # 设置新列表
+                new_list = input(f"输入新的{title}列表(逗号分隔): ").strip()
+                if new_list:
+                    items = [d.strip() for d in new_list.split(',') if d.strip()]
+                    print("更新后列表:", ", ".join(items) if items else "空")
+                    
+        # 保存修改后的列表
+        self.config[section][key] = ", ".join(items)
+
+    def _edit_section(self, section):
+        print(f"\n编辑 [{section}] 配置")
+        print("="*60)
+        
+        # 显示当前配置
+        for key in [k for k in self.config[section] if not k.startswith(';')]:
+            value = self.config[section][key]
+            help_text = self.config[section].get(f';{key}', '')
+            print(f"{key:20} = {value}")
+            if help_text:
+                print(f"  {help_text}")
+        
+        # 特殊处理SETTINGS节的排除目录与忽略关键词
+        if section == 'SETTINGS':
+            self._edit_name_list(section, 'excluded_dirs', CONFIG['DEFAULT_EXCLUDED_DIRS'])
+            self._edit_name_list(section, 'ignored_keywords', CONFIG['DEFAULT_IGNORED_KEYWORDS'])
+
+        # 语言表特殊编辑界面
+        if section == 'LANGUAGE':
+            print("\n🛠️ 语言表编辑模式 (输入格式: 模式 原内容=新内容)")
+            print("模式: replace(替换)/delete(删除)/add(添加)")
+            print("示例:")
+            print("  replace \\.chs\\.=CHS → 替换现有规则")
+            print("  delete \\.chs\\.=CHS → 删除规则")
+            print("  add \\.french\\.=FR → 添加新规则")
+            
+            while True:
+                try:
+                    edit_cmd = input("\n输入编辑命令 (留空结束): ").strip()
+                    if not edit_cmd:
+                        break
+                        
+                    parts = edit_cmd.split(maxsplit=1)
+                    if len(parts) < 2:
+                        print("⚠️ 格式错误，需要包含模式和内容")
+                        continue
+                        
+                    mode = parts[0].lower()
+                    content = parts[1]
+                    
+                    if mode not in ('replace', 'delete', 'add'):
+                        print("⚠️ 无效模式，请使用replace/delete/add")
+                        continue
+                        
+                    if '=' not in content:
+                        print("⚠️ 需要包含等号(=)分隔键值")
+                        continue
+                        
+                    key, value = content.split('=', 1)
+                    key = key.strip()
+                    value = value.strip()
+                    
+                    if mode == 'delete':
+                        if key not in self.config[section] or self.config[section][key] != value:
+                            print("⚠️ 规则不存在或不匹配")
+                            continue
+                            
+                        print(f"将删除: {key} = {value}")
+                        if input("确认删除? (y/n): ").lower() == 'y':
+                            del self.config[section][key]
+                            print("✅ 已删除")
+                            
+                    elif mode == 'add':
+                        if not (key.startswith('\\') or key.startswith('[')):
+                            print("⚠️ 键应以\\.或\\[开头")
+                            continue
+                            
+                        if key in self.config[section]:
+                            print("⚠️ 键已存在")
+                            continue
+
+                        try:
+                            re.compile(key)
+                        except re.error as e:
+                            print(f"⚠️ 无效正则表达式: {e}")
+                            continue
+                        if not self._confirm_regex_safety(key):
+                            continue
+                            
+                        print(f"将添加: {key} = {value}")
+                        if input("确认添加? (y/n): ").lower() == 'y':
+                            self.config[section][key] = value
+                            print("✅ 已添加")
+                            
+                    elif mode == 'replace':
+                        if key not in self.config[section]:
+                            print("⚠️ 原规则不存在")
+                            continue
+                            
+                        print(f"将替换: {key} = {self.config[section][key]} → {value}")
+                        if input("确认替换? (y/n): ").lower() == 'y':
+                            self.config[section][key] = value
+                            print("✅ 已替换")
+                            
+                except Exception as e:
+                    print(f"❌ 处理出错: {e}")
+                    logger.debug("配置编辑出错", exc_info=True)
+                    continue
+        
+        # 常规配置项编辑
+        while True:
+            key = input("\n输入要修改的键名 (留空结束编辑): ").strip()
+            if not key:
+                break
+                
+            if key not in self.config[section] or key.startswith(';'):
+                print("⚠️ 无效键名")
+                continue
+                
+            # 跳过已特殊处理的键
+            if (section == 'SETTINGS' and key in self.NAME_LIST_KEYS) or \
+            (section == 'LANGUAGE' and not key.startswith(';')):
+                continue
+                
+            current_value = self.config[section][key]
+            
+            # 处理多行值（如正则表达式列表）
+            if key == 'episode_regexes' and section == 'SETTINGS':
+                print(f"\n当前 {key} 值 (多行):")
+                print("-"*40)
+                print(current_value)
+                print("-"*40)
+                print("输入新的正则表达式列表（每行一个，空行结束）:")
+                lines = []
+                while True:
+                    line = input(f"正则 {len(lines)+1}: ").strip()
+                    if not line:
+                        break
+                    try:
+                        re.compile(line)  # 验证正则表达式
+                    except re.error as e:
+                        print(f"⚠️ 无效正则表达式: {e}")
+                        continue
+                    if self._confirm_regex_safety(line):
+                        lines.append(line)
+                        
+                if lines:
+                    new_value = '\n'.join(lines)
+                    print(f"\n新值预览:")
+                    print("-"*40)
+                    print(new_value)
+                    print("-"*40)
+                    if input("确认更新? (y/n): ").lower() == 'y':
+                        self.config[section][key] = new_value
+                        print("✅ 已更新")
+                continue
+                
+            # 处理布尔值
+            if current_value.lower() in ('true', 'false'):
+                new_value = input(f"切换 {key} 值 (当前: {current_value}) [y/n]: ").lower()
+                new_value = 'true' if new_value == 'y' else 'false'
+            else:
+                new_value = input(f"输入 {key} 的新值 (当前: {current_value}): ").strip()
+                
+            if new_value:
+                self.config[section][key] = new_value
+                print(f"✅ 已更新 {key} = {new_value}")
+        
+        save = input("\n是否保存更改? (y/n): ").lower() == 'y'
+        if save:
+            self.save_config()
+            print("✅ 配置已保存")
+        else:
+            print("⏹️ 更改已丢弃")
+
+    def _confirm_regex_safety(self, pattern):
+        """编辑器中录入正则时做安全评估：灾难性回溯直接拒绝，存在风险时需确认"""
+        verdict, reason = check_regex_safety(pattern)
+        if verdict == 'reject':
+            print(f"❌ 拒绝该正则: {reason}")
+            return False
+        if verdict == 'warn':
+            print(f"⚠️ 性能风险: {reason}")
+            return input("仍要使用此正则? (y/n): ").lower() == 'y'
+        return True
+
+    def edit_config(self):
+        print("\n⚙️ 配置编辑器")
+        print("="*60)
+        sections = list(self.config.sections())
+        for i, section in enumerate(sections, 1):
+            print(f"{i}. {section}")
+        while True:
+            try:
+                choice = input("\n选择要编辑的配置部分 (1-{}，q退出): ".format(len(sections)))
+                if choice.lower() == 'q':
+                    break
+                section_idx = int(choice) - 1
+                if 0 <= section_idx < len(sections):
+                    section = sections[section_idx]
+                    self._edit_section(section)
+                else:
+                    print("⚠️ 无效选择")
+            except ValueError:
+                print("⚠️ 请输入数字或q退出")
+
+    def _confirm_continue(self, prompt):
+        if self.debug and self.interactive:
+            choice = input(f"{prompt} (y/n): ").lower()
+            return choice == 'y'
+        return True
+
+    def connect_qbittorrent(self, only=None):
+        """连接配置中的实例（only 指定时只连接该实例）"""
+        logger.debug("🔌 尝试连接qBittorrent")
+        if not self._confirm_continue("继续连接qBittorrent?"):
+            return False
+        if self.replay is None and not self.config['QBITTORRENT']['username'] and self.interactive:
+            self.setup_credentials()
+        instances = self.settings.instances
+        if self.replay is not None:
+            # 回放时以录制中的实例为准，沿用同名实例的并发设置
+            configured = {inst.name: inst for inst in instances}
+            instances = [configured.get(name) or InstanceConfig(name, 'replay', '', '') for name in self.replay]
+        instances = [inst for inst in instances if only in (None, inst.name)]
+        if not instances:
+            print(f"❌ 未找到实例配置: {only}")
+            return False
+        with ThreadPoolExecutor(max_workers=len(instances)) as pool:
+            futures = {pool.submit(self._connect_instance, inst): inst for inst in instances}
+        self.clients = {}
+        for future, inst in futures.items():
+            try:
+                self.clients[inst.name] = future.result()
+                logger.debug("✅ 连接成功: %s (%s)", inst.name, inst.host)
+            except Exception as e:
+                print(f"❌ 连接失败: {e}" if len(instances) == 1 else f"❌ 实例 {inst.name} ({inst.host}) 连接失败: {e}")
+        if not self.clients:
+            return False
+        if len(instances) > 1:
+            print(f"🖥️ 已连接实例: {', '.join(self.clients)} ({len(self.clients)}/{len(instances)})")
+        self.client = next(iter(self.clients.values()))
+        return True
+
+    def _connect_instance(self, instance):
+        """连接单个实例：每个实例有独立的连接池、请求超时与并发上限"""
+        if self.replay is not None:
+            raw_client = self.replay[instance.name]
+        elif Client is None:
+            raise ImportError("需要安装依赖: pip install qbittorrent-api")
+        else:
+            raw_client = Client(
+                host=instance.host,
+                username=instance.username,
+                password=instance.password,
+                REQUESTS_ARGS={'timeout': (instance.connect_timeout, instance.request_timeout)},
+                HTTPADAPTER_ARGS={'pool_connections': 1, 'pool_maxsize': instance.max_concurrency}
+            )
+            if self.recorder is not None:
+                raw_client = self.recorder.wrap(raw_client, instance.name)
+        client = InstrumentedClient(raw_client, self.metrics, instance.name, instance.max_concurrency,
+                                    self.settings.adaptive_concurrency, self.settings.api_cache_ttl)
+        client.auth_log_in()
+        return client
+
+    def setup_credentials(self):
+        """设置qBittorrent连接凭据"""
+        print("\n⚙️ 首次运行配置向导")
+        print("="*60)
+        
+        # 显示当前配置
+        print("\n📋 当前qBittorrent配置:")
+        print(f"🌐 WebUI地址: {self.config['QBITTORRENT'].get('host', '未设置')}")
+        print(f"👤 用户名: {self.config['QBITTORRENT'].get('username', '未设置')}")
+        print(f"🔑 密码: {'*' * len(self.config['QBITTORRENT'].get('password', '')) if self.config['QBITTORRENT'].get('password') else '未设置'}")
+        
+        # 获取用户输入
+        print("\n🛠️ 请输入以下信息:")
+        self.config['QBITTORRENT']['host'] = input("🌐 WebUI地址 (默认localhost:8080): ") or 'localhost:8080'
+        self.config['QBITTORRENT']['username'] = input("👤 用户名: ").strip()
+        self.config['QBITTORRENT']['password'] = input("🔑 密码: ").strip()
+        
+        # 保存配置
+        self.save_config()
+        print("\n✅ 配置已保存！")
+
+    def select_mode(self):
+        modes = [
+            {'id': 'direct', 'name': '直接模式', 'desc': '直接通过qBittorrent API重命名文件', 'warning': '⚠️ 直接修改qBittorrent中的文件（高风险）', 'emoji': '⚡'},
+            {'id': 'copy', 'name': '复制模式', 'desc': '复制文件到工作目录并重命名', 'warning': '✅ 安全模式，不影响原文件', 'emoji': '📋'},
+            {'id': 'move', 'name': '移动模式', 'desc': '移动文件到工作目录并重命名', 'warning': '⚠️ 原文件将被移动到新位置', 'emoji': '🚚'},
+            {'id': 'pre', 'name': '试运行模式', 'desc': '仅预览重命名效果，不实际操作', 'warning': '✅ 安全模式，仅显示结果', 'emoji': '👀'}
+        ]
+        print("\n🔧 请选择操作模式:")
+        for i, mode in enumerate(modes, 1):
+            print(f"{i}. {mode['emoji']} {mode['name']}")
+            print(f"   {mode['desc']}")
+            print(f"   {mode['warning']}\n")
+        
+        default_mode = self.settings.default_mode
+        if self.settings.dry_run_first:
+            default_mode = 'pre'
+        
+        while True:
+            choice = input(f"选择模式 (1-{len(modes)}, 默认 {default_mode}): ").strip().lower()
+            if not choice:
+                choice = default_mode
+                break
+            elif choice.isdigit() and 1 <= int(choice) <= len(modes):
+                choice = modes[int(choice)-1]['id']
+                break
+            elif choice in [m['id'] for m in modes]:
+                break
+            print("⚠️ 无效选择，请重新输入")
+        
+        self.config['SETTINGS']['default_mode'] = choice
+        self.save_config()
+        return choice
+
+    def _display_file_tree(self, files, max_depth=1):
+        """显示文件目录树结构（最终修正版）
+        
+        参数:
+            files: 文件列表，每个元素是包含'name'和'progress'的字典
+            max_depth: 最大显示深度
+        """
+        file_tree = {}
+        
+        # 收集所有唯一路径
+        path_items = set()
+        for f in files:
+            if f.get('progress', 0) >= 1:  # 只处理完成的文件
+                path = Path(f['name'])
+                parts = path.parts[:max_depth + 1]  # 限制深度
+                path_items.add(tuple(parts))  # 使用元组保证可哈希
+        
+        # 构建树形结构
+        for parts in sorted(path_items):
+            current_level = file_tree
+            for i, part in enumerate(parts):
+                if i == len(parts) - 1 and i >= max_depth:
+                    # 文件层级
+                    if 'files' not in current_level:
+                        current_level['files'] = []
+                    current_level['files'].append(part)
+                else:
+                    # 目录层级
+                    if part not in current_level:
+                        current_level[part] = {}
+                    current_level = current_level[part]
+        
+        def _print_tree(node, prefix='', is_last=True):
+            """递归打印树结构"""
+            # 打印目录
+            dirs = [(k, v) for k, v in node.items() if k != 'files']
+            for i, (name, child) in enumerate(dirs):
+                last = i == len(dirs) - 1 and 'files' not in node
+                print(f"{prefix}{'└── ' if last else '├── '}{name}")
+                _print_tree(child, f"{prefix}{'    ' if last else '│   '}", last)
+            
+            # 打印文件
+            if 'files' in node:
+                files = node['files']
+                for i, name in enumerate(files):
+                    print(f"{prefix}{'└── ' if i == len(files)-1 else '├── '}{name}")
+        
+        print(f"\n📂 文件目录结构预览 (最大深度: {max_depth}):")
+        print(".")  # 根目录
+        _print_tree(file_tree)
+
+    def _report_duplicates(self, dropped):
+        """输出重复发布的取舍结果"""
+        if not dropped:
+            return
+        print(f"\n🧹 重复发布: 跳过 {len(dropped)} 个文件 (策略: {self.settings.duplicate_policy})")
+        for src, dst, winner in dropped:
+            print(f"  ⏭️ {Path(src).name} → 保留 {Path(winner).name} ({Path(dst).name})")
+
+    def _report_pairing(self, pairing):
+        """输出字幕配对结果"""
+        orphan_subs = pairing['orphan_subs']
+        lonely_videos = pairing['videos_without_subs']
+        if not (pairing['paired'] or orphan_subs):
+            return
+        print(f"🔗 字幕配对: 已配对 {pairing['paired']} | 孤立字幕 {len(orphan_subs)} | 无字幕视频 {len(lonely_videos)}")
+        for name in orphan_subs:
+            print(f"  ⚠️ 孤立字幕: {name}")
+        for name in lonely_videos:
+            print(f"  ℹ️ 无字幕视频: {name}")
+
+    def _prompt_params(self, scope, suggested_prefix, subgroup_enabled, suggested_subgroup="", remembered=None,
+                       suggested_season=""):
+        """询问一组命名参数（字幕组/前缀/季号/自定义标识）
+
+        remembered 为剧集记忆中的参数：作为各项默认值，开启 series_memory_auto 时直接套用。
+        suggested_season 为从名称推断的季号，优先于记忆中的季号作为默认值。
+        """
+        if remembered:
+            print(f"🧠 已记忆参数: 前缀 {remembered['prefix']} | 季号 S{remembered['season']}"
+                  + (f" | 自定义标识 {remembered['custom']}" if remembered['custom'] else "")
+                  + (f" | 字幕组 {remembered['subgroup']}" if remembered['subgroup'] else ""))
+            if self.settings.series_memory_auto:
+                return dict(remembered, season=suggested_season or remembered['season'],
+                            subgroup=remembered['subgroup'] if subgroup_enabled else "")
+            suggested_prefix = remembered['prefix'] or suggested_prefix
+            suggested_subgroup = remembered['subgroup'] or suggested_subgroup
+        default_season = suggested_season or (remembered or {}).get('season') or '01'
+        default_custom = (remembered or {}).get('custom') or ''
+
+        subgroup = ""
+        if subgroup_enabled:
+            while True:
+                subgroup = self._input_subgroup(f"为此{scope}输入字幕组标记", suggested_subgroup)
+                if not subgroup or (len(subgroup) <= 20 and not any(c in r'\/:*?"<>|' for c in subgroup)):
+                    break
+                print("⚠️ 字幕组标记不能包含特殊字符且长度不超过20")
+
+        while True:
+            prefix = input(f"📌 输入此{scope}前缀 (建议: {suggested_prefix}, 留空使用建议): ").strip() or suggested_prefix
+            if len(prefix) <= 50:
+                break
+            print("⚠️ 前缀长度不能超过50字符")
+
+        while True:
+            season = (input(f"  输入此{scope}季号 (默认{default_season}): ").strip() or default_season).zfill(2)
+            if season.isdigit() and 0 <= int(season) <= 99:
+                break
+            print("⚠️ 请输入00-99之间的数字 (00 为特典)")
+
+        if default_custom:
+            custom = input(f"✍️ 自定义标识 (上次: {default_custom}, 留空沿用, 输入-清除): ").strip()[:20]
+            custom = "" if custom == '-' else (custom or default_custom)
+        else:
+            custom = input("✍️ 自定义标识 (如WEB-DL, 可选): ").strip()[:20]
+
+        return {'prefix': prefix, 'season': season, 'custom': custom, 'subgroup': subgroup}
+
+    def _remember_series(self, title, category, subgroup, params):
+        """写入剧集记忆（特典第 0 季不记忆，避免成为该剧集之后的默认季号）"""
+        if self.series_memory is None or not title or params.get('season') == '00':
+            return
+        try:
+            self.series_memory.remember(title, category, subgroup, params)
+        except sqlite3.Error as e:
+            logger.debug("⚠️ 剧集记忆保存失败: %s", e)
+
+    def _input_subgroup(self, prompt, suggested=""):
+        """输入字幕组标记；有建议值时留空使用建议，输入 - 表示不添加"""
+        if not suggested:
+            return input(f"{prompt} (留空则不添加): ").strip()
+        value = input(f"{prompt} (建议: {suggested}, 留空使用建议, 输入-不添加): ").strip()
+        if value == '-':
+            return ""
+        return value or suggested
+
+    def _open_digest_index(self, workspace):
+        """开启校验模式时加载工作目录的校验索引"""
+        if not self.settings.verify_copies:
+            return None
+        algorithm = self.settings.verify_algorithm
+        if algorithm not in hashlib.algorithms_available:
+            print(f"⚠️ 不支持的校验算法 {algorithm}，改用 blake2b")
+            algorithm = 'blake2b'
+        return DigestIndex(workspace, algorithm)
+
+    def _copy_file(self, src, dst, digests=None, record=True):
+        """复制文件；校验模式下复制时同步计算摘要并与目标文件比对，返回摘要（未校验时为 None）"""
+        if digests is None:
+            shutil.copy2(src, dst)
+            self.metrics.inc('bytes_copied_total', os.path.getsize(dst))
+            return None
+        digest = digests.new_hash()
+        self.metrics.inc('bytes_copied_total', copy_with_digest(src, dst, digest))
+        expected = digest.hexdigest()
+        actual = hash_file(dst, digests.algorithm)
+        if actual != expected:
+            os.remove(dst)
+            raise IOError(f"校验不一致 ({digests.algorithm}): 源 {expected[:16]}… ≠ 目标 {actual[:16]}…")
+        if record:
+            digests.record(dst, expected)
+        logger.debug("🔐 校验通过: %s (%s…)", Path(dst).name, expected[:16])
+        return expected
+
+    def _move_torrent(self, workspace, torrent_hash, moves, digests=None):
+        """以事务方式移动一个种子的全部文件（失败时自动回滚，源文件保持原样）"""
+        tx = MoveTransaction(workspace, torrent_hash)
+        tx.run(moves, lambda src, staged: self._copy_file(src, staged, digests, record=False))
+        if digests is not None:
+            for entry in tx.entries:
+                if entry['digest']:
+                    digests.record(entry['dst'], entry['digest'])
+
+    def _recover_transactions(self, workspace):
+        """恢复上次中断的移动事务"""
+        for name, action in MoveTransaction.recover(workspace):
+            print(f"♻️ 恢复中断的移动事务 {name}: {'已回滚' if action == 'rolled_back' else '已完成提交'}")
+
+    def _iter_torrents(self, tag, client=None):
+        """分页获取待处理种子的生成器
+
+        标签、完成状态与分类过滤在服务端完成；API 不支持排除标签，
+        已处理标签只能在客户端逐页过滤。
+        """
+        settings = self.settings
+        page_size = settings.page_size
+        filters = {'tag': tag, 'sort': 'added_on'}
+        if settings.completed_only:
+            filters['status_filter'] = 'completed'
+        if settings.default_category:
+            filters['category'] = settings.default_category
+        processed_tag = settings.processed_tag if settings.skip_processed else None
+        client = client or self.client
+
+        offset = 0
+        while True:
+            try:
+                page = client.torrents_info(limit=page_size, offset=offset, **filters)
+            except Exception as e:
+                print(f"❌ 获取种子列表失败: {e}")
+                if hasattr(e, 'response'):
+                    print(f"HTTP 错误详情: {e.response.text}")
+                return
+            logger.debug("📄 获取种子列表: 偏移 %s，本页 %s 个", offset, len(page))
+            for torrent in page:
+                if processed_tag and processed_tag in {t.strip() for t in torrent.tags.split(',')}:
+                    continue
+                self.metrics.inc('torrents_scanned_total')
+                yield torrent
+            if len(page) < page_size:
+                return
+            offset += page_size
+
+    def _iter_instance_torrents(self, tag):
+        """并发扫描所有已连接实例，按就绪顺序产出 (实例名, 种子, 文件列表, 异常)
+
+        每个实例由一个后台线程分页获取种子并预取文件列表，结果经有界队列交给交互流程；
+        响应慢的实例只会晚一些出现，不会阻塞其他实例。调用方提前结束时后台线程随之退出。
+        """
+        results = queue.Queue(maxsize=max(1, self.settings.page_size))
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce(name, client):
+            try:
+                for torrent in self._iter_torrents(tag, client):
+                    try:
+                        item = (name, torrent, client.torrents_files(torrent.hash), None)
+                    except Exception as e:
+                        item = (name, torrent, None, e)
+                    if not put(item):
+                        return
+            finally:
+                put(None)
+
+        for name, client in self.clients.items():
+            threading.Thread(target=produce, args=(name, client), daemon=True,
+                             name=f"qb-scan-{name}").start()
+        remaining = len(self.clients)
+        try:
+            while remaining:
+                item = results.get()
+                if item is None:
+                    remaining -= 1
+                    continue
+                yield item
+        finally:
+            stop.set()
+
+    def _report_skipped(self, skip_stats, scope="此种子"):
+        """输出被跳过文件的统计"""
+        if not any(skip_stats.values()):
+            return
+        print(f"⏭️ {scope}跳过文件: 排除目录 {skip_stats['excluded_dir']} 个 | "
+              f"忽略关键词 {skip_stats['keyword']} 个")
+
+    def _filter_reason(self, torrent):
+        """种子不满足 default_tag / default_category 时返回原因（与批量扫描的服务端过滤一致），否则返回 None"""
+        settings = self.settings
+        if settings.default_tag and settings.default_tag not in {t.strip() for t in torrent.get('tags', '').split(',')}:
+            return f"未带标签 {settings.default_tag}"
+        if settings.default_category and (torrent.get('category') or '') != settings.default_category:
+            return f"分类不是 {settings.default_category}"
+        return None
+
+    def plan_single_torrent(self, torrent_hash, instance='default'):
+        """非交互规划单个种子（不产生任何副作用）
+
+        只获取该种子的信息与文件列表，使用配置中的默认模式与工作目录交给 plan_torrent 规划；
+        不满足标签/分类过滤条件的种子不获取文件列表，计划中 filtered 为原因。
+        该种子的缓存响应每次都先丢弃，常驻服务不会沿用之前请求读到的旧状态。
+        无法规划时抛出 LookupError。
+        """
+        client = self.clients.get(instance)
+        if client is None:
+            raise LookupError(f"实例 {instance} 未连接")
+        settings = self.settings
+        mode = settings.default_mode if settings.default_mode in ('direct', 'copy', 'move', 'pre') else 'pre'
+        workspace = None
+        if mode in ('copy', 'move'):
+            if not settings.workspace:
+                raise LookupError("copy/move 模式需要在配置中设置 workspace")
+            workspace = Path(settings.workspace)
+
+        client.forget_torrent(torrent_hash)
+        try:
+            torrents = client.torrents_info(torrent_hashes=torrent_hash)
+        except Exception as e:
+            raise LookupError(f"获取种子信息失败: {e}") from e
+        if not torrents:
+            raise LookupError(f"未找到种子: {torrent_hash}")
+        torrent = torrents[0]
+        if reason := self._filter_reason(torrent):
+            plan = self.plan_torrent(torrent, [], mode, workspace, instance)
+            plan['filtered'] = reason
+            return plan
+        try:
+            files = client.torrents_files(torrent.hash)
+        except Exception as e:
+            raise LookupError(f"获取文件列表失败: {e}") from e
+
+        return self.plan_torrent(torrent, files, mode, workspace, instance)
+
+    def process_single_torrent(self, torrent_hash, instance='default'):
+        """非交互处理单个种子（供 qBittorrent "下载完成时运行外部程序" 调用，参数 %I）
+
+        规划后使用配置中的默认模式与工作目录执行并打标签。
+        返回: {'ok': 是否成功, 'success': 成功数, 'total': 操作数[, 'error': 原因][, 'skipped': filtered|processed]}
+        """
+        set_log_context(phase='plan', torrent=torrent_hash)
+        try:
+            plan = self.plan_single_torrent(torrent_hash, instance)
+        except LookupError as e:
+            print(f"❌ {e}")
+            return {'ok': False, 'success': 0, 'total': 0, 'error': str(e)}
+        torrent = plan['torrent']
+        if plan['filtered']:
+            print(f"⏭️ 种子不在处理范围内 ({plan['filtered']}): {torrent.name}")
+            return {'ok': True, 'success': 0, 'total': 0, 'skipped': 'filtered', 'reason': plan['filtered']}
+        if plan['already_processed']:
+            print(f"⏭️ 种子已处理: {torrent.name}")
+            return {'ok': True, 'success': 0, 'total': 0, 'skipped': 'processed'}
+
+        for entry in sorted(plan['entries'], key=lambda e: e['file']):
+            print(f"{'🎬' if entry['type'] == 'video' else '📝'} {Path(entry['file']).name} → {entry['new_name']}")
+        self._report_duplicates(plan['duplicates'])
+        if not plan['operations']:
+            print(f"⚠️ 没有生成任何操作: {torrent.name}")
+            return {'ok': True, 'success': 0, 'total': 0}
+        if plan['mode'] == 'pre':
+            print("👀 试运行模式，未执行任何操作")
+            return {'ok': True, 'success': 0, 'total': 0}
+
+        if plan['workspace'] is not None:
+            plan['workspace'].mkdir(parents=True, exist_ok=True)
+        summary = self.execute_operations([{
+            'instance': instance,
+            'hash': torrent.hash,
+            'name': torrent.name,
+            'save_path': torrent.save_path,
+            'sizes': {f.name: f.get('size', 0) for f in plan['files']},
+            'operations': plan['operations'],
+            'params': plan['params']
+        }], plan['mode'], plan['workspace'])
+        return {'ok': summary is not None, **(summary or {'success': 0, 'total': len(plan['operations'])})}
+
+    def process_torrents(self):
+        set_log_context(phase='plan', torrent=None)
+        logger.debug("🚀 开始处理种子")
+        for client in self.clients.values():
+            client.clear_cache()
+        if not self._confirm_continue("开始处理种子?"):
+            return
+
+        # 获取标签设置
+        default_tag = self.settings.default_tag
+        tag = input(f"\n🏷️ 要处理的标签 (默认 '{default_tag}', 留空退出): ").strip() or default_tag
+        if not tag:
+            logger.debug("⏹️ 用户退出")
+            return
+        
+        logger.debug("📌 使用正则模式列表: %s", self.settings.episode_regexes)
+
+        # 字幕组标记设置
+        subgroup_enabled = self.settings.subgroup_mode
+        subgroup_choice = input("\n是否启用字幕组标记? (y/n, 默认{}): ".format("是" if subgroup_enabled else "否")).lower()
+        subgroup_enabled = subgroup_choice in ('y', 'yes') if subgroup_choice else subgroup_enabled
+        self.config['SETTINGS']['subgroup_mode'] = 'true' if subgroup_enabled else 'false'
+
+        # 目录深度设置
+        max_depth = self.settings.max_dir_depth
+
+        if input(f"\n📂 当前最大目录扫描深度为 {max_depth}，是否修改？(y/n): ").lower() == 'y':
+            while True:
+                try:
+                    new_depth = int(input("请输入新的最大扫描深度 (1-5，推荐1-2): "))
+                    if 1 <= new_depth <= 5:
+                        max_depth = new_depth
+                        self.config['SETTINGS']['max_dir_depth'] = str(new_depth)
+                        self.save_config()
+                        print(f"✅ 已更新最大目录扫描深度为 {new_depth}")
+                        break
+                    print("⚠️ 请输入1-5之间的数字")
+                except ValueError:
+                    print("⚠️ 请输入有效的数字")
+
+        # 操作模式选择
+        mode = self.select_mode()
+        workspace = None
+
+        if mode in ('copy', 'move'):
+            while True:
+                workspace = input(f"📁 输入工作目录 (必须指定): ").strip()
+                if workspace:
+                    workspace = Path(workspace)
+                    try:
+                        workspace.mkdir(parents=True, exist_ok=True)
+                        break
+                    except Exception as e:
+                        print(f"❌ 无法创建工作目录: {e}")
+                        if input("是否重试? (y/n): ").lower() != 'y':
+                            return
+                else:
+                    print("⚠️ 工作目录不能为空")
+
+        # 获取排除目录与忽略关键词设置
+        excluded_dirs = self.settings.excluded_dirs
+        dir_excluder = self.settings.dir_excluder
+        ignore_matcher = self.settings.ignore_matcher
+        logger.debug("🚫 排除目录列表: %s", set(excluded_dirs))
+        logger.debug("🚫 忽略文件关键词: %s", ignore_matcher.pattern if ignore_matcher else '无')
+        total_skipped = Counter()
+
+        # 连接qBittorrent分页获取种子（边获取边处理）
+        logger.debug("🔍 扫描标签: %s", tag)
+        torrent_count = 0
+        all_operations = []
+        arranged_duplicates = []    # direct_layout=season 整理时按最终位置去除的重复发布
+        multi_instance = len(self.clients) > 1
+        for instance_name, torrent, files, error in self._iter_instance_torrents(tag):
+            set_log_context(torrent=torrent.hash)
+            torrent_count += 1
+            skip_stats = Counter()
+            print(f"\n🎬 发现种子: {torrent.name}")
+            if multi_instance:
+                print(f"🖥️ 实例: {instance_name}")
+            print(f"📂 保存路径: {torrent.save_path}")
+
+            if error is not None:
+                print(f"⚠️ 无法获取文件列表: {error}")
+                if input("是否继续处理下一个种子? (y/n): ").lower() != 'y':
+                    break
+                continue
+            print(f"📦 文件数量: {len(files)}")
+            self._display_file_tree(files, max_depth)
+        
+            if input("\n是否处理此种子? (y/n, 默认y): ").lower() not in ('', 'y', 'yes'):
+                continue
+            
+            deep_dirs, root_files = self._collect_torrent_dirs(files, max_depth, dir_excluder, skip_stats)
+
+            # 第一阶段：参数设置（仅当有深层目录时才跳过根目录设置）
+            # 种子名只解析一次，字幕组、前缀与季号建议都取自推断结果
+            torrent_hint = infer_series(torrent.name)
+            series_title = torrent_hint.title or torrent.name
+            suggested_prefix = torrent.category or (torrent_hint.title or torrent.name.strip())[:30]
+            params = self._prompt_params(
+                "种子", suggested_prefix, subgroup_enabled, torrent_hint.subgroup,
+                self._lookup_series(series_title, torrent.category, torrent_hint.subgroup),
+                torrent_hint.season
+            )
+            prefix, default_season = params['prefix'], params['season']
+            custom_str, current_subgroup = params['custom'], params['subgroup']
+
+            # 第二阶段：处理深层目录（按目录名推断参数，确认一次即可套用到全部目录）
+            planned_groups = []     # (目录, 参数, 操作)，确认后的各组
+            if deep_dirs:
+                print("\n🔍 发现深层目录，按目录名推断每个目录的参数")
+                dir_plans = []
+                for dir_path in sorted(deep_dirs.keys(), key=lambda x: str(x)):
+                    # 每个深层目录按目录名单独记忆
+                    hint = infer_series(dir_path.name)
+                    dir_title = self._dir_series_title(hint, series_title)
+                    dir_group = hint.subgroup or torrent_hint.subgroup
+                    remembered = self._lookup_series(dir_title, torrent.category, dir_group)
+                    inferred = self._infer_dir_params(hint, params, series_title, subgroup_enabled, remembered)
+                    dir_plans.append((dir_path, dir_title, dir_group, remembered, inferred))
+                    print(f"  📁 {dir_path} → {inferred['prefix']} S{inferred['season']}"
+                          + (f" | {inferred['custom']}" if inferred['custom'] else "")
+                          + (f" | [{inferred['subgroup']}]" if inferred['subgroup'] else ""))
+                use_inferred = input("\n使用以上推断参数? (y/n, 默认y, n 逐个设置): ").lower() in ('', 'y', 'yes')
+
+                for dir_path, dir_title, dir_group, remembered, inferred in dir_plans:
+                    if use_inferred:
+                        dir_params = inferred
+                    else:
+                        print(f"\n📁 正在设置目录: {dir_path}")
+                        dir_params = self._prompt_params(
+                            "目录", inferred['prefix'], subgroup_enabled, inferred['subgroup'],
+                            remembered, inferred['season']
+                        )
+                    dir_prefix, dir_season = dir_params['prefix'], dir_params['season']
+                    dir_custom, dir_subgroup = dir_params['custom'], dir_params['subgroup']
+
+                    # 处理目录文件
+                    operations, file_tree, pairing = self._plan_files(
+                        deep_dirs[dir_path]['files'], mode, workspace, dir_prefix, dir_season,
+                        dir_custom, dir_subgroup, skip_stats
+                    )
+                    
+                    if operations:
+                        print(f"\n🔍 目录 {dir_path} 重命名预览:")
+                        for filename, info in sorted(file_tree.items()):
+                            print(f"{'🎬' if info['type'] == 'video' else '📝'} {filename} → {info['new_name']}")
+                        self._report_pairing(pairing)
+                        
+                        if use_inferred or input("\n确认处理此目录? (y/n): ").lower() == 'y':
+                            planned_groups.append((dir_path, dir_params, operations))
+                            self._remember_series(dir_title, torrent.category, dir_group, dir_params)
+            
+            # 第三阶段：处理根目录文件（仅当没有深层目录时）
+            elif root_files:
+                print("\n🔍 未发现深层目录，处理根目录文件")
+                operations, file_tree, pairing = self._plan_files(
+                    root_files, mode, workspace, prefix, default_season,
+                    custom_str, current_subgroup, skip_stats
+                )
+                
+                if operations:
+                    print(f"\n🔍 根目录重命名预览:")
+                    for filename, info in sorted(file_tree.items()):
+                        print(f"{'🎬' if info['type'] == 'video' else '📝'} {filename} → {info['new_name']}")
+                    self._report_pairing(pairing)
+                    
+                    if input("\n确认处理根目录文件? (y/n): ").lower() == 'y':
+                        planned_groups.append((None, params, operations))
+                        self._remember_series(series_title, torrent.category, torrent_hint.subgroup, params)
+
+            self._report_skipped(skip_stats)
+            total_skipped.update(skip_stats)
+
+            processed_operations, layout_duplicates = self._arrange_direct_operations(mode, planned_groups, files)
+            arranged_duplicates.extend(layout_duplicates)
+            if processed_operations:
+                all_operations.append({
+                    'instance': instance_name,
+                    'hash': torrent.hash,
+                    'name': torrent.name,
+                    'save_path': torrent.save_path,
+                    'sizes': {f.name: f.get('size', 0) for f in files},
+                    'operations': processed_operations,
+                    'params': {
+                        'prefix': prefix,
+                        'season': default_season,
+                        'custom': custom_str,
+                        'subgroup': current_subgroup
+                    }
+                })
+
+        if not torrent_count:
+            print("⚠️ 没有找到可处理的种子")
+            return
+
+        if torrent_count > 1:
+            self._report_skipped(total_skipped, "全部种子")
+
+        if not all_operations:
+            print("⚠️ 没有生成任何操作")
+            return
+
+        self._report_duplicates(arranged_duplicates + self._drop_duplicate_releases(all_operations))
+        self.show_full_preview(all_operations, mode, subgroup_enabled)
+
+        if mode != 'pre' and input("\n⚠️ 确认执行以上操作? (y/n): ").lower() == 'y':
+            self.execute_operations(all_operations, mode, workspace)
+        else:
+            print("⏹️ 操作已取消")
+
+    def _init_io_scheduler(self):
+        """按配置创建设备感知 I/O 调度器"""
+        return IOScheduler(self.settings.ssd_io_streams, self.settings.hdd_io_streams, self.metrics)
+
+    def _build_io_jobs(self, all_operations, digests, workspace):
+        """将 copy/move 操作转换为 I/O 任务（源路径相对于种子保存路径）
+
+        copy 每个文件一个任务；move 每个种子一个事务任务，键为 (种子序号, None)。
+        """
+        jobs = []
+        for t_idx, torrent in enumerate(all_operations):
+            moves = []
+            for op_idx, (op_type, src, dst) in enumerate(torrent['operations']):
+                if op_type not in ('copy', 'move'):
+                    continue
+                src_path = Path(torrent['save_path']) / src
+                size = torrent.get('sizes', {}).get(src)
+                if size is None:
+                    try:
+                        size = os.path.getsize(src_path)
+                    except OSError:
+                        size = 0
+                if op_type == 'move':
+                    moves.append((src_path, dst, size))
+                    continue
+                jobs.append(IOJob(
+                    key=(t_idx, op_idx),
+                    fn=lambda s=src_path, d=dst: self._copy_file(s, d, digests),
+                    src=str(src_path), dst=dst, size=size, op_type=op_type
+                ))
+            if moves:
+                jobs.append(IOJob(
+                    key=(t_idx, None),
+                    fn=lambda h=torrent['hash'], m=[(s, d) for s, d, _ in moves]: self._move_torrent(
+                        workspace, h, m, digests),
+                    src=str(moves[0][0]), dst=moves[0][1], size=sum(size for _, _, size in moves), op_type='move'
+                ))
+        return jobs
+
+    def execute_operations(self, all_operations, mode, workspace):
+        """执行已确认的操作：copy/move 先做空间预检再按设备并发执行，API 操作按实例并发执行
+
+        返回: {'success': 成功数, 'total': 操作数}；空间预检失败时返回 None
+        """
+        set_log_context(phase='execute', torrent=None)
+        total_success = 0
+        digests = self._open_digest_index(workspace) if mode in ('copy', 'move') else None
+        io_results = {}
+        if mode in ('copy', 'move'):
+            if mode == 'move':
+                self._recover_transactions(workspace)
+            scheduler = self._init_io_scheduler()
+            jobs = self._build_io_jobs(all_operations, digests, workspace)
+            shortages = scheduler.check_free_space(jobs)
+            if shortages:
+                for path, needed, free in shortages:
+                    print(f"❌ 空间不足: {path} 需要 {needed / 1024**3:.2f} GB，可用 {free / 1024**3:.2f} GB")
+                print("⏹️ 未执行任何文件操作")
+                return None
+            file_count = sum(1 for t in all_operations for op in t['operations'] if op[0] in ('copy', 'move'))
+            print(f"\n💽 空间检查通过，共 {file_count} 个文件 / {sum(j.size for j in jobs) / 1024**3:.2f} GB")
+            io_results = scheduler.run(jobs)
+            # 移动事务的结果作用于该种子的全部移动操作
+            for (t_idx, op_idx), error in list(io_results.items()):
+                if op_idx is None:
+                    for i, (op_type, _, _) in enumerate(all_operations[t_idx]['operations']):
+                        if op_type == 'move':
+                            io_results[(t_idx, i)] = error
+
+        torrent_results = self._run_instance_tasks(all_operations, io_results)
+        instance_totals = {}
+        for t_idx, torrent in enumerate(all_operations):
+            print(f"\n🔄 处理: {torrent['name']}")
+            outcomes, tag_notes = torrent_results[t_idx]
+            for (op_type, src, dst), error in zip(torrent['operations'], outcomes):
+                if error is not None:
+                    print(f"❌ 操作失败 {src} → {error}")
+            for note in tag_notes:
+                print(note)
+
+            success = outcomes.count(None)
+            total_success += success
+            totals = instance_totals.setdefault(torrent.get('instance', 'default'), [0, 0])
+            totals[0] += success
+            totals[1] += len(outcomes)
+            print(f"✅ 完成: {success}/{len(torrent['operations'])}")
+
+        if len(instance_totals) > 1:
+            print("\n🖥️ 各实例结果:")
+            for name, (success, total) in instance_totals.items():
+                print(f"  {name}: {success}/{total}")
+
+        if digests:
+            try:
+                digests.save()
+                print(f"🔐 校验索引已更新: {digests.path}")
+            except OSError as e:
+                print(f"⚠️ 校验索引保存失败: {e}")
+        self._export_metrics()
+        print(f"\n🎉 全部完成! 成功处理 {total_success} 个文件")
+        return {'success': total_success, 'total': sum(len(t['operations']) for t in all_operations)}
+
+    def _run_instance_tasks(self, all_operations, io_results):
+        """按实例并发执行每个种子的 API 操作（重命名与标签更新）
+
+        每个实例有独立的线程池（大小为其并发上限），同一种子内的操作按顺序执行；
+        各实例互不等待，某个实例响应慢只影响它自己的种子。
+        返回: {种子序号: (各操作的异常或 None, 标签更新输出)}
+        """
+        limits = {inst.name: inst.max_concurrency for inst in self.settings.instances}
+        pools = {}
+        futures = {}
+        try:
+            for t_idx, torrent in enumerate(all_operations):
+                name = torrent.get('instance', 'default')
+                if name not in pools:
+                    pools[name] = ThreadPoolExecutor(max_workers=limits.get(name, 1),
+                                                     thread_name_prefix=f"qb-exec-{name}")
+                futures[t_idx] = pools[name].submit(self._execute_torrent, t_idx, torrent, io_results)
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True)
+        return {t_idx: future.result() for t_idx, future in futures.items()}
+
+    def _execute_torrent(self, t_idx, torrent, io_results):
+        """执行单个种子的操作（在所属实例的线程池中运行，输出由调用方统一打印）"""
+        set_log_context(phase='execute', torrent=torrent['hash'])
+        client = self.clients.get(torrent.get('instance'), self.client)
+        outcomes = []
+        for op_idx, (op_type, src, dst) in enumerate(torrent['operations']):
+            try:
+                if op_type in ('copy', 'move'):
+                    if error := io_results.get((t_idx, op_idx)):
+                        raise error
+                elif op_type == 'rename':
+                    client.torrents_rename_file(torrent_hash=torrent['hash'], old_path=src, new_path=dst)
+                elif op_type == 'rename_folder':
+                    client.torrents_rename_folder(torrent_hash=torrent['hash'], old_path=src, new_path=dst)
+                outcomes.append(None)
+                self.metrics.inc('file_operations_total', op=op_type, result='success')
+                logger.debug("✅ 成功: %s → %s", src, dst)
+            except Exception as e:
+                outcomes.append(e)
+                self.metrics.inc('file_operations_total', op=op_type, result='failure')
+                logger.debug("操作失败: %s → %s", src, dst, exc_info=e)
+
+        tag_notes = []
+        if None in outcomes and self.settings.auto_tag_processed:
+            tag_notes = self._tag_processed(torrent['hash'], client)
+        return outcomes, tag_notes
+
+    def _start_metrics_server(self):
+        """配置了 metrics_port 时启动本地 /metrics 端点"""
+        if not self.settings.metrics_port:
+            return None
+        try:
+            server = self.metrics.serve(self.settings.metrics_port)
+            print(f"📈 指标端点: http://127.0.0.1:{self.settings.metrics_port}/metrics")
+            return server
+        except OSError as e:
+            print(f"⚠️ 无法启动指标端点: {e}")
+            return None
+
+    def _export_metrics(self):
+        """配置了 metrics_textfile 时写出当前指标"""
+        if not self.settings.metrics_textfile:
+            return
+        try:
+            self.metrics.write_textfile(self.settings.metrics_textfile)
+            logger.debug("📈 指标已写入: %s", self.settings.metrics_textfile)
+        except OSError as e:
+            print(f"⚠️ 指标文件写入失败: {e}")
+
+    def _tag_processed(self, torrent_hash, client=None):
+        """移除待处理标签并添加已处理标签，返回需输出的提示行"""
+        old_tag = self.settings.default_tag
+        new_tag = self.settings.processed_tag
+        client = client or self.client
+        notes = []
+        
+        try:
+            current_tags = client.torrents_info(torrent_hashes=torrent_hash)[0].tags.split(', ')
+            
+            if old_tag and old_tag in current_tags:
+                client.torrents_remove_tags(torrent_hashes=torrent_hash, tags=[old_tag])
+            
+            if new_tag not in current_tags:
+                client.torrents_add_tags(torrent_hashes=torrent_hash, tags=[new_tag])
+                
+            notes.append(f"🏷️ 标签更新: 移除 {old_tag} → 添加 {new_tag}")
+            
+            updated = client.torrents_info(torrent_hashes=torrent_hash)[0]
+            notes.append(f"🔍 当前标签: {updated.tags}")
+            
+        except Exception as e:
+            notes.append(f"⚠️ 标签更新失败: {str(e)}")
+            if hasattr(e, 'response'):
+                notes.append(f"HTTP 错误详情: {e.response.text}")
+        return notes
+        
+    def show_full_preview(self, all_operations, mode, subgroup_enabled=False):
+        mode_names = {
+            'direct': '⚡ 直接模式',
+            'copy': '📋 复制模式',
+            'move': '🚚 移动模式',
+            'pre': '👀 试运行模式'
+        }
+        
+        print(f"\n🔎 完整操作预览 ({mode_names.get(mode, mode)})")
+        print("="*80)
+        print(f"🔍 使用的集数匹配正则: {self.settings.episode_regexes}")
+        if subgroup_enabled:
+            print(f"🔖 字幕组标记功能已启用")
+        print("="*80)
+        
+        total_stats = {
+            'torrents': len(all_operations),
+            'videos': 0,
+            'subs': 0,
+            'total': 0,
+            'dirs': 0
+        }
+        
+        for torrent in all_operations:
+            print(f"\n📌 种子: {torrent['name']}")
+            if len(self.clients) > 1:
+                print(f"├─ 🖥️ 实例: {torrent.get('instance', 'default')}")
+            print(f"├─ 📂 路径: {torrent.get('path', '根目录')}")
+            # 修正参数访问路径
+            print(f"├─ 🔤 前缀: {torrent['params']['prefix']}")  # 正确访问方式
+            print(f"├─ 🏷️ 季号: S{torrent['params']['season']}")
+            if subgroup_enabled and torrent['params'].get('subgroup'):
+                print(f"├─ 🔖 字幕组: {torrent['params']['subgroup']}")
+            if torrent['params'].get('custom'):
+                print(f"├─ ✍️ 自定义标识: {torrent['params']['custom']}")
+            
+            folder_ops = [op for op in torrent['operations'] if op[0] == 'rename_folder']
+            for _, src, dst in folder_ops:
+                print(f"├─ 📁 目录: {src} → {dst}")
+
+            stats = {'videos': 0, 'subs': 0}
+            for op in torrent['operations']:
+                ext = Path(op[1]).suffix.lower()
+                if ext in self.settings.video_exts:
+                    stats['videos'] += 1
+                elif ext in self.settings.sub_exts:
+                    stats['subs'] += 1
+            
+            total_stats['videos'] += stats['videos']
+            total_stats['subs'] += stats['subs']
+            total_stats['total'] += stats['videos'] + stats['subs']
+            total_stats['dirs'] += 1
+            
+            print(f"├─ 🎬 视频: {stats['videos']} | 📝 字幕: {stats['subs']} | 📦 总计: {stats['videos'] + stats['subs']}")
+            print(f"└─ 🔧 操作类型: {mode_names.get(mode, mode)}")
+
+        print("\n📊 全局统计:")
+        if len(self.clients) > 1:
+            print(f"• 🖥️ 实例数: {len({t.get('instance', 'default') for t in all_operations})}")
+        print(f"• 🏷️ 总种子数: {total_stats['torrents']}")
+        print(f"• 📂 总目录数: {total_stats['dirs']}")
+        print(f"• 🎬 总视频文件: {total_stats['videos']}")
+        print(f"• 📝 总字幕文件: {total_stats['subs']}")
+        print(f"• 📦 总文件数: {total_stats['total']}")
+        print("="*80)
+
+    def run(self):
+        print("\n🎬 qBittorrent文件整理工具 v12.8")
+        print(f"📝 配置文件: {CONFIG['CONFIG_FILE']}")
+        print("="*60)
+        
+        # 显示当前配置
+        print("\n📋 当前主要配置:")
+        print(f"🌐 WebUI地址: {self.config['QBITTORRENT'].get('host', '未设置')}")
+        print(f"👤 用户名: {self.config['QBITTORRENT'].get('username', '未设置')}")
+        print(f"🔑 密码: {'*' * len(self.config['QBITTORRENT'].get('password', '')) if self.config['QBITTORRENT'].get('password') else '未设置'}")
+        
+        config_action = input("\n是否查看/编辑当前配置? (v查看/e编辑/回车跳过): ").lower()
+        if config_action == 'v':
+            self.show_config()
+        elif config_action == 'e':
+            self.edit_config()
+        
+        if not self.connect_qbittorrent():
+            return
+
+        metrics_server = self._start_metrics_server()
+        try:
+            while True:
+                self.process_torrents()
+                if not self._confirm_continue("\n是否继续处理其他标签?"):
+                    break
+        except KeyboardInterrupt:
+            print("\n🛑 用户中断操作")
+        except Exception as e:
+            print(f"❌ 发生错误: {e}")
+            logger.debug("未处理的异常", exc_info=True)
+        finally:
+            for client in self.clients.values():
+                try:
+                    client.auth_log_out()
+                except:
+                    pass
+            if self.series_memory:
+                self.series_memory.close()
+            self._export_metrics()
+            if metrics_server:
+                metrics_server.shutdown()
+            print("\n✅ 程序退出")
+
+class RenamerService:
+    """常驻规划服务：保持已编译规则与已登录客户端常驻，通过本地 HTTP 提供 JSON API
+
+    GET  /health              实例连接状态
+    GET  /metrics             Prometheus 指标
+    POST /plan     {hash, instance?}                 种子将被重命名成什么（无副作用）
+    POST /preview  {names, prefix?, season?, custom?, subgroup?}  按当前规则渲染任意文件名
+    POST /execute  {hash, instance?}                 规划并执行（与 --torrent 相同）
+    POST /reload                                     重新加载配置
+
+    规划请求并发处理；执行请求串行化，避免同时进行的文件操作互相争用。
+    每次 /plan 与 /execute 都重新读取该种子的信息与文件列表，不使用之前请求缓存的响应。
+    """
+
+    MAX_BODY = 1024 * 1024
+
+    def __init__(self, renamer):
+        self.renamer = renamer
+        self._execute_lock = threading.Lock()
+
+    def plan(self, payload):
+        renamer = self.renamer
+        plan = renamer.plan_single_torrent(payload['hash'], payload.get('instance', 'default'))
+        torrent = plan['torrent']
+        return {
+            'hash': torrent.hash,
+            'name': torrent.name,
+            'mode': plan['mode'],
+            'already_processed': plan['already_processed'],
+            'filtered': plan['filtered'],
+            'params': plan['params'],
+            'files': sorted(plan['entries'], key=lambda e: e['file']),
+            'duplicates': [{'file': src, 'target': str(dst), 'kept': winner} for src, dst, winner in plan['duplicates']],
+            'operations': [[op, str(src), str(dst)] for op, src, dst in plan['operations']]
+        }
+
+    def preview(self, payload):
+        names = payload.get('names')
+        if not isinstance(names, list) or not names:
+            raise ValueError("names 必须是非空列表")
+        season = str(payload.get('season') or '01').zfill(2)
+        files = [{'name': name} for name in names]
+        _, file_tree, pairing = self.renamer._plan_files(
+            files, 'pre', None, payload.get('prefix', ''), season,
+            payload.get('custom', ''), payload.get('subgroup', ''), Counter()
+        )
+        return {
+            'files': [{'file': info['original_path'], 'new_name': info['new_name'], 'type': info['type']}
+                      for info in file_tree.values()],
+            'pairing': pairing
+        }
+
+    def execute(self, payload):
+        with self._execute_lock:
+            return self.renamer.process_single_torrent(payload['hash'], payload.get('instance', 'default'))
+
+    def reload(self, payload):
+        self.renamer.load_config()
+        return {'ok': True}
+
+    def health(self):
+        return {'status': 'ok', 'instances': list(self.renamer.clients)}
+
+    def dispatch(self, method, path, payload):
+        """返回 (HTTP 状态码, 响应对象)"""
+        routes = {'/plan': self.plan, '/preview': self.preview, '/execute': self.execute, '/reload': self.reload}
+        if method == 'GET' and path == '/health':
+            return 200, self.health()
+        if method != 'POST' or path not in routes:
+            return 404, {'error': f"未知接口: {method} {path}"}
+        try:
+            return 200, routes[path](payload)
+        except KeyError as e:
+            return 400, {'error': f"缺少参数: {e}"}
+        except (LookupError, ValueError) as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            logger.debug("服务请求出错: %s", path, exc_info=True)
+            return 500, {'error': str(e)}
+
+    def serve(self, port, host='127.0.0.1'):
+        """启动服务并阻塞，直到 Ctrl+C"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, body, content_type='application/json; charset=utf-8'):
+                data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/metrics':
+                    self._reply(200, service.renamer.metrics.render().encode('utf-8'),
+                                'text/plain; version=0.0.4; charset=utf-8')
+                    return
+                self._reply(*service.dispatch('GET', path, {}))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length > service.MAX_BODY:
+                    self._reply(413, {'error': '请求体过大'})
+                    return
+                try:
+                    payload = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    self._reply(400, {'error': '请求体不是有效的 JSON'})
+                    return
+                if not isinstance(payload, dict):
+                    self._reply(400, {'error': '请求体必须是 JSON 对象'})
+                    return
+                self._reply(*service.dispatch('POST', self.path.split('?')[0], payload))
+
+            def log_message(self, format, *args):
+                logger.debug("🌐 %s " + format, self.address_string(), *args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        print(f"🛰️ 规划服务已启动: http://{host}:{port} (Ctrl+C 停止)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\n🛑 服务停止")
+        finally:
+            server.server_close()
+
+
+def delegate_to_service(port, torrent_hash, instance, timeout, connect_timeout=0.3):
+    """若本机规划服务在运行，把 --torrent 请求交给它执行；服务不可用时返回 None
+
+    请求已发出后等待超过 timeout 秒时返回失败结果而不是 None：服务可能仍会执行，
+    不能再回退到本地处理同一个种子。
+    """
+    import socket
+    import urllib.error
+    import urllib.request
+    try:
+        # 先快速探测端口，服务未运行时立即回退到本地处理
+        socket.create_connection(('127.0.0.1', port), timeout=connect_timeout).close()
+    except OSError:
+        return None
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/execute",
+        data=json.dumps({'hash': torrent_hash, 'instance': instance}).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except (socket.timeout, TimeoutError):
+        return {'ok': False, 'error': f"等待规划服务超过 {timeout} 秒"}
+    except urllib.error.HTTPError as e:
+        try:
+            return {'ok': False, **json.loads(e.read())}
+        except ValueError:
+            return None
+    except urllib.error.URLError as e:
+        if isinstance(e.reason, (socket.timeout, TimeoutError)):
+            return {'ok': False, 'error': f"等待规划服务超过 {timeout} 秒"}
+        return None
+    except (OSError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='🎬 qBittorrent文件整理工具')
+    parser.add_argument('--debug', action='store_true', help='🐛 启用调试模式')
+    parser.add_argument('--config', help='📂 指定配置文件路径')
+    parser.add_argument('--log-json', metavar='PATH', help='📜 将结构化日志以 JSON Lines 写入文件 (覆盖配置中的 log_file)')
+    parser.add_argument('--torrent', metavar='HASH', help='⚡ 非交互处理单个种子 (用于qBittorrent"下载完成时运行外部程序"，传入 %%I)')
+    parser.add_argument('--instance', default='default', help='🖥️ 与 --torrent 配合，指定种子所在实例 (默认主实例)')
+    parser.add_argument('--serve', action='store_true', help='🛰️ 以常驻服务模式运行，在本地端口提供规划/预览/执行 JSON API')
+    parser.add_argument('--port', type=int, default=None, help='🛰️ 服务端口 (默认使用配置中的 service_port)')
+    parser.add_argument('--record', metavar='FILE', help='⏺️ 把本次的 API 调用与响应录制到回放文件 (不含凭据)')
+    parser.add_argument('--replay', metavar='FILE', help='⏯️ 不连接 qBittorrent，使用回放文件中的响应运行 (用于离线复现与性能分析)')
+    parser.add_argument('--replay-latency', choices=('recorded', 'zero'), default='recorded',
+                        help='⏯️ 回放时按录制耗时等待 (recorded) 或立即返回 (zero)')
+    parser.add_argument('--verify', metavar='WORKSPACE', help='🔐 增量复查工作目录中已记录校验值的文件')
+    parser.add_argument('--recover', metavar='WORKSPACE', help='♻️ 恢复工作目录中中断的移动事务后退出')
+    parser.add_argument('--verify-limit', type=int, default=None, help='🔐 本次最多复查的文件数 (默认全部)')
+    args = parser.parse_args()
+    
+    if args.config:
+        CONFIG['CONFIG_FILE'] = args.config
+
+    if args.recover:
+        recovered = MoveTransaction.recover(args.recover)
+        for name, action in recovered:
+            print(f"♻️ {name}: {'已回滚' if action == 'rolled_back' else '已完成提交'}")
+        print(f"✅ 已处理 {len(recovered)} 个中断的移动事务")
+        sys.exit(0)
+
+    if args.verify:
+        index = DigestIndex(args.verify)
+        if not index.entries:
+            print(f"⚠️ 未找到校验索引: {index.path}")
+            sys.exit(1)
+        checked, mismatched, missing = index.reverify(args.verify_limit)
+        index.save()
+        print(f"🔐 已复查 {checked}/{len(index.entries)} 个文件 | 不一致 {len(mismatched)} | 缺失 {len(missing)}")
+        for name in mismatched:
+            print(f"  ❌ 校验不一致: {name}")
+        for name in missing:
+            print(f"  ⚠️ 文件缺失: {name}")
+        sys.exit(1 if mismatched or missing else 0)
+
+    session = {}
+    if args.replay:
+        try:
+            session['replay'] = ReplayClient.load(args.replay, args.replay_latency)
+        except (OSError, ValueError) as e:
+            print(f"❌ 无法读取回放文件: {e}")
+            sys.exit(1)
+    elif args.record:
+        session['recorder'] = SessionRecorder(args.record)
+
+    def close_session():
+        if 'recorder' in session:
+            session['recorder'].close()
+            print(f"⏺️ 已录制 {session['recorder'].calls} 次 API 调用: {args.record}")
+    
+    if args.torrent:
+        # 规划服务在运行时直接交给它处理，省去登录与初始化
+        service_config = configparser.ConfigParser(interpolation=None)
+        try:
+            service_config.read(CONFIG['CONFIG_FILE'], encoding='utf-8')
+        except configparser.Error as e:
+            print(f"⚠️ 配置读取错误，规划服务使用默认设置: {e}")
+            service_config = configparser.ConfigParser(interpolation=None)
+        service_settings = service_config['SETTINGS'] if service_config.has_section('SETTINGS') else {}
+        service_port = args.port or parse_int_setting(service_settings, 'service_port', '8766', minimum=0)
+        service_timeout = parse_int_setting(service_settings, 'service_timeout', '300')
+        if service_port and not session and (result := delegate_to_service(
+                service_port, args.torrent, args.instance, service_timeout)) is not None:
+            print(f"🛰️ 已交由规划服务处理: 成功 {result.get('success', 0)}/{result.get('total', 0)}"
+                  + (f" ({result['error']})" if result.get('error') else ""))
+            sys.exit(0 if result.get('ok') else 1)
+
+        renamer = QBitRenamer(debug=args.debug, log_json=args.log_json, interactive=False, **session)
+        ok = (renamer.connect_qbittorrent(only=args.instance)
+              and renamer.process_single_torrent(args.torrent, args.instance)['ok'])
+        if renamer.series_memory:
+            renamer.series_memory.close()
+        for client in renamer.clients.values():
+            try:
+                client.auth_log_out()
+            except Exception:
+                pass
+        close_session()
+        sys.exit(0 if ok else 1)
+
+    if args.serve:
+        renamer = QBitRenamer(debug=args.debug, log_json=args.log_json, interactive=False, **session)
+        if not renamer.connect_qbittorrent():
+            sys.exit(1)
+        metrics_server = renamer._start_metrics_server()
+        try:
+            RenamerService(renamer).serve(args.port or renamer.settings.service_port or 8766)
+        finally:
+            if metrics_server:
+                metrics_server.shutdown()
+            if renamer.series_memory:
+                renamer.series_memory.close()
+            for client in renamer.clients.values():
+                try:
+                    client.auth_log_out()
+                except Exception:
+                    pass
+            close_session()
+        sys.exit(0)
+
+    try:
+        QBitRenamer(debug=args.debug, log_json=args.log_json, **session).run()
+    except ImportError as e:
+        print(f"❌ 需要安装依赖: pip install qbittorrent-api\n{e}")
+    finally:
+        close_session()
\ No newline at end of file